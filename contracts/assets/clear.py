@@ -1,26 +1,50 @@
+import sys
+
 from pyteal import *
 
-from helpers.state import GlobalState, LocalState
+from helpers.parse import parse_args
+from helpers.schema import state_var
+from helpers.state import StateCache
 
 
-def clear():
-    GLOBAL_LIQ_TOKENS = GlobalState("LIQ")
-    ALGOS_BALANCE = GlobalState("A")
-    TOKENS_BALANCE = GlobalState("B")
-    ALGOS_TO_WITHDRAW = LocalState("USR_A")
-    TOKENS_TO_WITHDRAW = LocalState("USR_B")
-    USR_LIQ_TOKENS = LocalState("USR_LIQ")
+def clear(packed_state: bool = False):
+    # The pending withdrawals of the user go back to the pool and the
+    # liquidity tokens of the user are no longer counted, the keys are those
+    # of state.py. The price sums of pools built with twap are not updated
+    # first, see helpers/twap.py
+    if packed_state:
+        reserves = state_var("reserves")
+        total_liquidity_tokens = reserves.field("L")
+        a_balance = reserves.field("A")
+        b_balance = reserves.field("B")
+    else:
+        total_liquidity_tokens = state_var("total_liquidity_tokens")
+        a_balance = state_var("a_balance")
+        b_balance = state_var("b_balance")
+    a_to_withdraw = state_var("a_to_withdraw")
+    b_to_withdraw = state_var("b_to_withdraw")
+    user_liquidity_tokens = state_var("user_liquidity_tokens")
 
-    return Seq(
-        [
-            GLOBAL_LIQ_TOKENS.put(
-                GLOBAL_LIQ_TOKENS.get() - USR_LIQ_TOKENS.get()
+    def ops():
+        return [
+            total_liquidity_tokens.put(
+                total_liquidity_tokens.get() - user_liquidity_tokens.get()
             ),
-            ALGOS_BALANCE.put(ALGOS_BALANCE.get() + ALGOS_TO_WITHDRAW.get()),
-            TOKENS_BALANCE.put(TOKENS_BALANCE.get() + TOKENS_TO_WITHDRAW.get()),
+            a_balance.put(a_balance.get() + a_to_withdraw.get()),
+            b_balance.put(b_balance.get() + b_to_withdraw.get()),
         ]
-    )
+
+    # Packed reserves are read once and written back once
+    body = StateCache(*reserves.fields.values()).wrap(ops) if packed_state else ops()
+    # The writes are discarded unless the program approves
+    return Seq(body + [Return(Int(1))])
 
 
 if __name__ == "__main__":
-    print(compileTeal(clear(), Mode.Application))
+    params = {"packed_state": False}
+
+    # Overwrite params if sys.argv[1] is passed
+    if len(sys.argv) > 1:
+        params = parse_args(sys.argv[1], params)
+
+    print(compileTeal(clear(bool(params["packed_state"])), Mode.Application))
@@ -2,22 +2,24 @@ import sys
 
 from pyteal import *
 
+from helpers.checks import AssertAll
+from helpers.optimize import optimize
 from helpers.parse import parse_args
 
 
-def escrow(app_id: int):
+def escrow(app_id: int, settle_swaps: bool = False):
+    # Conditions are listed from the most likely to reject a group which
+    # does not belong to the pool, AssertAll stops at the first failing one
     on_asset_opt_in = Seq(
         [
-            Assert(
-                And(
-                    Gtxn[1].close_remainder_to() == Global.zero_address(),
-                    Gtxn[1].rekey_to() == Global.zero_address(),
-                    Gtxn[0].application_id() == Int(app_id),
-                    Gtxn[0].type_enum() == TxnType.ApplicationCall,
-                    Gtxn[0].application_args[0] == Bytes("E"),
-                    Gtxn[1].type_enum() == TxnType.AssetTransfer,
-                    Gtxn[1].asset_amount() == Int(0),
-                )
+            AssertAll(
+                Gtxn[0].application_id() == Int(app_id),
+                Gtxn[0].type_enum() == TxnType.ApplicationCall,
+                Gtxn[0].application_args[0] == Bytes("E"),
+                Gtxn[1].type_enum() == TxnType.AssetTransfer,
+                Gtxn[1].asset_amount() == Int(0),
+                Gtxn[1].close_remainder_to() == Global.zero_address(),
+                Gtxn[1].rekey_to() == Global.zero_address(),
             ),
             Return(Int(1)),
         ]
@@ -25,29 +27,59 @@ def escrow(app_id: int):
 
     on_withdraw = Seq(
         [
-            Assert(
-                And(
-                    Gtxn[1].close_remainder_to() == Global.zero_address(),
-                    Gtxn[1].rekey_to() == Global.zero_address(),
-                    Gtxn[2].close_remainder_to() == Global.zero_address(),
-                    Gtxn[2].rekey_to() == Global.zero_address(),
-                    Gtxn[0].application_id() == Int(app_id),
-                    Gtxn[0].type_enum() == TxnType.ApplicationCall,
-                    Gtxn[0].application_args[0] == Bytes("W"),
-                    Gtxn[1].type_enum() == TxnType.AssetTransfer,
-                    Or(
+            AssertAll(
+                Gtxn[0].application_id() == Int(app_id),
+                Gtxn[0].type_enum() == TxnType.ApplicationCall,
+                Gtxn[0].application_args[0] == Bytes("W"),
+                Gtxn[1].type_enum() == TxnType.AssetTransfer,
+                Gtxn[3].type_enum() == TxnType.Payment,
+                Gtxn[3].sender() == Gtxn[0].sender(),
+                Gtxn[1].close_remainder_to() == Global.zero_address(),
+                Gtxn[1].asset_close_to() == Global.zero_address(),
+                Gtxn[1].rekey_to() == Global.zero_address(),
+                Gtxn[2].close_remainder_to() == Global.zero_address(),
+                Gtxn[2].asset_close_to() == Global.zero_address(),
+                Gtxn[2].rekey_to() == Global.zero_address(),
+                Gtxn[3].amount() >= (Gtxn[1].fee() + Gtxn[2].fee()),
+                Or(
+                    Gtxn[2].type_enum() == TxnType.Payment,
+                    Gtxn[2].type_enum() == TxnType.AssetTransfer,
+                ),
+                Or(
+                    Gtxn[1].asset_amount() > Int(0),
+                    Gtxn[2].amount() > Int(0),
+                    Gtxn[2].asset_amount() > Int(0),
+                ),
+            ),
+            Return(Int(1)),
+        ]
+    )
+
+    # Payout of a swap settled in the same group (contract built with
+    # settle_swaps), the escrow signs only the payout to the caller
+    on_swap = Seq(
+        [
+            AssertAll(
+                Gtxn[0].application_id() == Int(app_id),
+                Gtxn[0].type_enum() == TxnType.ApplicationCall,
+                Txn.group_index() == Int(2),
+                Or(
+                    And(
                         Gtxn[2].type_enum() == TxnType.Payment,
-                        Gtxn[2].type_enum() == TxnType.AssetTransfer,
+                        Gtxn[2].receiver() == Gtxn[0].sender(),
                     ),
-                    Or(
-                        Gtxn[1].asset_amount() > Int(0),
-                        Gtxn[2].amount() > Int(0),
-                        Gtxn[2].asset_amount() > Int(0),
+                    And(
+                        Gtxn[2].type_enum() == TxnType.AssetTransfer,
+                        Gtxn[2].asset_receiver() == Gtxn[0].sender(),
                     ),
-                    Gtxn[3].sender() == Gtxn[0].sender(),
-                    Gtxn[3].type_enum() == TxnType.Payment,
-                    Gtxn[3].amount() >= (Gtxn[1].fee() + Gtxn[2].fee()),
-                )
+                ),
+                Gtxn[3].type_enum() == TxnType.Payment,
+                Gtxn[3].sender() == Gtxn[0].sender(),
+                Gtxn[3].receiver() == Gtxn[2].sender(),
+                Gtxn[3].amount() >= Gtxn[2].fee(),
+                Gtxn[2].close_remainder_to() == Global.zero_address(),
+                Gtxn[2].asset_close_to() == Global.zero_address(),
+                Gtxn[2].rekey_to() == Global.zero_address(),
             ),
             Return(Int(1)),
         ]
@@ -55,44 +87,60 @@ def escrow(app_id: int):
 
     on_withdraw_liquidity = Seq(
         [
-            Assert(
-                And(
-                    Gtxn[0].type_enum() == TxnType.ApplicationCall,
-                    Gtxn[1].close_remainder_to() == Global.zero_address(),
-                    Gtxn[1].rekey_to() == Global.zero_address(),
-                    Gtxn[0].application_id() == Int(app_id),
-                    Gtxn[0].type_enum() == TxnType.ApplicationCall,
-                    Gtxn[0].application_args[0] == Bytes("X"),
-                    Gtxn[1].type_enum() == TxnType.AssetTransfer,
-                    Gtxn[1].asset_amount() > Int(0),
-                    Gtxn[2].sender() == Gtxn[0].sender(),
-                    Gtxn[2].type_enum() == TxnType.Payment,
-                    Gtxn[2].amount() >= Gtxn[1].fee(),
-                )
+            AssertAll(
+                Gtxn[0].application_id() == Int(app_id),
+                Gtxn[0].type_enum() == TxnType.ApplicationCall,
+                Gtxn[0].application_args[0] == Bytes("X"),
+                Gtxn[1].type_enum() == TxnType.AssetTransfer,
+                Gtxn[1].asset_amount() > Int(0),
+                Gtxn[2].type_enum() == TxnType.Payment,
+                Gtxn[2].sender() == Gtxn[0].sender(),
+                Gtxn[2].amount() >= Gtxn[1].fee(),
+                Gtxn[1].close_remainder_to() == Global.zero_address(),
+                Gtxn[1].asset_close_to() == Global.zero_address(),
+                Gtxn[1].rekey_to() == Global.zero_address(),
             ),
             Return(Int(1)),
         ]
     )
 
+    branches = [[Global.group_size() == Int(2), on_asset_opt_in]]
+    if settle_swaps:
+        # Only pools built with settle_swaps pay out swaps in the same group
+        branches.append(
+            [
+                And(
+                    Global.group_size() == Int(4),
+                    Gtxn[0].application_args[0] == Bytes("S"),
+                ),
+                on_swap,
+            ]
+        )
     return Cond(
-        [Global.group_size() == Int(2), on_asset_opt_in],
+        *branches,
         [Global.group_size() == Int(4), on_withdraw],
         [Global.group_size() == Int(3), on_withdraw_liquidity],
     )
 
 
+DEFAULT_PARAMS = {"app_id": 123, "settle_swaps": False, "optimize": False}
+
+
+def compile_escrow(params: dict, out=None) -> str:
+    teal = compileTeal(
+        escrow(int(params["app_id"]), bool(params["settle_swaps"])), Mode.Signature
+    )
+    if params["optimize"]:
+        teal = optimize(teal, out)
+    return teal
+
+
 if __name__ == "__main__":
-    params = {"app_id": 123}
+    params = dict(DEFAULT_PARAMS)
 
     # Overwrite params if sys.argv[1] is passed
     if len(sys.argv) > 1:
         params = parse_args(sys.argv[1], params)
 
-    print(
-        compileTeal(
-            escrow(
-                int(params["app_id"]),
-            ),
-            Mode.Signature,
-        )
-    )
+    # The optimizer reports to stderr, algob reads the program from stdout
+    print(compile_escrow(params, sys.stderr))
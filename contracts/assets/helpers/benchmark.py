@@ -0,0 +1,411 @@
+"""
+Cost regression benchmark of the pool programs, run without algod.
+
+Every contract type is compiled with each set of options in VARIANTS, the
+size and constant blocks of the state, escrow and clear programs are
+recorded together with the opcode cost of every handler on representative
+groups evaluated by helpers.interpreter. The results are compared with the
+baseline in test/costs.yaml:
+
+    cd assets && python -m helpers.benchmark
+    cd assets && python -m helpers.benchmark "{update: true}"
+
+The run fails when a value grows by more than ``threshold`` (relative to the
+baseline), or whenever a program is larger than its size limit or its
+static cost is over its budget. Variants whose programs can not be deployed are
+reported without evaluating their handlers. Pass ``update: true`` to write
+the current results as the new baseline.
+"""
+import hashlib
+import os
+import sys
+
+import yaml
+
+from helpers.interpreter import (
+    MAX_APP_PROGRAM_COST,
+    MAX_LOGICSIG_COST,
+    ON_COMPLETION,
+    TXN_TYPES,
+    Ledger,
+    Program,
+    evaluate_group,
+)
+from helpers.parse import parse_args
+
+ASSETS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE = os.path.join(os.path.dirname(ASSETS_DIR), "test", "costs.yaml")
+
+MAX_APP_PROGRAM_SIZE = 1024
+MAX_LOGICSIG_SIZE = 1000
+
+SIZE_LIMITS = {
+    "state": MAX_APP_PROGRAM_SIZE,
+    "escrow": MAX_LOGICSIG_SIZE,
+    "clear": MAX_APP_PROGRAM_SIZE,
+}
+# TEAL v2 checks the static cost of the whole program against the budget
+BUDGETS = {
+    "state": MAX_APP_PROGRAM_COST,
+    "escrow": MAX_LOGICSIG_COST,
+    "clear": MAX_APP_PROGRAM_COST,
+}
+
+TYPES = ("ALGOS_TO_ASA", "ASA_TO_ASA")
+VARIANTS = {
+    "default": {},
+    "packed_state": {"packed_state": True},
+    "settle_swaps": {"settle_swaps": True},
+    # Every variant has to fit within the limits of TEAL v2 for both types
+    "direct_math": {"direct_math": True},
+    "wide_math": {"direct_math": True, "wide_math": "S", "optimize": True},
+    "fail_fast": {"fail_fast": True, "optimize": True},
+    "twap": {"twap": True, "optimize": True},
+    "limits": {"limits": True, "optimize": True},
+    "optimize": {"optimize": True},
+}
+
+SECONDARY, PRIMARY, LIQUIDITY = 123, 111, 555
+
+
+def program_stats(program: Program) -> dict:
+    ints, byte_values, _ = program.constants()
+    return {
+        "bytes": program.size,
+        "cost": program.static_cost,
+        "ints": len(ints),
+        "byte_strings": len(byte_values),
+    }
+
+
+class Pool:
+    """
+    A pool on an in-memory ledger, with builders of the groups sent to it.
+    ``create`` deploys the compiled programs, ``run`` evaluates a group,
+    which has to be approved, and records the cost of its application call
+    and escrow transactions.
+    """
+
+    def __init__(self, params: dict, approval: Program = None, app_id: int = 1):
+        from clear import clear
+        from escrow import compile_escrow
+        from pyteal import Mode, compileTeal
+        from state import ExchangeType, compile_state
+
+        self.asa = params["type"] == ExchangeType.ASA_TO_ASA
+        self.ledger = Ledger()
+        self.approval = approval or Program(compile_state(params))
+        self.clear = Program(
+            compileTeal(clear(bool(params["packed_state"])), Mode.Application)
+        )
+        self.creator, self.master, self.swapper, self.idle = (
+            bytes([index]) * 32 for index in range(1, 5)
+        )
+        self.costs = {}
+
+        # The app_id the pool gets once created, which the escrow is bound to
+        self.ledger.next_app_id = self.app_id = app_id
+        self.lsig = Program(
+            compile_escrow(
+                {
+                    "app_id": self.app_id,
+                    "settle_swaps": params["settle_swaps"],
+                    "optimize": params["optimize"],
+                }
+            ),
+            "Signature",
+        )
+        self.escrow = hashlib.new(
+            "sha512_256", b"Program" + self.lsig.bytecode()
+        ).digest()
+
+    def programs(self) -> dict:
+        return {"state": self.approval, "escrow": self.lsig, "clear": self.clear}
+
+    def create(self):
+        args = [SECONDARY] + ([PRIMARY] if self.asa else []) + [LIQUIDITY]
+        create = self.call(self.creator, *args)
+        create.update(
+            ApplicationID=0,
+            ApprovalProgram=self.approval,
+            ClearStateProgram=self.clear,
+        )
+        self.run("create", [create])
+
+    def run(self, name: str, group: list):
+        results = evaluate_group(group, self.ledger)
+        for index, (txn, result) in enumerate(zip(group, results)):
+            evaluated = (
+                txn.get("LogicSig") is not None or txn["TypeEnum"] == TXN_TYPES["appl"]
+            )
+            if evaluated and (result is None or not result.approved):
+                raise RuntimeError(f"{name}: transaction {index} rejected, {result}")
+        for txn, result in zip(group, results):
+            if txn.get("LogicSig") is not None:
+                self.costs.setdefault(f"escrow {name}", result.cost)
+            elif txn["TypeEnum"] == TXN_TYPES["appl"]:
+                self.costs[name] = result.cost
+
+    def local(self, address: bytes, key: bytes) -> int:
+        return self.ledger.local_state[(address, self.app_id)].get(key, 0)
+
+    def call(self, sender: bytes, *args, on_completion: str = "NoOp") -> dict:
+        return {
+            "TypeEnum": TXN_TYPES["appl"],
+            "Sender": sender,
+            "ApplicationID": getattr(self, "app_id", 0),
+            "ApplicationArgs": [
+                arg if isinstance(arg, bytes) else arg.to_bytes(8, "big")
+                for arg in args
+            ],
+            "OnCompletion": ON_COMPLETION[on_completion],
+        }
+
+    def asset(self, sender, asset, amount, receiver=None) -> dict:
+        txn = {
+            "TypeEnum": TXN_TYPES["axfer"],
+            "Sender": sender,
+            "XferAsset": asset,
+            "AssetReceiver": receiver or self.escrow,
+            "AssetAmount": amount,
+        }
+        if sender == self.escrow:
+            txn.update(Fee=1000, LogicSig=self.lsig)
+        return txn
+
+    def algos(self, sender, amount, receiver=None) -> dict:
+        txn = {
+            "TypeEnum": TXN_TYPES["pay"],
+            "Sender": sender,
+            "Receiver": receiver or self.escrow,
+            "Amount": amount,
+        }
+        if sender == self.escrow:
+            txn.update(Fee=1000, LogicSig=self.lsig)
+        return txn
+
+    def primary(self, sender, amount, receiver=None) -> dict:
+        if self.asa:
+            return self.asset(sender, PRIMARY, amount, receiver)
+        return self.algos(sender, amount, receiver)
+
+    def secondary(self, sender, amount, receiver=None) -> dict:
+        return self.asset(sender, SECONDARY, amount, receiver)
+
+
+def measure(params: dict, approval: Program = None) -> dict:
+    """
+    Sizes of the programs and costs of every handler of a pool built with
+    ``params``, or with the given approval program. The handlers of
+    programs which can not be deployed are not evaluated.
+    """
+    pool = Pool(params, approval)
+    programs = {
+        name: program_stats(program) for name, program in pool.programs().items()
+    }
+    if any(limit_errors(name, stats) for name, stats in programs.items()):
+        return {"programs": programs, "costs": {}}
+    pool.create()
+    settle_swaps = bool(params["settle_swaps"])
+
+    pool.run(
+        "E",
+        [
+            pool.call(pool.creator, b"E"),
+            pool.asset(pool.escrow, SECONDARY, 0, pool.escrow),
+        ],
+    )
+    update = pool.call(pool.creator, b"U", on_completion="UpdateApplication")
+    update["Accounts"] = [pool.escrow]
+    pool.run("U", [update])
+    for user in (pool.master, pool.swapper, pool.idle):
+        pool.run("OptIn", [pool.call(user, on_completion="OptIn")])
+
+    add = [pool.call(pool.master, b"A")]
+    pool.run(
+        "A (first)",
+        add
+        + [pool.secondary(pool.master, 6000000), pool.primary(pool.master, 7000000)],
+    )
+    pool.run(
+        "A",
+        add + [pool.secondary(pool.master, 600000), pool.primary(pool.master, 700000)],
+    )
+
+    # The least outputs accepted are only checked with limits
+    swap = pool.call(pool.swapper, b"S", 1)
+    if settle_swaps:
+        # The payout may be less than the swap is worth
+        fee = pool.algos(pool.swapper, 1000)
+        pool.run(
+            "S (primary in)",
+            [
+                swap,
+                pool.primary(pool.swapper, 1000000),
+                pool.secondary(pool.escrow, 1, pool.swapper),
+                fee,
+            ],
+        )
+        pool.run(
+            "S (secondary in)",
+            [
+                swap,
+                pool.secondary(pool.swapper, 1000000),
+                pool.primary(pool.escrow, 1, pool.swapper),
+                fee,
+            ],
+        )
+    else:
+        pool.run("S (primary in)", [swap, pool.primary(pool.swapper, 1000000)])
+        pool.run("S (secondary in)", [swap, pool.secondary(pool.swapper, 1000000)])
+
+    pool.run("R", [pool.call(pool.master, b"R", 1000000, 1, 1)])
+    pool.run(
+        "W",
+        [
+            pool.call(pool.master, b"W"),
+            pool.secondary(pool.escrow, pool.local(pool.master, b"2"), pool.master),
+            pool.primary(pool.escrow, pool.local(pool.master, b"1"), pool.master),
+            pool.algos(pool.master, 2000),
+        ],
+    )
+    pool.run(
+        "X",
+        [
+            pool.call(pool.master, b"X"),
+            pool.asset(pool.escrow, LIQUIDITY, 1000000, pool.master),
+            pool.algos(pool.master, 1000),
+        ],
+    )
+    pool.run(
+        "Y", [pool.call(pool.master, b"Y"), pool.asset(pool.master, LIQUIDITY, 1000000)]
+    )
+    pool.run("CloseOut", [pool.call(pool.idle, on_completion="CloseOut")])
+    pool.run("clear", [pool.call(pool.swapper, on_completion="ClearState")])
+
+    return {"programs": programs, "costs": pool.costs}
+
+
+def limit_errors(program: str, stats: dict) -> list:
+    """
+    Limits of TEAL v2 which the program exceeds, as (metric, limit) pairs.
+    """
+    errors = []
+    if stats["bytes"] > SIZE_LIMITS[program]:
+        errors.append(("bytes", SIZE_LIMITS[program]))
+    if stats["cost"] > BUDGETS[program]:
+        errors.append(("cost", BUDGETS[program]))
+    return errors
+
+
+def benchmark(types=TYPES, variants=VARIANTS) -> dict:
+    from state import DEFAULT_PARAMS
+
+    results = {}
+    for type_ in types:
+        for variant, options in variants.items():
+            params = {**DEFAULT_PARAMS, **options, "type": type_}
+            results[f"{type_} {variant}"] = measure(params)
+    return results
+
+
+def compare(baseline: dict, results: dict, threshold: float) -> list:
+    """
+    Regressions of ``results`` against ``baseline`` as (run, metric, before,
+    after) tuples, ``before`` is None for programs over a limit. The
+    handlers of runs which can not be deployed are not compared.
+    """
+    regressions = []
+    undeployable = set()
+    for run, result in results.items():
+        for program, stats in result["programs"].items():
+            for metric, limit in limit_errors(program, stats):
+                undeployable.add(run)
+                regressions.append(
+                    (run, f"{program} {metric} over {limit}", None, stats[metric])
+                )
+        old = baseline.get(run)
+        if old is None:
+            continue
+        for program, stats in result["programs"].items():
+            old_stats = old["programs"].get(program, {})
+            for metric, value in stats.items():
+                before = old_stats.get(metric)
+                if before is not None and value > before * (1 + threshold):
+                    regressions.append((run, f"{program} {metric}", before, value))
+        for handler, cost in result["costs"].items():
+            before = old["costs"].get(handler)
+            if before is not None and cost > before * (1 + threshold):
+                regressions.append((run, f"cost {handler}", before, cost))
+    for run, old in baseline.items():
+        if run in undeployable:
+            continue
+        result = results.get(run)
+        missing = set(old["costs"]) - set(result["costs"]) if result else ["run"]
+        regressions.extend(
+            (run, f"missing {name}", None, None) for name in sorted(missing)
+        )
+    return regressions
+
+
+def changes(baseline: dict, results: dict) -> list:
+    """
+    Every value which differs from the baseline, as (run, metric, before,
+    after) tuples.
+    """
+    rows = []
+    for run, result in results.items():
+        old = baseline.get(run, {"programs": {}, "costs": {}})
+        for program, stats in result["programs"].items():
+            for metric, value in stats.items():
+                before = old["programs"].get(program, {}).get(metric)
+                if before != value:
+                    rows.append((run, f"{program} {metric}", before, value))
+        for handler, cost in result["costs"].items():
+            before = old["costs"].get(handler)
+            if before != cost:
+                rows.append((run, f"cost {handler}", before, cost))
+    return rows
+
+
+def report(rows: list, out=sys.stdout):
+    print(f"{'run':<28}{'metric':<36}{'before':>8}{'after':>8}", file=out)
+    for run, metric, before, after in rows:
+        before = "-" if before is None else before
+        after = "-" if after is None else after
+        print(f"{run:<28}{metric:<36}{before:>8}{after:>8}", file=out)
+
+
+if __name__ == "__main__":
+    params = {
+        "baseline": BASELINE,
+        "threshold": 0.01,
+        "update": False,
+    }
+
+    # Overwrite params if sys.argv[1] is passed
+    if len(sys.argv) > 1:
+        params = parse_args(sys.argv[1], params)
+
+    results = benchmark()
+    if params["update"]:
+        with open(params["baseline"], "w") as f:
+            yaml.safe_dump(results, f)
+        print(f"Baseline written to {params['baseline']}")
+        sys.exit(0)
+    if not os.path.exists(params["baseline"]):
+        print(f"No baseline at {params['baseline']}, run with \"{{update: true}}\"")
+        sys.exit(1)
+
+    with open(params["baseline"]) as f:
+        baseline = yaml.safe_load(f) or {}
+    rows = changes(baseline, results)
+    if rows:
+        report(rows)
+
+    regressions = compare(baseline, results, float(params["threshold"]))
+    if regressions:
+        print(f"\n{len(regressions)} regressions beyond {params['threshold']:.0%}:")
+        report(regressions)
+        sys.exit(1)
+    print(f"{len(results)} runs, no regressions beyond {params['threshold']:.0%}")
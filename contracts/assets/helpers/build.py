@@ -0,0 +1,207 @@
+"""
+Compiles the programs of many pools in a single run.
+
+algob starts a new Python process, which imports pyteal again, for every
+program it compiles. A build manifest lists the pools instead, each entry
+taking the parameters of state.py and the app_id of the pool's escrow:
+
+    - {type: ALGOS_TO_ASA, ratio_decimal_points: 1000000, fee_pct: 3, app_id: 14104138}
+    - {type: ASA_TO_ASA, fee_pct: 3, name: usdt-usdc}
+
+Programs are compiled in a process pool and cached under a hash of the
+contract sources and their own parameters, like the ``srcHash`` kept by
+algob. Pools sharing parameters compile their approval program once and an
+unchanged pool is not compiled again.
+"""
+import functools
+import hashlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import yaml
+
+from helpers.parse import parse_args
+
+ASSETS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BUILD_DIR = os.path.join(os.path.dirname(ASSETS_DIR), "artifacts", "build")
+
+
+def source_hash(directory: str = ASSETS_DIR) -> str:
+    """
+    Hash of every Python source the programs are compiled from.
+    """
+    digest = hashlib.sha256()
+    for root, dirs, files in os.walk(directory):
+        dirs[:] = sorted(d for d in dirs if d != "__pycache__")
+        for name in sorted(files):
+            if not name.endswith(".py"):
+                continue
+            path = os.path.join(root, name)
+            digest.update(os.path.relpath(path, directory).encode())
+            with open(path, "rb") as f:
+                digest.update(f.read())
+    return digest.hexdigest()
+
+
+def default_pool() -> dict:
+    from state import DEFAULT_PARAMS
+
+    return {**DEFAULT_PARAMS, "app_id": None, "name": None}
+
+
+def pool_name(pool: dict) -> str:
+    if pool["name"]:
+        return str(pool["name"])
+    return "{}-{}-{}-{}".format(
+        pool["type"], pool["ratio_decimal_points"], pool["fee_pct"], pool["app_id"]
+    ).lower()
+
+
+def pool_programs(pool: dict) -> dict:
+    """
+    Parameters of each program of a pool, the escrow is only built once the
+    pool has an app_id.
+    """
+    from state import DEFAULT_PARAMS
+
+    programs = {"state": {key: pool[key] for key in DEFAULT_PARAMS}}
+    if pool["app_id"] is not None:
+        programs["escrow"] = {
+            "app_id": int(pool["app_id"]),
+            "settle_swaps": bool(pool["settle_swaps"]),
+            "optimize": bool(pool["optimize"]),
+        }
+    programs["clear"] = {"packed_state": bool(pool["packed_state"])}
+    return programs
+
+
+def program_key(src_hash: str, program: str, params: dict) -> str:
+    payload = json.dumps([src_hash, program, params], sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()[:32]
+
+
+def compile_program(job) -> str:
+    program, params = job
+    if program == "state":
+        from state import compile_state
+
+        return compile_state(params)
+    if program == "escrow":
+        try:
+            # Only the app_id differs between the escrows of the pools
+            template = escrow_template(params["optimize"], params["settle_swaps"])
+            return template.teal(params["app_id"])
+        except ValueError:
+            from escrow import compile_escrow
+
+            return compile_escrow(params)
+    if program == "clear":
+        from clear import clear
+        from pyteal import Mode, compileTeal
+
+        return compileTeal(clear(params["packed_state"]), Mode.Application)
+    raise ValueError(f"Unknown program {program}")
+
+
+@functools.lru_cache(maxsize=None)
+def escrow_template(optimize: bool, settle_swaps: bool):
+    from helpers.template import compile_template
+
+    return compile_template(optimize, settle_swaps)
+
+
+def escrow_address(params: dict, teal: str) -> str:
+    try:
+        template = escrow_template(params["optimize"], params["settle_swaps"])
+        return template.address(params["app_id"])
+    except ValueError:
+        from helpers.interpreter import Program, encode_address
+
+        program = b"Program" + Program(teal, "Signature").bytecode()
+        return encode_address(hashlib.new("sha512_256", program).digest())
+
+
+def build(pools: list, out_dir: str = BUILD_DIR, jobs: int = None) -> dict:
+    """
+    Compiles the programs of every pool into ``out_dir/<name>/<program>.teal``
+    and describes them in ``out_dir/manifest.yaml``. Returns the number of
+    compiled and cached programs.
+    """
+    src_hash = source_hash()
+    cache_dir = os.path.join(out_dir, "cache")
+    os.makedirs(cache_dir, exist_ok=True)
+
+    artifacts = {}  # name -> (pool, {program: key})
+    pending = {}  # key -> (program, params)
+    cached = set()
+    for pool in pools:
+        name = pool_name(pool)
+        if name in artifacts:
+            raise ValueError(f"Duplicate pool name {name}, set a name for it")
+        keys = {}
+        for program, params in pool_programs(pool).items():
+            key = keys[program] = program_key(src_hash, program, params)
+            if os.path.exists(os.path.join(cache_dir, f"{key}.teal")):
+                cached.add(key)
+            else:
+                pending[key] = (program, params)
+        artifacts[name] = (pool, keys)
+
+    if len(pending) > 1 and jobs != 1:
+        with ProcessPoolExecutor(jobs) as executor:
+            compiled = list(executor.map(compile_program, pending.values()))
+    else:
+        compiled = [compile_program(job) for job in pending.values()]
+    for key, teal in zip(pending, compiled):
+        # Same as the output of running the contract file
+        write(os.path.join(cache_dir, f"{key}.teal"), teal + "\n")
+
+    manifest = {"srcHash": src_hash, "pools": []}
+    for name, (pool, keys) in artifacts.items():
+        entry = {"name": name, "params": pool, "programs": {}}
+        for program, key in keys.items():
+            path = os.path.join(name, f"{program}.teal")
+            with open(os.path.join(cache_dir, f"{key}.teal")) as f:
+                teal = f.read()
+            write(os.path.join(out_dir, path), teal)
+            entry["programs"][program] = {"file": path, "hash": key}
+            if program == "escrow":
+                params = pool_programs(pool)["escrow"]
+                entry["programs"][program]["address"] = escrow_address(params, teal)
+        manifest["pools"].append(entry)
+    write(os.path.join(out_dir, "manifest.yaml"), yaml.safe_dump(manifest))
+    return {"compiled": len(pending), "cached": len(cached)}
+
+
+def write(path: str, content: str):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(content)
+
+
+if __name__ == "__main__":
+    params = {"out": BUILD_DIR, "jobs": None}
+
+    # The manifest is passed as sys.argv[1], either inline or as a file
+    manifest = sys.argv[1]
+    if os.path.isfile(manifest):
+        with open(manifest) as f:
+            manifest = f.read()
+    pools = parse_args(manifest, default_pool())
+    if isinstance(pools, dict):
+        pools = [pools]
+
+    # Overwrite params if sys.argv[2] is passed
+    if len(sys.argv) > 2:
+        params = parse_args(sys.argv[2], params)
+
+    start = time.perf_counter()
+    counts = build(pools, params["out"], params["jobs"])
+    print(
+        f"{len(pools)} pools: compiled {counts['compiled']}, "
+        f"cached {counts['cached']} programs "
+        f"in {time.perf_counter() - start:.2f}s"
+    )
@@ -0,0 +1,93 @@
+from pyteal import *
+from pyteal.ast.naryexpr import NaryExpr
+from pyteal.types import require_type
+
+
+class AssertAll(Expr):
+    """
+    Asserts each condition in turn and rejects at the first one that fails.
+
+    An ``Assert(And(...))`` evaluates every condition before it can reject,
+    here each condition branches to a shared ``err`` instead. A passing call
+    costs the same, the ``bz`` after each condition replacing its ``&&``,
+    for 2 more bytes per condition.
+
+    Nested ``And`` conditions are flattened and duplicates removed. The
+    conditions are checked from the cheapest to the most expensive, those of
+    equal cost in the given order, so list the most likely rejections first.
+    Without ``fail_fast`` the remaining conditions are asserted together in
+    the given order, like ``Assert(And(...))``.
+    """
+
+    def __init__(self, *conditions: Expr, fail_fast: bool = True):
+        super().__init__()
+        self.conditions = []
+        for condition in flatten_and(conditions):
+            require_type(condition.type_of(), TealType.uint64)
+            self.conditions.append(condition)
+        self.fail_fast = fail_fast
+
+    def __teal__(self, options):
+        checks = []
+        for condition in self.conditions:
+            ops = condition_ops(condition, options)
+            if ops not in (ops_ for ops_, _ in checks):
+                checks.append((ops, condition))
+        if not self.fail_fast:
+            conditions = [condition for _, condition in checks]
+            if len(conditions) == 1:
+                return Assert(conditions[0]).__teal__(options)
+            return Assert(And(*conditions)).__teal__(options)
+        checks.sort(key=lambda check: len(check[0]))
+
+        err = TealSimpleBlock([TealOp(self, Op.err)])
+        start = end = None
+        for _, condition in checks:
+            condition_start, condition_end = condition.__teal__(options)
+            branch = TealConditionalBlock([])
+            branch.setFalseBlock(err)
+            condition_end.setNextBlock(branch)
+            if end is None:
+                start = condition_start
+            else:
+                end.setTrueBlock(condition_start)
+            end = branch
+        passed = TealSimpleBlock([])
+        end.setTrueBlock(passed)
+        return start, passed
+
+    def __str__(self):
+        return "(AssertAll {})".format(" ".join(map(str, self.conditions)))
+
+    def type_of(self):
+        return TealType.none
+
+
+def flatten_and(conditions) -> list:
+    flat = []
+    for condition in conditions:
+        if isinstance(condition, NaryExpr) and condition.op == Op.logic_and:
+            flat.extend(flatten_and(condition.args))
+        else:
+            flat.append(condition)
+    return flat
+
+
+def condition_ops(condition: Expr, options) -> tuple:
+    """
+    Opcodes of a condition across all of its blocks, which tell apart the
+    conditions and how much they cost. A branch counts as one ``bnz``.
+    """
+    ops = []
+    start, _ = condition.__teal__(options)
+    blocks, seen = [start], set()
+    while blocks:
+        block = blocks.pop(0)
+        if id(block) in seen:
+            continue
+        seen.add(id(block))
+        ops.extend((op.op, tuple(op.args)) for op in block.ops)
+        if isinstance(block, TealConditionalBlock):
+            ops.append((Op.bnz, ()))
+        blocks.extend(block.getOutgoing())
+    return tuple(ops)
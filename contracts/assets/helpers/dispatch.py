@@ -0,0 +1,144 @@
+import sys
+
+from pyteal import *
+
+from helpers.parse import parse_args
+from helpers.state import StateCache
+
+
+class Dispatcher:
+    """
+    Builds a Cond out of handlers kept in the declared order.
+
+    Branches are checked one after another, so the handlers declared first
+    (the most frequent calls) pay for the fewest failed compares.
+    """
+
+    def __init__(
+        self,
+        selector: Expr = None,
+        cache: StateCache = None,
+        prelude=None,
+        prelude_keys=None,
+    ):
+        self.selector = selector if selector is not None else Txn.application_args[0]
+        # State kept in scratch across all the handlers, handlers that do not
+        # return fall through to its write back and approve the call
+        self.cache = cache
+        # Function building the expressions run before any handler, within
+        # the cache, so that they are compiled once instead of per handler
+        self.prelude = prelude
+        # Names of the handlers the prelude runs for, all of them by default
+        self.prelude_keys = prelude_keys
+        self.branches = []  # (name, condition, handler)
+
+    def add(self, key: str, handler, name: str = None) -> "Dispatcher":
+        """
+        Adds a handler called when the selector equals ``key``.
+        """
+        return self.add_condition(name or key, self.selector == Bytes(key), handler)
+
+    def add_condition(self, name: str, condition: Expr, handler) -> "Dispatcher":
+        """
+        Adds a handler guarded by an arbitrary condition. The handler may be
+        another Dispatcher, which is then nested into this one, or a function
+        building the handler when the program is built.
+        """
+        self.branches.append((name, condition, handler))
+        return self
+
+    def get_expr(self) -> Expr:
+        if self.cache is None:
+            return self.build()
+        return Seq(self.cache.wrap(lambda: [self.build()]) + [Return(Int(1))])
+
+    def build(self) -> Expr:
+        if self.prelude is None:
+            return self.build_cond(self.branches)
+        if self.prelude_keys is None:
+            return Seq(self.prelude() + [self.build_cond(self.branches)])
+        # The other handlers are checked first, the prelude and its handlers
+        # follow as the last branch instead of behind a check of their keys
+        others, selected = self.split_branches()
+        prelude = Seq(self.prelude() + [self.build_cond(selected)])
+        return self.build_cond(others + [("prelude", Int(1), prelude)])
+
+    def build_cond(self, branches) -> Expr:
+        return Cond(
+            *[
+                [condition, build_handler(handler)]
+                for name, condition, handler in branches
+            ]
+        )
+
+    def split_branches(self):
+        # (other branches, branches run after the prelude) in program order
+        if self.prelude is None or self.prelude_keys is None:
+            return self.branches, []
+        keys = self.prelude_keys
+        others = [branch for branch in self.branches if branch[0] not in keys]
+        selected = [branch for branch in self.branches if branch[0] in keys]
+        return others, selected
+
+    def handler_names(self) -> list:
+        """
+        Leaf handler names in the order they appear in the compiled program.
+        """
+        names = []
+        for name, condition, handler in sum(self.split_branches(), []):
+            if isinstance(handler, Dispatcher):
+                names.extend(handler.handler_names())
+            else:
+                names.append(name)
+        return names
+
+    def handler_costs(self, mode=Mode.Application, offset: int = 0) -> list:
+        """
+        Opcode cost of reaching each leaf handler as (name, cost) pairs, not
+        counting the prelude.
+        """
+        costs = []
+        others, selected = self.split_branches()
+        for index, (name, condition, handler) in enumerate(others + selected):
+            if index == len(others) and selected:
+                # int 1 and the bnz to the prelude
+                offset += 2
+            # Every condition is followed by a bnz to its branch
+            offset += condition_cost(condition, mode) + 1
+            if isinstance(handler, Dispatcher):
+                costs.extend(handler.handler_costs(mode, offset))
+            else:
+                costs.append((name, offset))
+        return costs
+
+    def print_costs(self, mode=Mode.Application, out=sys.stdout):
+        for name, cost in self.handler_costs(mode):
+            print(f"{name:<24}{cost:>4}", file=out)
+
+
+def build_handler(handler) -> Expr:
+    if isinstance(handler, Dispatcher):
+        return handler.get_expr()
+    if callable(handler):
+        return handler()
+    return handler
+
+
+def condition_cost(condition: Expr, mode=Mode.Application) -> int:
+    """
+    Number of opcodes compiled for a branch-free expression.
+    """
+    lines = compileTeal(condition, mode).splitlines()
+    return len([line for line in lines if line and not line.startswith("#pragma")])
+
+
+if __name__ == "__main__":
+    from state import DEFAULT_PARAMS, build_contract
+
+    params = dict(DEFAULT_PARAMS)
+
+    # Overwrite params if sys.argv[1] is passed
+    if len(sys.argv) > 1:
+        params = parse_args(sys.argv[1], params)
+
+    build_contract({**DEFAULT_PARAMS, **params}).get_dispatcher().print_costs()
@@ -0,0 +1,237 @@
+"""Indexes the reserves of pools at every round they changed."""
+import base64
+import json
+import os
+import sys
+
+import numpy as np
+
+from helpers.parse import parse_args
+from helpers.schema import decode_reserves
+
+ASSETS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HISTORY_DIR = os.path.join(os.path.dirname(ASSETS_DIR), "artifacts", "history")
+
+COLUMNS = ("round", "A", "B", "L")
+DTYPE = np.dtype("<u8")
+
+
+class ReserveHistory:
+    """
+    Append-only columns of the reserves of a single pool.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._views = None
+        self._pending = []  # rows not written yet
+        # The columns are appended one after another, rows which did not
+        # make it into every column before a crash are dropped
+        self._stored = min(
+            os.path.getsize(self._path(name)) // DTYPE.itemsize
+            if os.path.exists(self._path(name))
+            else 0
+            for name in COLUMNS
+        )
+        for name in COLUMNS:
+            if os.path.exists(self._path(name)):
+                os.truncate(self._path(name), self._stored * DTYPE.itemsize)
+
+    def _path(self, column: str) -> str:
+        return os.path.join(self.directory, f"{column}.u64")
+
+    def __len__(self) -> int:
+        return self._stored + len(self._pending)
+
+    def last(self) -> dict:
+        """
+        The last appended row, or None.
+        """
+        if self._pending:
+            return dict(zip(COLUMNS, self._pending[-1]))
+        if self._stored:
+            return {name: int(column[-1]) for name, column in self.columns.items()}
+        return None
+
+    def append(self, round: int, values: dict):
+        """
+        Appends the reserves after ``round``, replacing the last row if it
+        is of the same round.
+        """
+        row = (round,) + tuple(values[name] for name in COLUMNS[1:])
+        last = self.last()
+        if last is not None and round < last["round"]:
+            raise ValueError(f"Round {round} is before round {last['round']}")
+        if last is not None and round == last["round"]:
+            if self._pending:
+                self._pending[-1] = row
+                return
+            # Overwrite the stored row in place
+            for name, value in zip(COLUMNS, row):
+                with open(self._path(name), "r+b") as f:
+                    f.seek(-DTYPE.itemsize, os.SEEK_END)
+                    f.write(np.array([value], DTYPE).tobytes())
+            self._views = None
+            return
+        self._pending.append(row)
+
+    def flush(self):
+        if not self._pending:
+            return
+        rows = np.array(self._pending, DTYPE)
+        for index, name in enumerate(COLUMNS):
+            with open(self._path(name), "ab") as f:
+                f.write(rows[:, index].tobytes())
+        self._stored += len(self._pending)
+        self._pending = []
+        self._views = None
+
+    @property
+    def columns(self) -> dict:
+        """
+        Read-only memory-mapped views of the stored columns.
+        """
+        if self._views is None:
+            if self._stored:
+                self._views = {
+                    name: np.memmap(self._path(name), DTYPE, "r", shape=(self._stored,))
+                    for name in COLUMNS
+                }
+            else:
+                self._views = {name: np.zeros(0, DTYPE) for name in COLUMNS}
+        return self._views
+
+    def at(self, round: int) -> dict:
+        """
+        The reserves at the end of ``round``, or None before the first
+        stored row.
+        """
+        rounds = self.columns["round"]
+        index = int(np.searchsorted(rounds, round, side="right")) - 1
+        if index < 0:
+            return None
+        return {name: int(column[index]) for name, column in self.columns.items()}
+
+    def range(self, start: int, end: int) -> dict:
+        """
+        Views of the rows of rounds ``start`` to ``end`` inclusive.
+        """
+        rounds = self.columns["round"]
+        first = np.searchsorted(rounds, start, side="left")
+        last = np.searchsorted(rounds, end, side="right")
+        return {name: column[first:last] for name, column in self.columns.items()}
+
+
+class Indexer:
+    """
+    Applies global state deltas of the configured applications to their
+    reserve histories.
+    """
+
+    def __init__(self, app_ids, directory: str = HISTORY_DIR):
+        self.directory = directory
+        self.histories = {
+            app_id: ReserveHistory(os.path.join(directory, str(app_id)))
+            for app_id in app_ids
+        }
+        self.state = {}  # app_id -> current reserves
+        for app_id, history in self.histories.items():
+            last = history.last()
+            self.state[app_id] = (
+                {name: last[name] for name in COLUMNS[1:]}
+                if last
+                else dict.fromkeys(COLUMNS[1:], 0)
+            )
+
+    def apply(self, round: int, app_id: int, delta: dict) -> bool:
+        """
+        Applies a delta of decoded values, None for deleted keys. Returns
+        whether the reserves of a configured application changed.
+        """
+        history = self.histories.get(app_id)
+        if history is None:
+            return False
+        state = dict(self.state[app_id])
+        for key, value in delta.items():
+            key = key.decode("latin-1") if isinstance(key, bytes) else key
+            if key == "P":
+                state.update(decode_reserves({"P": value}) if value is not None else {})
+            elif key in state:
+                state[key] = value or 0
+        if state == self.state[app_id]:
+            return False
+        self.state[app_id] = state
+        history.append(round, state)
+        return True
+
+    def consume(self, feed) -> int:
+        """
+        Applies every ``(round, app_id, delta)`` of the feed, returns the
+        number of changes to the reserves.
+        """
+        changes = sum(self.apply(*change) for change in feed)
+        self.flush()
+        return changes
+
+    def flush(self):
+        for history in self.histories.values():
+            history.flush()
+
+
+def transaction_deltas(transactions):
+    """
+    ``(round, app_id, delta)`` of every transaction returned by the
+    indexer which changed the global state of an application.
+    """
+    for txn in transactions:
+        changes = txn.get("global-state-delta")
+        if not changes:
+            continue
+        app_id = (
+            txn.get("created-application-index")
+            or txn["application-transaction"]["application-id"]
+        )
+        delta = {}
+        for change in changes:
+            key = base64.b64decode(change["key"]).decode("latin-1")
+            value = change["value"]
+            if value["action"] == 1:
+                delta[key] = base64.b64decode(value.get("bytes", ""))
+            elif value["action"] == 2:
+                delta[key] = value.get("uint", 0)
+            else:
+                delta[key] = None
+        yield txn["confirmed-round"], app_id, delta
+
+
+def read_transactions(path: str):
+    """
+    Transactions of a file of indexer responses or transactions, one JSON
+    document per line.
+    """
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            document = json.loads(line)
+            if "transactions" in document:
+                yield from document["transactions"]
+            else:
+                yield document
+
+
+if __name__ == "__main__":
+    params = {"out": HISTORY_DIR, "apps": []}
+
+    # Overwrite params if sys.argv[2] is passed
+    if len(sys.argv) > 2:
+        params = parse_args(sys.argv[2], params)
+
+    indexer = Indexer([int(app_id) for app_id in params["apps"]], params["out"])
+    rows = indexer.consume(transaction_deltas(read_transactions(sys.argv[1])))
+    print(f"{rows} changes indexed into {params['out']}")
+    for app_id, history in indexer.histories.items():
+        print(
+            f"{app_id}: {len(history)} rows, at round {history.last()['round'] if len(history) else '-'}"
+        )
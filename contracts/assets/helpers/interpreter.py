@@ -0,0 +1,1954 @@
+"""
+In-process TEAL v2 evaluator with opcode cost metering.
+
+Programs are assembled from the text produced by compileTeal into a list of
+closures, one per opcode. The runs of opcodes between branches are compiled
+into single functions which inline the common opcodes and keep the values
+they push and use in locals, so the evaluation loop is a single indexed call
+per run. Only
+application state is modelled: payments and asset transfers are validated by
+the programs but balances are not moved.
+"""
+import base64
+import hashlib
+import sys
+import time
+
+from helpers.parse import parse_args
+
+MAX_APP_PROGRAM_COST = 700
+MAX_LOGICSIG_COST = 20000
+
+ZERO_ADDRESS = bytes(32)
+
+TXN_TYPES = {"pay": 1, "keyreg": 2, "acfg": 3, "axfer": 4, "afrz": 5, "appl": 6}
+ON_COMPLETION = {
+    "NoOp": 0,
+    "OptIn": 1,
+    "CloseOut": 2,
+    "ClearState": 3,
+    "UpdateApplication": 4,
+    "DeleteApplication": 5,
+}
+CONSTANT_GLOBALS = {"ZeroAddress", "MinTxnFee", "MinBalance", "MaxTxnLife"}
+NAMED_INTS = {**TXN_TYPES, **ON_COMPLETION, "unknown": 0}
+
+BYTES_FIELDS = {
+    "Sender",
+    "Receiver",
+    "CloseRemainderTo",
+    "AssetSender",
+    "AssetReceiver",
+    "AssetCloseTo",
+    "RekeyTo",
+    "Note",
+    "Lease",
+    "TxID",
+    "GroupID",
+    "Type",
+    "VotePK",
+    "SelectionPK",
+    "ApprovalProgram",
+    "ClearStateProgram",
+}
+ARRAY_FIELDS = {"ApplicationArgs", "Accounts"}
+
+OPCODE_COSTS = {
+    "sha256": 35,
+    "keccak256": 130,
+    "sha512_256": 45,
+    "ed25519verify": 1900,
+}
+
+
+class TealError(Exception):
+    """
+    Raised while evaluating a program, the program is then rejected.
+    """
+
+
+class EvalResult:
+    """
+    Outcome and cost of a single program evaluation.
+
+    ``branch`` is the index of the dispatched handler (see
+    Program._find_dispatch), ``dispatch_opcodes``/``dispatch_cost`` is what
+    it took to reach it.
+    """
+
+    __slots__ = (
+        "approved",
+        "error",
+        "opcodes",
+        "cost",
+        "branch",
+        "dispatch_opcodes",
+        "dispatch_cost",
+    )
+
+    def __init__(self):
+        self.approved = False
+        self.error = None
+        self.opcodes = 0
+        self.cost = 0
+        self.branch = None
+        self.dispatch_opcodes = 0
+        self.dispatch_cost = 0
+
+    @property
+    def handler_cost(self) -> int:
+        return self.cost - self.dispatch_cost
+
+    def __repr__(self):
+        return (
+            f"EvalResult(approved={self.approved}, error={self.error!r}, "
+            f"opcodes={self.opcodes}, cost={self.cost}, branch={self.branch})"
+        )
+
+
+def _check_int(value):
+    if type(value) is not int:
+        raise TealError("expected uint64 on the stack")
+    return value
+
+
+def _check_bytes(value):
+    if type(value) is not bytes:
+        raise TealError("expected bytes on the stack")
+    return value
+
+
+def _parse_bytes(args):
+    # byte "..." / byte 0x.. / byte base64 .. / byte base32(..) / addr ..
+    text = " ".join(args)
+    if text.startswith('"'):
+        if not text.endswith('"') or len(text) < 2:
+            raise TealError(f"invalid string literal {text}")
+        return text[1:-1].encode("latin-1").decode("unicode_escape").encode("latin-1")
+    if text.startswith("0x"):
+        return bytes.fromhex(text[2:])
+    for prefix, decode in (
+        ("base64", base64.b64decode),
+        ("b64", base64.b64decode),
+        ("base32", _b32decode),
+        ("b32", _b32decode),
+    ):
+        if text.startswith(prefix):
+            value = text[len(prefix) :].strip()
+            if value.startswith("(") and value.endswith(")"):
+                value = value[1:-1]
+            return decode(value)
+    raise TealError(f"unsupported byte literal {text}")
+
+
+def _b32decode(value: str) -> bytes:
+    return base64.b32decode(value + "=" * (-len(value) % 8))
+
+
+def decode_address(address: str) -> bytes:
+    """
+    Public key of an Algorand address.
+    """
+    raw = _b32decode(address)
+    public_key, checksum = raw[:32], raw[32:]
+    if hashlib.new("sha512_256", public_key).digest()[-4:] != checksum:
+        raise ValueError(f"invalid address checksum {address}")
+    return public_key
+
+
+def encode_address(public_key: bytes) -> str:
+    checksum = hashlib.new("sha512_256", public_key).digest()[-4:]
+    return base64.b32encode(public_key + checksum).decode().rstrip("=")
+
+
+class Ledger:
+    """
+    In-memory application state shared by evaluated groups.
+    """
+
+    def __init__(self, round: int = 1, latest_timestamp: int = 0):
+        self.round = round
+        self.latest_timestamp = latest_timestamp
+        self.apps = {}  # app_id -> (approval Program, clear Program)
+        self.global_state = {}  # app_id -> {key: value}
+        self.local_state = {}  # (address, app_id) -> {key: value}
+        self.balances = {}  # address -> microalgos
+        self.asset_holdings = {}  # (address, asset_id) -> amount
+        self.next_app_id = 1
+
+    def create_app(self, approval, clear, global_state=None, app_id=None) -> int:
+        if app_id is None:
+            app_id = self.next_app_id
+        self.next_app_id = max(self.next_app_id, app_id + 1)
+        self.apps[app_id] = (approval, clear)
+        self.global_state[app_id] = dict(global_state or {})
+        return app_id
+
+    def opt_in(self, address: bytes, app_id: int, local_state=None):
+        self.local_state[(address, app_id)] = dict(local_state or {})
+
+
+class _GroupState:
+    """
+    Copy-on-write view over the ledger, committed only if the group passes.
+    """
+
+    __slots__ = ("ledger", "globals", "locals", "closed", "deleted")
+
+    def __init__(self, ledger: Ledger):
+        self.ledger = ledger
+        self.globals = {}
+        self.locals = {}
+        self.closed = set()
+        self.deleted = set()
+
+    def read_global(self, app_id):
+        state = self.globals.get(app_id)
+        if state is None:
+            state = self.ledger.global_state.get(app_id)
+            if state is None:
+                raise TealError(f"application {app_id} does not exist")
+        return state
+
+    def write_global(self, app_id):
+        state = self.globals.get(app_id)
+        if state is None:
+            state = self.globals[app_id] = dict(self.read_global(app_id))
+        return state
+
+    def read_local(self, address, app_id):
+        key = (address, app_id)
+        state = self.locals.get(key)
+        if state is None:
+            if key in self.closed:
+                raise TealError("account is not opted in")
+            state = self.ledger.local_state.get(key)
+            if state is None:
+                raise TealError("account is not opted in")
+        return state
+
+    def write_local(self, address, app_id):
+        key = (address, app_id)
+        state = self.locals.get(key)
+        if state is None:
+            state = self.locals[key] = dict(self.read_local(address, app_id))
+        return state
+
+    def opted_in(self, address, app_id):
+        key = (address, app_id)
+        if key in self.locals:
+            return True
+        return key not in self.closed and key in self.ledger.local_state
+
+    def commit(self):
+        ledger = self.ledger
+        ledger.global_state.update(self.globals)
+        for key in self.closed:
+            ledger.local_state.pop(key, None)
+        ledger.local_state.update(self.locals)
+        for app_id in self.deleted:
+            ledger.apps.pop(app_id, None)
+            ledger.global_state.pop(app_id, None)
+
+
+class _Context:
+    __slots__ = (
+        "group",
+        "txn",
+        "state",
+        "app_id",
+        "scratch",
+        "args",
+        "ledger",
+        "extra_cost",
+    )
+
+    def __init__(self, group, index, state, app_id, args):
+        self.group = group
+        self.txn = group[index]
+        self.state = state
+        self.app_id = app_id
+        self.scratch = [0] * 256
+        self.args = args
+        self.ledger = state.ledger if state is not None else None
+        self.extra_cost = 0
+
+    def account(self, index):
+        accounts = self.txn.get("Accounts", ())
+        if index == 0:
+            return self.txn["Sender"]
+        if index > len(accounts):
+            raise TealError(f"invalid Accounts index {index}")
+        return accounts[index - 1]
+
+    def foreign_app(self, index):
+        if index == 0:
+            return self.app_id
+        apps = self.txn.get("ForeignApps", ())
+        if index > len(apps):
+            raise TealError(f"invalid ForeignApps index {index}")
+        return apps[index - 1]
+
+    def require_app(self):
+        if self.state is None:
+            raise TealError("state access is not allowed in signature mode")
+
+
+def _field_default(field):
+    if field in ("Type", "Note", "Lease"):
+        return b""
+    if field in BYTES_FIELDS:
+        return ZERO_ADDRESS
+    return 0
+
+
+def _txn_field(txn, field):
+    if field == "NumAppArgs":
+        return len(txn.get("ApplicationArgs", ()))
+    if field == "NumAccounts":
+        return len(txn.get("Accounts", ()))
+    return txn.get(field, _field_default(field))
+
+
+def _txn_array(txn, field, index):
+    if field == "Accounts":
+        if index == 0:
+            return txn["Sender"]
+        index -= 1
+    values = txn.get(field, ())
+    if index >= len(values):
+        raise TealError(f"invalid {field} index")
+    return values[index]
+
+
+def _global_field(ctx, field):
+    if field == "GroupSize":
+        return len(ctx.group)
+    if field == "ZeroAddress":
+        return ZERO_ADDRESS
+    if field == "MinTxnFee":
+        return 1000
+    if field == "MinBalance":
+        return 100000
+    if field == "MaxTxnLife":
+        return 1000
+    if field == "LogicSigVersion":
+        return 2
+    if field == "Round":
+        ctx.require_app()
+        return ctx.ledger.round
+    if field == "LatestTimestamp":
+        ctx.require_app()
+        return ctx.ledger.latest_timestamp
+    if field == "CurrentApplicationID":
+        ctx.require_app()
+        return ctx.app_id
+    raise TealError(f"unsupported global field {field}")
+
+
+def _binary_int(func, name):
+    def factory(args, nxt):
+        def op(stack, ctx):
+            b = stack.pop()
+            a = stack[-1]
+            if type(a) is not int or type(b) is not int:
+                raise TealError(f"{name} expects uint64 arguments")
+            stack[-1] = func(a, b)
+            return nxt
+
+        return op
+
+    return factory
+
+
+def _mod(a, b):
+    if b == 0:
+        raise TealError("% 0")
+    return a % b
+
+
+def _plus(args, nxt):
+    def op(stack, ctx):
+        b = stack.pop()
+        a = stack[-1]
+        if type(a) is not int or type(b) is not int:
+            raise TealError("+ expects uint64 arguments")
+        a += b
+        if a > 0xFFFFFFFFFFFFFFFF:
+            raise TealError("+ overflowed")
+        stack[-1] = a
+        return nxt
+
+    return op
+
+
+def _minus(args, nxt):
+    def op(stack, ctx):
+        b = stack.pop()
+        a = stack[-1]
+        if type(a) is not int or type(b) is not int:
+            raise TealError("- expects uint64 arguments")
+        if b > a:
+            raise TealError("- would result negative")
+        stack[-1] = a - b
+        return nxt
+
+    return op
+
+
+def _times(args, nxt):
+    def op(stack, ctx):
+        b = stack.pop()
+        a = stack[-1]
+        if type(a) is not int or type(b) is not int:
+            raise TealError("* expects uint64 arguments")
+        a *= b
+        if a > 0xFFFFFFFFFFFFFFFF:
+            raise TealError("* overflowed")
+        stack[-1] = a
+        return nxt
+
+    return op
+
+
+def _divide(args, nxt):
+    def op(stack, ctx):
+        b = stack.pop()
+        a = stack[-1]
+        if type(a) is not int or type(b) is not int:
+            raise TealError("/ expects uint64 arguments")
+        if b == 0:
+            raise TealError("/ 0")
+        stack[-1] = a // b
+        return nxt
+
+    return op
+
+
+def _and(args, nxt):
+    def op(stack, ctx):
+        b = stack.pop()
+        a = stack[-1]
+        if type(a) is not int or type(b) is not int:
+            raise TealError("&& expects uint64 arguments")
+        stack[-1] = 1 if a and b else 0
+        return nxt
+
+    return op
+
+
+def _eq(args, nxt):
+    def op(stack, ctx):
+        b = stack.pop()
+        a = stack[-1]
+        if type(a) is not type(b):
+            raise TealError("== expects arguments of the same type")
+        stack[-1] = 1 if a == b else 0
+        return nxt
+
+    return op
+
+
+def _ne(args, nxt):
+    def op(stack, ctx):
+        b = stack.pop()
+        a = stack[-1]
+        if type(a) is not type(b):
+            raise TealError("!= expects arguments of the same type")
+        stack[-1] = 0 if a == b else 1
+        return nxt
+
+    return op
+
+
+def _push_factory(args, nxt, value):
+    def op(stack, ctx):
+        stack.append(value)
+        return nxt
+
+    return op
+
+
+def _int_value(args):
+    if len(args) != 1:
+        raise TealError("int expects one argument")
+    text = args[0]
+    if text in NAMED_INTS:
+        value = NAMED_INTS[text]
+    else:
+        value = int(text, 0)
+    if not 0 <= value <= 0xFFFFFFFFFFFFFFFF:
+        raise TealError(f"int {text} out of range")
+    return value
+
+
+def _int(args, nxt):
+    return _push_factory(args, nxt, _int_value(args))
+
+
+def _byte(args, nxt):
+    return _push_factory(args, nxt, _parse_bytes(args))
+
+
+def _addr(args, nxt):
+    return _push_factory(args, nxt, decode_address(args[0]))
+
+
+def _txn(args, nxt):
+    field = args[0]
+    if len(args) == 2:
+        return _txna([field, args[1]], nxt)
+    if field in ("NumAppArgs", "NumAccounts"):
+
+        def op(stack, ctx):
+            stack.append(_txn_field(ctx.txn, field))
+            return nxt
+
+        return op
+    default = _field_default(field)
+
+    def op(stack, ctx):
+        stack.append(ctx.txn.get(field, default))
+        return nxt
+
+    return op
+
+
+def _group_txn(ctx, index):
+    try:
+        return ctx.group[index]
+    except IndexError:
+        raise TealError(f"gtxn index {index} out of group") from None
+
+
+def _gtxn(args, nxt):
+    index = int(args[0])
+    field = args[1]
+    if len(args) == 3:
+        return _gtxna([args[0], field, args[2]], nxt)
+    if field in ("NumAppArgs", "NumAccounts"):
+
+        def op(stack, ctx):
+            stack.append(_txn_field(_group_txn(ctx, index), field))
+            return nxt
+
+        return op
+    default = _field_default(field)
+
+    def op(stack, ctx):
+        group = ctx.group
+        if index >= len(group):
+            raise TealError(f"gtxn index {index} out of group")
+        stack.append(group[index].get(field, default))
+        return nxt
+
+    return op
+
+
+def _txna(args, nxt):
+    field, index = args[0], int(args[1])
+
+    def op(stack, ctx):
+        stack.append(_txn_array(ctx.txn, field, index))
+        return nxt
+
+    return op
+
+
+def _gtxna(args, nxt):
+    group_index, field, index = int(args[0]), args[1], int(args[2])
+
+    def op(stack, ctx):
+        stack.append(_txn_array(_group_txn(ctx, group_index), field, index))
+        return nxt
+
+    return op
+
+
+def _global(args, nxt):
+    field = args[0]
+    if field in CONSTANT_GLOBALS:
+        value = _global_field(None, field)
+        return _push_factory(args, nxt, value)
+
+    def op(stack, ctx):
+        stack.append(_global_field(ctx, field))
+        return nxt
+
+    return op
+
+
+def _arg(args, nxt, index=None):
+    if index is None:
+        index = int(args[0])
+
+    def op(stack, ctx):
+        if index >= len(ctx.args):
+            raise TealError(f"invalid arg index {index}")
+        stack.append(ctx.args[index])
+        return nxt
+
+    return op
+
+
+def _load(args, nxt):
+    slot = int(args[0])
+
+    def op(stack, ctx):
+        stack.append(ctx.scratch[slot])
+        return nxt
+
+    return op
+
+
+def _store(args, nxt):
+    slot = int(args[0])
+
+    def op(stack, ctx):
+        ctx.scratch[slot] = stack.pop()
+        return nxt
+
+    return op
+
+
+def _err(args, nxt):
+    def op(stack, ctx):
+        raise TealError("err opcode executed")
+
+    return op
+
+
+def _return(args, nxt):
+    def op(stack, ctx):
+        del stack[:-1]
+        return sys.maxsize
+
+    return op
+
+
+def _pop(args, nxt):
+    def op(stack, ctx):
+        stack.pop()
+        return nxt
+
+    return op
+
+
+def _dup(args, nxt):
+    def op(stack, ctx):
+        stack.append(stack[-1])
+        return nxt
+
+    return op
+
+
+def _dup2(args, nxt):
+    def op(stack, ctx):
+        stack.extend(stack[-2:])
+        return nxt
+
+    return op
+
+
+def _not(args, nxt):
+    def op(stack, ctx):
+        stack[-1] = int(_check_int(stack[-1]) == 0)
+        return nxt
+
+    return op
+
+
+def _bitnot(args, nxt):
+    def op(stack, ctx):
+        stack[-1] = _check_int(stack[-1]) ^ 0xFFFFFFFFFFFFFFFF
+        return nxt
+
+    return op
+
+
+def _len(args, nxt):
+    def op(stack, ctx):
+        stack[-1] = len(_check_bytes(stack[-1]))
+        return nxt
+
+    return op
+
+
+def _itob(args, nxt):
+    def op(stack, ctx):
+        stack[-1] = _check_int(stack[-1]).to_bytes(8, "big")
+        return nxt
+
+    return op
+
+
+def _btoi(args, nxt):
+    def op(stack, ctx):
+        value = _check_bytes(stack[-1])
+        if len(value) > 8:
+            raise TealError("btoi arg too long")
+        stack[-1] = int.from_bytes(value, "big")
+        return nxt
+
+    return op
+
+
+def _mulw(args, nxt):
+    def op(stack, ctx):
+        b = _check_int(stack.pop())
+        a = _check_int(stack.pop())
+        result = a * b
+        stack.append(result >> 64)
+        stack.append(result & 0xFFFFFFFFFFFFFFFF)
+        return nxt
+
+    return op
+
+
+def _addw(args, nxt):
+    def op(stack, ctx):
+        b = _check_int(stack.pop())
+        a = _check_int(stack.pop())
+        result = a + b
+        stack.append(result >> 64)
+        stack.append(result & 0xFFFFFFFFFFFFFFFF)
+        return nxt
+
+    return op
+
+
+def _hash(name):
+    def factory(args, nxt):
+        def op(stack, ctx):
+            stack[-1] = hashlib.new(name, _check_bytes(stack[-1])).digest()
+            return nxt
+
+        return op
+
+    return factory
+
+
+def _keccak256(args, nxt):
+    def op(stack, ctx):
+        raise TealError("keccak256 is not supported by this evaluator")
+
+    return op
+
+
+def _ed25519verify(args, nxt):
+    def op(stack, ctx):
+        raise TealError("ed25519verify is not supported by this evaluator")
+
+    return op
+
+
+def _concat(args, nxt):
+    def op(stack, ctx):
+        b = _check_bytes(stack.pop())
+        result = _check_bytes(stack[-1]) + b
+        if len(result) > 4096:
+            raise TealError("concat resulted in string too long")
+        stack[-1] = result
+        return nxt
+
+    return op
+
+
+def _substring_values(value, start, end):
+    value = _check_bytes(value)
+    if end < start or end > len(value):
+        raise TealError("substring range beyond length of string")
+    return value[start:end]
+
+
+def _substring(args, nxt):
+    start, end = int(args[0]), int(args[1])
+
+    def op(stack, ctx):
+        stack[-1] = _substring_values(stack[-1], start, end)
+        return nxt
+
+    return op
+
+
+def _substring3(args, nxt):
+    def op(stack, ctx):
+        end = _check_int(stack.pop())
+        start = _check_int(stack.pop())
+        stack[-1] = _substring_values(stack[-1], start, end)
+        return nxt
+
+    return op
+
+
+def _balance(args, nxt):
+    def op(stack, ctx):
+        ctx.require_app()
+        address = ctx.account(_check_int(stack[-1]))
+        stack[-1] = ctx.ledger.balances.get(address, 0)
+        return nxt
+
+    return op
+
+
+def _app_opted_in(args, nxt):
+    def op(stack, ctx):
+        ctx.require_app()
+        app_id = ctx.foreign_app(_check_int(stack.pop()))
+        address = ctx.account(_check_int(stack[-1]))
+        stack[-1] = int(ctx.state.opted_in(address, app_id))
+        return nxt
+
+    return op
+
+
+def _app_global_get(args, nxt):
+    def op(stack, ctx):
+        ctx.require_app()
+        stack[-1] = ctx.state.read_global(ctx.app_id).get(_check_bytes(stack[-1]), 0)
+        return nxt
+
+    return op
+
+
+def _app_global_get_ex(args, nxt):
+    def op(stack, ctx):
+        ctx.require_app()
+        key = _check_bytes(stack.pop())
+        app_id = ctx.foreign_app(_check_int(stack[-1]))
+        try:
+            state = ctx.state.read_global(app_id)
+        except TealError:
+            state = {}
+        value = state.get(key)
+        stack[-1] = 0 if value is None else value
+        stack.append(int(value is not None))
+        return nxt
+
+    return op
+
+
+def _app_global_put(args, nxt):
+    def op(stack, ctx):
+        ctx.require_app()
+        value = stack.pop()
+        key = _check_bytes(stack.pop())
+        if len(key) > 64:
+            raise TealError("key too long")
+        ctx.state.write_global(ctx.app_id)[key] = value
+        return nxt
+
+    return op
+
+
+def _app_global_del(args, nxt):
+    def op(stack, ctx):
+        ctx.require_app()
+        ctx.state.write_global(ctx.app_id).pop(_check_bytes(stack.pop()), None)
+        return nxt
+
+    return op
+
+
+def _app_local_get(args, nxt):
+    def op(stack, ctx):
+        ctx.require_app()
+        key = _check_bytes(stack.pop())
+        address = ctx.account(_check_int(stack[-1]))
+        stack[-1] = ctx.state.read_local(address, ctx.app_id).get(key, 0)
+        return nxt
+
+    return op
+
+
+def _app_local_get_ex(args, nxt):
+    def op(stack, ctx):
+        ctx.require_app()
+        key = _check_bytes(stack.pop())
+        app_id = ctx.foreign_app(_check_int(stack.pop()))
+        address = ctx.account(_check_int(stack[-1]))
+        try:
+            state = ctx.state.read_local(address, app_id)
+        except TealError:
+            state = {}
+        value = state.get(key)
+        stack[-1] = 0 if value is None else value
+        stack.append(int(value is not None))
+        return nxt
+
+    return op
+
+
+def _app_local_put(args, nxt):
+    def op(stack, ctx):
+        ctx.require_app()
+        value = stack.pop()
+        key = _check_bytes(stack.pop())
+        address = ctx.account(_check_int(stack.pop()))
+        if len(key) > 64:
+            raise TealError("key too long")
+        ctx.state.write_local(address, ctx.app_id)[key] = value
+        return nxt
+
+    return op
+
+
+def _app_local_del(args, nxt):
+    def op(stack, ctx):
+        ctx.require_app()
+        key = _check_bytes(stack.pop())
+        address = ctx.account(_check_int(stack.pop()))
+        ctx.state.write_local(address, ctx.app_id).pop(key, None)
+        return nxt
+
+    return op
+
+
+def _asset_holding_get(args, nxt):
+    field = args[0]
+    if field not in ("AssetBalance", "AssetFrozen"):
+        raise TealError(f"unsupported asset holding field {field}")
+
+    def op(stack, ctx):
+        ctx.require_app()
+        asset_id = _check_int(stack.pop())
+        address = ctx.account(_check_int(stack[-1]))
+        amount = ctx.ledger.asset_holdings.get((address, asset_id))
+        if amount is None:
+            stack[-1] = 0
+            stack.append(0)
+        else:
+            stack[-1] = amount if field == "AssetBalance" else 0
+            stack.append(1)
+        return nxt
+
+    return op
+
+
+# Instructions on uint64 inlined into compiled runs
+_INLINE_INT = {"+", "-", "*", "/", "%", "<", ">", "<=", ">=", "&&", "||"}
+# Instructions which never continue with the next one
+_TERMINAL = {"b", "bz", "bnz", "return", "err"}
+
+OPCODES = {
+    "int": _int,
+    "byte": _byte,
+    "addr": _addr,
+    "txn": _txn,
+    "gtxn": _gtxn,
+    "txna": _txna,
+    "gtxna": _gtxna,
+    "global": _global,
+    "arg": _arg,
+    "arg_0": lambda args, nxt: _arg(args, nxt, 0),
+    "arg_1": lambda args, nxt: _arg(args, nxt, 1),
+    "arg_2": lambda args, nxt: _arg(args, nxt, 2),
+    "arg_3": lambda args, nxt: _arg(args, nxt, 3),
+    "load": _load,
+    "store": _store,
+    "err": _err,
+    "return": _return,
+    "pop": _pop,
+    "dup": _dup,
+    "dup2": _dup2,
+    "+": _plus,
+    "-": _minus,
+    "*": _times,
+    "/": _divide,
+    "%": _binary_int(_mod, "%"),
+    "<": _binary_int(lambda a, b: int(a < b), "<"),
+    ">": _binary_int(lambda a, b: int(a > b), ">"),
+    "<=": _binary_int(lambda a, b: int(a <= b), "<="),
+    ">=": _binary_int(lambda a, b: int(a >= b), ">="),
+    "&&": _and,
+    "||": _binary_int(lambda a, b: int(a != 0 or b != 0), "||"),
+    "|": _binary_int(lambda a, b: a | b, "|"),
+    "&": _binary_int(lambda a, b: a & b, "&"),
+    "^": _binary_int(lambda a, b: a ^ b, "^"),
+    "==": _eq,
+    "!=": _ne,
+    "!": _not,
+    "~": _bitnot,
+    "len": _len,
+    "itob": _itob,
+    "btoi": _btoi,
+    "mulw": _mulw,
+    "addw": _addw,
+    "sha256": _hash("sha256"),
+    "sha512_256": _hash("sha512_256"),
+    "keccak256": _keccak256,
+    "ed25519verify": _ed25519verify,
+    "concat": _concat,
+    "substring": _substring,
+    "substring3": _substring3,
+    "balance": _balance,
+    "app_opted_in": _app_opted_in,
+    "app_global_get": _app_global_get,
+    "app_global_get_ex": _app_global_get_ex,
+    "app_global_put": _app_global_put,
+    "app_global_del": _app_global_del,
+    "app_local_get": _app_local_get,
+    "app_local_get_ex": _app_local_get_ex,
+    "app_local_put": _app_local_put,
+    "app_local_del": _app_local_del,
+    "asset_holding_get": _asset_holding_get,
+}
+
+BRANCHES = {"bnz", "bz", "b"}
+
+# Bytecode of the TEAL v2 opcodes, for measuring the size of programs
+BYTECODES = {
+    "err": 0x00,
+    "sha256": 0x01,
+    "keccak256": 0x02,
+    "sha512_256": 0x03,
+    "ed25519verify": 0x04,
+    "+": 0x08,
+    "-": 0x09,
+    "/": 0x0A,
+    "*": 0x0B,
+    "<": 0x0C,
+    ">": 0x0D,
+    "<=": 0x0E,
+    ">=": 0x0F,
+    "&&": 0x10,
+    "||": 0x11,
+    "==": 0x12,
+    "!=": 0x13,
+    "!": 0x14,
+    "len": 0x15,
+    "itob": 0x16,
+    "btoi": 0x17,
+    "%": 0x18,
+    "|": 0x19,
+    "&": 0x1A,
+    "^": 0x1B,
+    "~": 0x1C,
+    "mulw": 0x1D,
+    "addw": 0x1E,
+    "intcblock": 0x20,
+    "intc": 0x21,
+    "intc_0": 0x22,
+    "intc_1": 0x23,
+    "intc_2": 0x24,
+    "intc_3": 0x25,
+    "bytecblock": 0x26,
+    "bytec": 0x27,
+    "bytec_0": 0x28,
+    "bytec_1": 0x29,
+    "bytec_2": 0x2A,
+    "bytec_3": 0x2B,
+    "arg": 0x2C,
+    "arg_0": 0x2D,
+    "arg_1": 0x2E,
+    "arg_2": 0x2F,
+    "arg_3": 0x30,
+    "txn": 0x31,
+    "global": 0x32,
+    "gtxn": 0x33,
+    "load": 0x34,
+    "store": 0x35,
+    "txna": 0x36,
+    "gtxna": 0x37,
+    "bnz": 0x40,
+    "bz": 0x41,
+    "b": 0x42,
+    "return": 0x43,
+    "pop": 0x48,
+    "dup": 0x49,
+    "dup2": 0x4A,
+    "concat": 0x50,
+    "substring": 0x51,
+    "substring3": 0x52,
+    "balance": 0x60,
+    "app_opted_in": 0x61,
+    "app_local_get": 0x62,
+    "app_local_get_ex": 0x63,
+    "app_global_get": 0x64,
+    "app_global_get_ex": 0x65,
+    "app_local_put": 0x66,
+    "app_global_put": 0x67,
+    "app_local_del": 0x68,
+    "app_global_del": 0x69,
+    "asset_holding_get": 0x70,
+}
+TXN_FIELDS = [
+    "Sender",
+    "Fee",
+    "FirstValid",
+    "FirstValidTime",
+    "LastValid",
+    "Note",
+    "Lease",
+    "Receiver",
+    "Amount",
+    "CloseRemainderTo",
+    "VotePK",
+    "SelectionPK",
+    "VoteFirst",
+    "VoteLast",
+    "VoteKeyDilution",
+    "Type",
+    "TypeEnum",
+    "XferAsset",
+    "AssetAmount",
+    "AssetSender",
+    "AssetReceiver",
+    "AssetCloseTo",
+    "GroupIndex",
+    "TxID",
+    "ApplicationID",
+    "OnCompletion",
+    "ApplicationArgs",
+    "NumAppArgs",
+    "Accounts",
+    "NumAccounts",
+    "ApprovalProgram",
+    "ClearStateProgram",
+    "RekeyTo",
+]
+GLOBAL_FIELDS = [
+    "MinTxnFee",
+    "MinBalance",
+    "MaxTxnLife",
+    "ZeroAddress",
+    "GroupSize",
+    "LogicSigVersion",
+    "Round",
+    "LatestTimestamp",
+    "CurrentApplicationID",
+]
+ASSET_HOLDING_FIELDS = ["AssetBalance", "AssetFrozen"]
+
+
+def _varuint(value: int) -> bytes:
+    out = bytearray()
+    while value >= 0x80:
+        out.append(value & 0x7F | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def _branch(opcode, target, nxt):
+    if opcode == "b":
+
+        def op(stack, ctx):
+            return target
+
+    elif opcode == "bnz":
+
+        def op(stack, ctx):
+            if _check_int(stack.pop()) != 0:
+                return target
+            return nxt
+
+    else:
+
+        def op(stack, ctx):
+            if _check_int(stack.pop()) == 0:
+                return target
+            return nxt
+
+    return op
+
+
+def _metered(op, extra_cost):
+    # Only the few opcodes costing more than 1 pay for tracking it
+    def metered(stack, ctx):
+        ctx.extra_cost += extra_cost
+        return op(stack, ctx)
+
+    return metered
+
+
+def _counted(op, index, counts):
+    def counted(stack, ctx):
+        counts[index] += 1
+        return op(stack, ctx)
+
+    return counted
+
+
+class _Run:
+    """
+    Source of a run of instructions compiled into a single function which
+    returns the next pc. Values pushed and used within the run are kept in
+    locals, the stack only receives those left at its end or used by ops
+    which are not inlined.
+    """
+
+    def __init__(self, program, start: int, end: int, inline: bool):
+        self.program = program
+        self.start = start
+        self.namespace = {"TealError": TealError, "ops": program.code}
+        self.source = ["def run(stack, ctx):"]
+        self.lines = [None]  # line number - 1 -> position in the run
+        self.values = []  # (expression, type or None) of the pushed values
+        self.temps = 0
+        for index in range(start, end):
+            self.position = index - start
+            opcode = program.instructions[index][0]
+            last = index == end - 1
+            if inline and OPCODE_COSTS.get(opcode, 1) == 1 and self._inline(index):
+                if last and opcode not in _TERMINAL:
+                    self._flush()
+                    self._emit(f"return {end}")
+                continue
+            self._flush()
+            call = f"ops[{index}](stack, ctx)"
+            self._emit(f"return {call}" if last else call)
+
+    def compile(self):
+        code = compile("\n".join(self.source), f"<run {self.start}>", "exec")
+        exec(code, self.namespace)
+        run = self.namespace["run"]
+        run.lines = self.lines
+        return run
+
+    def _emit(self, line: str):
+        self.source.append(f"    {line}")
+        self.lines.append(self.position)
+
+    def _push(self, expression: str, kind=None):
+        # Evaluates the expression into a new local, in program order
+        name = f"t{self.temps}"
+        self.temps += 1
+        self._emit(f"{name} = {expression}")
+        self.values.append((name, kind))
+        return name
+
+    def _pop(self):
+        if not self.values:
+            self._push("stack.pop()")
+        return self.values.pop()
+
+    def _flush(self):
+        if len(self.values) == 1:
+            self._emit(f"stack.append({self.values[0][0]})")
+        elif self.values:
+            self._emit(f"stack.extend(({', '.join(name for name, _ in self.values)}))")
+        self.values = []
+
+    def _check(self, values, kind, message: str):
+        # Fails unless every value is of kind
+        if any(known not in (None, kind) for _, known in values):
+            self._emit(f"raise TealError({message!r})")
+            return
+        tests = [
+            f"type({name}) is not {kind.__name__}"
+            for name, known in values
+            if known is None
+        ]
+        if tests:
+            self._emit(f"if {' or '.join(tests)}: raise TealError({message!r})")
+
+    def _require_app(self):
+        self._emit(
+            "if ctx.state is None: "
+            "raise TealError('state access is not allowed in signature mode')"
+        )
+
+    def _inline(self, index: int) -> bool:
+        program = self.program
+        opcode, args = program.instructions[index]
+        if program._is_constant(index):
+            value = program._constant_value(index)
+            self.namespace[f"c{index}"] = value
+            self.values.append((f"c{index}", type(value)))
+        elif opcode in _INLINE_INT:
+            b, a = self._pop(), self._pop()
+            self._check([a, b], int, f"{opcode} expects uint64 arguments")
+            self._int_op(opcode, a[0], b[0])
+        elif opcode in ("==", "!="):
+            (b, b_kind), (a, a_kind) = self._pop(), self._pop()
+            message = f"{opcode} expects arguments of the same type"
+            if a_kind is not None and b_kind is not None:
+                if a_kind is not b_kind:
+                    self._emit(f"raise TealError({message!r})")
+            elif a_kind is not None or b_kind is not None:
+                name, known = (b, a_kind) if b_kind is None else (a, b_kind)
+                self._check([(name, None)], known, message)
+            else:
+                self._emit(
+                    f"if type({a}) is not type({b}): raise TealError({message!r})"
+                )
+            equal, different = (1, 0) if opcode == "==" else (0, 1)
+            self._push(f"{equal} if {a} == {b} else {different}", int)
+        elif opcode == "!":
+            value = self._pop()
+            self._check([value], int, "expected uint64 on the stack")
+            self._push(f"1 if {value[0]} == 0 else 0", int)
+        elif opcode in ("bz", "bnz"):
+            value = self._pop()
+            self._check([value], int, "expected uint64 on the stack")
+            self._flush()
+            test = "==" if opcode == "bz" else "!="
+            self._emit(f"if {value[0]} {test} 0: return {program.labels[args[0]]}")
+            self._emit(f"return {index + 1}")
+        elif opcode == "b":
+            self._flush()
+            self._emit(f"return {program.labels[args[0]]}")
+        elif opcode == "return":
+            self._flush()
+            self._emit("del stack[:-1]")
+            self._emit(f"return {sys.maxsize}")
+        elif opcode == "err":
+            self._emit('raise TealError("err opcode executed")')
+        elif opcode == "pop":
+            self._pop()
+        elif opcode == "dup":
+            value = self._pop()
+            self.values.extend((value, value))
+        elif opcode == "load":
+            self._push(f"ctx.scratch[{int(args[0])}]")
+        elif opcode == "store":
+            self._emit(f"ctx.scratch[{int(args[0])}] = {self._pop()[0]}")
+        elif opcode == "global" and args[0] == "GroupSize":
+            self._push("len(ctx.group)", int)
+        elif program._is_field(index):
+            field = args[-1]
+            self.namespace[f"d{index}"] = _field_default(field)
+            if opcode == "txn":
+                self._push(f"ctx.txn.get({field!r}, d{index})")
+            else:
+                group_index = int(args[0])
+                self._emit(
+                    f"if {group_index} >= len(ctx.group): "
+                    f"raise TealError('gtxn index {group_index} out of group')"
+                )
+                self._push(f"ctx.group[{group_index}].get({field!r}, d{index})")
+        elif opcode == "app_global_get":
+            self._require_app()
+            key = self._pop()
+            self._check([key], bytes, "expected bytes on the stack")
+            self._push(f"ctx.state.read_global(ctx.app_id).get({key[0]}, 0)")
+        elif opcode == "app_global_put":
+            self._require_app()
+            value, key = self._pop(), self._pop()
+            self._check([key], bytes, "expected bytes on the stack")
+            self._emit(f"if len({key[0]}) > 64: raise TealError('key too long')")
+            self._emit(f"ctx.state.write_global(ctx.app_id)[{key[0]}] = {value[0]}")
+        elif opcode == "app_local_get":
+            self._require_app()
+            key = self._pop()
+            self._check([key], bytes, "expected bytes on the stack")
+            account = self._pop()
+            self._check([account], int, "expected uint64 on the stack")
+            self._push(
+                f"ctx.state.read_local(ctx.account({account[0]}), ctx.app_id)"
+                f".get({key[0]}, 0)"
+            )
+        else:
+            return False
+        return True
+
+    def _int_op(self, opcode: str, a: str, b: str):
+        if opcode in ("+", "*"):
+            result = self._push(f"{a} {opcode} {b}", int)
+            self._emit(
+                f"if {result} > 0xFFFFFFFFFFFFFFFF: "
+                f"raise TealError('{opcode} overflowed')"
+            )
+        elif opcode == "-":
+            self._emit(f"if {b} > {a}: raise TealError('- would result negative')")
+            self._push(f"{a} - {b}", int)
+        elif opcode in ("/", "%"):
+            self._emit(f"if {b} == 0: raise TealError('{opcode} 0')")
+            self._push(f"{a} {'//' if opcode == '/' else '%'} {b}", int)
+        elif opcode == "&&":
+            self._push(f"1 if {a} and {b} else 0", int)
+        elif opcode == "||":
+            self._push(f"1 if {a} or {b} else 0", int)
+        else:
+            self._push(f"1 if {a} {opcode} {b} else 0", int)
+
+
+def _failed_at(exc: Exception, run) -> int:
+    # Position in the run of the instruction raising exc
+    traceback = exc.__traceback__
+    while traceback.tb_frame.f_code is not run.__code__:
+        traceback = traceback.tb_next
+    return run.lines[traceback.tb_lineno - 1]
+
+
+class Program:
+    """
+    Assembled TEAL program ready for repeated evaluation.
+    """
+
+    def __init__(self, source: str, mode: str = "Application"):
+        self.source = source
+        self.mode = mode
+        self.version = 1
+        self.instructions = []  # (opcode, args)
+        self.labels = {}  # label -> instruction index
+        self.intcblock = None
+        self.bytecblock = None
+        self._parse(source)
+        self._assemble()
+
+    @classmethod
+    def from_artifact(cls, path: str, mode: str = "Application") -> "Program":
+        """
+        Loads the TEAL code stored by algob in artifacts/cache.
+        """
+        import yaml
+
+        with open(path) as artifact:
+            return cls(yaml.safe_load(artifact)["tealCode"], mode)
+
+    def _parse(self, source):
+        for line in source.splitlines():
+            line = line.split("//", 1)[0].strip() if '"' not in line else line.strip()
+            if not line:
+                continue
+            if line.startswith("#pragma"):
+                parts = line.split()
+                if len(parts) == 3 and parts[1] == "version":
+                    self.version = int(parts[2])
+                continue
+            if line.endswith(":"):
+                self.labels[line[:-1]] = len(self.instructions)
+                continue
+            if line.startswith("byte ") or line.startswith("addr "):
+                opcode, rest = line.split(None, 1)
+                self.instructions.append((opcode, [rest]))
+                continue
+            opcode, *args = line.split()
+            if opcode in ("intcblock", "bytecblock"):
+                # Constant blocks are kept out of the code like the blocks
+                # the assembler builds for int and byte, so both forms of a
+                # program cost the same
+                if self.instructions:
+                    raise TealError(f"{opcode} is only supported at the start")
+                if opcode == "intcblock":
+                    self.intcblock = [int(arg, 0) for arg in args]
+                else:
+                    self.bytecblock = [_parse_bytes([arg]) for arg in args]
+                continue
+            self.instructions.append((opcode, args))
+        if self.version > 2:
+            raise TealError(f"unsupported TEAL version {self.version}")
+
+    def _assemble(self):
+        self.code = []
+        self.costs = []
+        for index, (opcode, args) in enumerate(self.instructions):
+            nxt = index + 1
+            if opcode in BRANCHES:
+                target = self.labels.get(args[0])
+                if target is None:
+                    raise TealError(f"reference to undefined label {args[0]}")
+                if target <= index:
+                    raise TealError("backward branches are not allowed")
+                op = _branch(opcode, target, nxt)
+            elif opcode.startswith(("intc", "bytec")):
+                op = _push_factory(args, nxt, self._constant(opcode, args))
+            else:
+                factory = OPCODES.get(opcode)
+                if factory is None:
+                    raise TealError(f"unknown opcode {opcode}")
+                op = factory(args, nxt)
+            cost = OPCODE_COSTS.get(opcode, 1)
+            if cost > 1:
+                op = _metered(op, cost - 1)
+            self.code.append(op)
+            self.costs.append(cost)
+        self.static_cost = sum(self.costs)
+        self.dispatch = self._find_dispatch()
+        self.blocks = self._blocks()
+
+    def _blocks(self, inline: bool = True) -> list:
+        """
+        The code split into runs without branches, at the index of their
+        first instruction, as (run, length) pairs. Runs start at labels and
+        after branches, return and err. Each run is compiled into a single
+        function returning the next pc, with the simplest instructions
+        inlined unless ``inline`` is False and the others calling their op.
+        """
+        starts = {0, *self.labels.values()}
+        for index, (opcode, _) in enumerate(self.instructions):
+            if opcode in BRANCHES or opcode in ("return", "err"):
+                starts.add(index + 1)
+        starts = sorted(start for start in starts if start < len(self.code))
+        blocks = [None] * len(self.code)
+        for start, end in zip(starts, starts[1:] + [len(self.code)]):
+            blocks[start] = (_Run(self, start, end, inline).compile(), end - start)
+        return blocks
+
+    def _is_field(self, index: int) -> bool:
+        # txn or gtxn of a field which is not an array
+        opcode, args = self.instructions[index]
+        return (
+            opcode in ("txn", "gtxn")
+            and len(args) == (1 if opcode == "txn" else 2)
+            and args[-1] not in ("NumAppArgs", "NumAccounts")
+        )
+
+    def _is_constant(self, index: int) -> bool:
+        opcode, args = self.instructions[index]
+        if opcode == "global":
+            return args[0] in CONSTANT_GLOBALS
+        return opcode in ("int", "byte", "addr") or (
+            opcode.startswith(("intc", "bytec")) and not opcode.endswith("block")
+        )
+
+    def _constant_value(self, index: int):
+        opcode, args = self.instructions[index]
+        if opcode == "int":
+            return _int_value(args)
+        if opcode == "byte":
+            return _parse_bytes(args)
+        if opcode == "addr":
+            return decode_address(args[0])
+        if opcode == "global":
+            return _global_field(None, args[0])
+        return self._constant(opcode, args)
+
+    def _constant(self, opcode, args):
+        block = self.intcblock if opcode.startswith("intc") else self.bytecblock
+        index = int(opcode[-1]) if "_" in opcode else int(args[0])
+        if block is None or index >= len(block):
+            raise TealError(f"{opcode} refers past the constant block")
+        return block[index]
+
+    def constants(self):
+        """
+        Int and byte constant blocks of the program, and the index of the
+        constant pushed by each instruction (None for other opcodes).
+        Without explicit blocks the int and byte constants are numbered in
+        the order of their first appearance, like goal does.
+        """
+        ints = list(self.intcblock or [])
+        byte_values = list(self.bytecblock or [])
+        pushes = []
+        for opcode, args in self.instructions:
+            if opcode == "int":
+                block, value = ints, _int_value(args)
+            elif opcode in ("byte", "addr"):
+                block = byte_values
+                value = _parse_bytes(args) if opcode == "byte" else decode_address(args[0])
+            else:
+                pushes.append(None)
+                continue
+            if (self.intcblock if block is ints else self.bytecblock) is not None:
+                raise TealError(f"{opcode} next to an explicit constant block")
+            if value not in block:
+                block.append(value)
+            pushes.append(block.index(value))
+        return ints, byte_values, pushes
+
+    def bytecode(self) -> bytes:
+        """
+        The program assembled like goal does for TEAL v2.
+        """
+        return self._encode()[0]
+
+    def offsets(self) -> list:
+        """
+        Byte offset of every instruction in the bytecode, which is the pc
+        reported by a dry-run trace.
+        """
+        return self._encode()[1][:-1]
+
+    def _encode(self):
+        ints, byte_values, pushes = self.constants()
+        out = bytearray(_varuint(self.version))
+        if ints:
+            out += bytes([BYTECODES["intcblock"]]) + _varuint(len(ints))
+            out += b"".join(_varuint(value) for value in ints)
+        if byte_values:
+            out += bytes([BYTECODES["bytecblock"]]) + _varuint(len(byte_values))
+            out += b"".join(_varuint(len(value)) + value for value in byte_values)
+
+        offsets = []  # instruction index -> byte offset
+        jumps = []  # (position of the offset, target instruction index)
+        for index, ((opcode, args), constant) in enumerate(
+            zip(self.instructions, pushes)
+        ):
+            offsets.append(len(out))
+            if constant is not None:
+                base = "intc" if opcode == "int" else "bytec"
+                out += self._constant_ref(base, constant)
+            elif opcode in BRANCHES:
+                out.append(BYTECODES[opcode])
+                jumps.append((len(out), self.labels[args[0]]))
+                out += b"\0\0"
+            elif opcode in BYTECODES:
+                out.append(BYTECODES[opcode])
+                out += bytes(self._immediates(opcode, args))
+            else:
+                raise TealError(f"unknown opcode {opcode}")
+        offsets.append(len(out))
+        for position, target in jumps:
+            offset = offsets[target] - position - 2
+            out[position : position + 2] = offset.to_bytes(2, "big", signed=True)
+        return bytes(out), offsets
+
+    @staticmethod
+    def _constant_ref(base, index):
+        if index < 4:
+            return bytes([BYTECODES[f"{base}_{index}"]])
+        return bytes([BYTECODES[base], index])
+
+    @staticmethod
+    def _immediates(opcode, args):
+        if opcode in ("txn", "txna"):
+            return [TXN_FIELDS.index(args[0])] + [int(arg) for arg in args[1:]]
+        if opcode in ("gtxn", "gtxna"):
+            return [int(args[0]), TXN_FIELDS.index(args[1])] + [
+                int(arg) for arg in args[2:]
+            ]
+        if opcode == "global":
+            return [GLOBAL_FIELDS.index(args[0])]
+        if opcode == "asset_holding_get":
+            return [ASSET_HOLDING_FIELDS.index(args[0])]
+        return [int(arg) for arg in args]
+
+    @property
+    def size(self) -> int:
+        return len(self.bytecode())
+
+    def _find_dispatch(self) -> dict:
+        """
+        Maps the bnz instructions of the top-level Cond to the index of the
+        handler they lead to. Cond chains nested directly in a branch (as
+        built by Dispatcher) map to None and their handlers are numbered in
+        the order of appearance.
+        """
+        dispatch = {}
+        self._scan_dispatch(0, dispatch, [0])
+        return dispatch
+
+    def _dispatch_chain(self, start: int) -> list:
+        chain = []
+        for index in range(start, len(self.instructions)):
+            opcode = self.instructions[index][0]
+            if opcode == "bnz":
+                chain.append(index)
+            elif opcode == "err":
+                return chain
+            elif opcode in ("return", "b", "bz"):
+                return []
+        return []
+
+    def _scan_dispatch(self, start, dispatch, counter):
+        for index in self._dispatch_chain(start):
+            target = self.labels[self.instructions[index][1][0]]
+            # A single bnz followed by err is an Assert rather than a Cond
+            if len(self._dispatch_chain(target)) > 1:
+                dispatch[index] = None
+                self._scan_dispatch(target, dispatch, counter)
+            else:
+                dispatch[index] = counter[0]
+                counter[0] += 1
+
+    def record(self, counts):
+        """
+        Counts the executions of every instruction into ``counts``, a list
+        as long as ``instructions``, until ``record(None)`` is called.
+        """
+        self._assemble()
+        if counts is not None:
+            self.code = [
+                _counted(op, index, counts) for index, op in enumerate(self.code)
+            ]
+            # Every instruction is counted on its own
+            self.blocks = self._blocks(inline=False)
+
+    @property
+    def budget(self) -> int:
+        if self.mode == "Signature":
+            return MAX_LOGICSIG_COST
+        return MAX_APP_PROGRAM_COST
+
+    def evaluate(self, group, index, state=None, app_id=0, args=()) -> EvalResult:
+        result = EvalResult()
+        if self.static_cost > self.budget:
+            # TEAL v2 checks the cost of the whole program before running it
+            kind = "LogicSig" if self.mode == "Signature" else "app program"
+            result.error = f"{kind} cost too high: {self.static_cost} > {self.budget}"
+            return result
+        ctx = _Context(group, index, state, app_id, args)
+        blocks = self.blocks
+        dispatch = self.dispatch
+        end = len(blocks)
+        stack = []
+        pc = 0
+        opcodes = 0
+        run = None
+        try:
+            # Runs are counted as a whole, their last instruction is the
+            # only one changing the pc
+            while pc < end:
+                run, size = blocks[pc]
+                opcodes += size
+                current = pc + size - 1
+                pc = run(stack, ctx)
+                if pc != current + 1 and current in dispatch:
+                    if dispatch[current] is None:
+                        continue
+                    result.branch = dispatch[current]
+                    result.dispatch_opcodes = opcodes
+                    result.dispatch_cost = opcodes + ctx.extra_cost
+                    break
+            while pc < end:
+                run, size = blocks[pc]
+                opcodes += size
+                pc = run(stack, ctx)
+            run = None
+            if len(stack) != 1:
+                raise TealError(f"stack has {len(stack)} elements at the end")
+            if type(stack[0]) is not int:
+                raise TealError("program returned bytes")
+            result.approved = stack[0] != 0
+            if not result.approved:
+                result.error = "program rejected"
+        except (TealError, IndexError) as exc:
+            if run is not None:
+                # Only the instructions of the run up to the failing one
+                # were executed
+                opcodes -= size - 1 - _failed_at(exc, run)
+            result.error = str(exc) if isinstance(exc, TealError) else "stack underflow"
+        result.opcodes = opcodes
+        result.cost = opcodes + ctx.extra_cost
+        return result
+
+
+def evaluate_group(group, ledger: Ledger) -> list:
+    """
+    Evaluates every LogicSig and application call of the group in order.
+
+    Transactions are dicts keyed by TEAL field names. A transaction signed by
+    a LogicSig carries its Program under ``"LogicSig"`` (and its arguments
+    under ``"LogicSigArgs"``). Application calls run the approval program of
+    ``ledger.apps[ApplicationID]``, or ``ApprovalProgram`` when creating.
+    ``GroupIndex`` is set from the position of each transaction in the group.
+    State changes are committed to the ledger only if the whole group passes.
+    Returns one EvalResult (or None) per transaction.
+    """
+    for index, txn in enumerate(group):
+        txn["GroupIndex"] = index
+    results = [None] * len(group)
+    for index, txn in enumerate(group):
+        lsig = txn.get("LogicSig")
+        if lsig is not None:
+            result = lsig.evaluate(group, index, args=txn.get("LogicSigArgs", ()))
+            results[index] = result
+            if not result.approved:
+                return results
+
+    state = _GroupState(ledger)
+    for index, txn in enumerate(group):
+        if txn.get("TypeEnum") != TXN_TYPES["appl"]:
+            continue
+        result = _evaluate_app_call(group, index, txn, state, ledger)
+        if results[index] is None:
+            results[index] = result
+        else:
+            results[index] = (results[index], result)
+        if not result.approved:
+            return results
+    state.commit()
+    return results
+
+
+def _evaluate_app_call(group, index, txn, state, ledger):
+    on_completion = txn.get("OnCompletion", 0)
+    app_id = txn.get("ApplicationID", 0)
+    sender = txn["Sender"]
+    if app_id == 0:
+        app_id = ledger.next_app_id
+        ledger.next_app_id += 1
+        state.globals[app_id] = {}
+        approval = txn["ApprovalProgram"]
+        clear = txn.get("ClearStateProgram")
+    else:
+        if app_id not in ledger.apps:
+            result = EvalResult()
+            result.error = f"application {app_id} does not exist"
+            return result
+        approval, clear = ledger.apps[app_id]
+
+    if on_completion == ON_COMPLETION["OptIn"]:
+        if state.opted_in(sender, app_id):
+            result = EvalResult()
+            result.error = "account has already opted in"
+            return result
+        state.closed.discard((sender, app_id))
+        state.locals[(sender, app_id)] = {}
+
+    program = clear if on_completion == ON_COMPLETION["ClearState"] else approval
+    result = program.evaluate(group, index, state, app_id)
+
+    if on_completion == ON_COMPLETION["ClearState"]:
+        # Clearing always succeeds, the program only decides about state writes
+        result.approved = True
+    if not result.approved:
+        return result
+
+    if txn.get("ApplicationID", 0) == 0:
+        ledger.apps[app_id] = (approval, clear)
+    if on_completion in (ON_COMPLETION["CloseOut"], ON_COMPLETION["ClearState"]):
+        state.locals.pop((sender, app_id), None)
+        state.closed.add((sender, app_id))
+    elif on_completion == ON_COMPLETION["DeleteApplication"]:
+        state.deleted.add(app_id)
+    return result
+
+
+class CostMeter:
+    """
+    Aggregates EvalResults per handler and prints them next to the static
+    cost of the program against its budget. TEAL v2 rejects programs whose
+    static cost, the sum of the costs of all their opcodes, is over the
+    budget; the executed cost of a call is only reported.
+    """
+
+    def __init__(self):
+        self.handlers = {}  # name -> [runs, opcodes, cost, max cost, dispatch cost, program]
+
+    def record(self, name: str, result: EvalResult, program: Program):
+        stats = self.handlers.setdefault(name, [0, 0, 0, 0, 0, program])
+        stats[0] += 1
+        stats[1] += result.opcodes
+        stats[2] += result.cost
+        stats[3] = max(stats[3], result.cost)
+        stats[4] = result.dispatch_cost
+
+    def report(self, out=sys.stdout):
+        print(
+            f"{'handler':<24}{'runs':>8}{'opcodes':>10}{'cost':>8}"
+            f"{'max':>8}{'dispatch':>10}{'static':>8}{'budget %':>10}",
+            file=out,
+        )
+        for name, (runs, opcodes, cost, max_cost, dispatch, program) in sorted(
+            self.handlers.items()
+        ):
+            static_cost = program.static_cost
+            print(
+                f"{name:<24}{runs:>8}{opcodes / runs:>10.1f}{cost / runs:>8.1f}"
+                f"{max_cost:>8}{dispatch:>10}{static_cost:>8}"
+                f"{100 * static_cost / program.budget:>9.1f}%",
+                file=out,
+            )
+
+
+def _demo_swaps(params):
+    """
+    Compiles state.py with ``params`` and the escrow of its template, and
+    evaluates a stream of swap groups.
+    """
+    from helpers.template import compile_template
+    from state import build_contract, compile_state
+
+    contract = build_contract(params)
+    approval = Program(compile_state(params))
+    clear = Program("#pragma version 2\nint 1\n")
+    ledger = Ledger()
+    # Small app_ids may collide with the constants of the escrow template
+    app_id = 14104138
+    template = compile_template(bool(params["optimize"]), contract.settle_swaps)
+    lsig = Program(template.teal(app_id), "Signature")
+    escrow_addr = decode_address(template.address(app_id))
+    reserves = {"A": 10 ** 12, "B": 10 ** 12, "L": 10 ** 12}
+    if contract.packed_state:
+        global_state = {b"P": contract.reserves.encode(reserves)}
+    else:
+        global_state = {key.encode(): value for key, value in reserves.items()}
+    ledger.create_app(
+        approval,
+        clear,
+        {**global_state, b"E": escrow_addr, b"Y": 2, b"X": 3, b"Z": 4},
+        app_id,
+    )
+    user = bytes([1]) * 32
+    ledger.opt_in(user, app_id, {b"1": 0, b"2": 0, b"3": 0})
+
+    asa = contract.__class__.__name__ == "AsaToAsaContract"
+    primary_out = {
+        "TypeEnum": TXN_TYPES["axfer" if asa else "pay"],
+        "Sender": escrow_addr,
+        "Fee": 1000,
+        "LogicSig": lsig,
+    }
+    if asa:
+        primary_out.update(XferAsset=3, AssetReceiver=user, AssetAmount=0)
+    else:
+        primary_out.update(Receiver=user, Amount=0)
+    # The least output accepted is only checked with limits
+    swap = [
+        {
+            "TypeEnum": TXN_TYPES["appl"],
+            "Sender": user,
+            "ApplicationID": app_id,
+            "ApplicationArgs": [b"S", (1).to_bytes(8, "big")],
+        },
+        {
+            "TypeEnum": TXN_TYPES["axfer"],
+            "Sender": user,
+            "XferAsset": 2,
+            "AssetReceiver": escrow_addr,
+            "AssetAmount": 1000,
+        },
+    ]
+    fee = {
+        "TypeEnum": TXN_TYPES["pay"],
+        "Sender": user,
+        "Receiver": escrow_addr,
+        "Amount": 2000,
+    }
+    if contract.settle_swaps:
+        # The payout goes in the swap group, paying out nothing keeps the
+        # reserves (and so the cost) stable
+        groups = [("S", swap + [primary_out, fee])]
+    else:
+        withdraw = [
+            dict(swap[0], ApplicationArgs=[b"W"]),
+            {
+                "TypeEnum": TXN_TYPES["axfer"],
+                "Sender": escrow_addr,
+                "XferAsset": 2,
+                "AssetReceiver": user,
+                "AssetAmount": 0,
+                "Fee": 1000,
+                "LogicSig": lsig,
+            },
+            primary_out,
+            fee,
+        ]
+        groups = [("S", swap), ("W", withdraw)]
+    amount_field = "AssetAmount" if asa else "Amount"
+    local_state = ledger.local_state[(user, app_id)]
+
+    meter = CostMeter()
+    count = int(params["groups"])
+    start = time.perf_counter()
+    for index in range(count):
+        name, group = groups[index % len(groups)]
+        if name == "W":
+            primary_out[amount_field] = local_state[b"1"]
+        results = evaluate_group(group, ledger)
+        for result in results:
+            if result is not None and not result.approved:
+                raise TealError(f"{name} group {index} rejected: {result.error}")
+        meter.record(name, results[0], approval)
+        if len(results) > 2:
+            meter.record(f"escrow {name}", results[2], lsig)
+        local_state = ledger.local_state[(user, app_id)]
+    elapsed = time.perf_counter() - start
+    meter.report()
+    print(f"{count / elapsed:.0f} groups/s")
+
+
+if __name__ == "__main__":
+    from state import DEFAULT_PARAMS
+
+    params = {**DEFAULT_PARAMS, "groups": 20000}
+
+    # Overwrite params if sys.argv[1] is passed
+    if len(sys.argv) > 1:
+        params = parse_args(sys.argv[1], params)
+
+    _demo_swaps(params)
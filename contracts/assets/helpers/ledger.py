@@ -0,0 +1,300 @@
+"""
+Liquidity positions of every account of a pool in parallel NumPy columns.
+
+Accounts are numbered in the order they are first seen, and their local
+state (``a_to_withdraw``, ``b_to_withdraw`` and ``user_liquidity_tokens`` of
+helpers.schema) is kept in uint64 columns indexed by that number, next to
+the reserves of the pool. Transitions of the contract are applied in
+batches, each either applied as a whole or rejected like the first call of
+the batch the contract would reject:
+
+- adding and removing liquidity changes the reserves the next call is
+  computed with. The batch methods of PoolMath are run with the reserves
+  the previous calls leave according to the last run, until the amounts no
+  longer change. Call i is exact from run i + 1 on, so this ends with the
+  amounts of calls made in order, with the contract's truncation, usually
+  after a few runs
+- depositing (``Y``) and withdrawing (``X``) liquidity tokens and paying out
+  the pending withdrawals (``W``) only touch the positions and are applied
+  with ``np.add.at``
+
+``redeemable`` values every position at once with the ``a_calc`` and
+``b_calc`` of a remove liquidity call:
+
+    ledger = PositionLedger.from_state(params, decode_global_states([app])[0], decode_local_states(accounts, app_id))
+    a_out, b_out, failed = ledger.redeemable()
+"""
+import numpy as np
+
+from helpers.quote import UINT64_MAX, PoolMath, TealArithmeticError
+from helpers.schema import FIELDS, LOCAL
+
+COLUMNS = tuple(field.name for field in FIELDS if field.scope == LOCAL)
+
+
+class PositionLedger:
+    """
+    The reserves of a pool and the local state of its accounts.
+    """
+
+    def __init__(
+        self,
+        math: PoolMath,
+        a_balance: int = 0,
+        b_balance: int = 0,
+        total_liquidity_tokens: int = 0,
+        capacity: int = 1024,
+    ):
+        self.math = math
+        self.a_balance = a_balance
+        self.b_balance = b_balance
+        self.total_liquidity_tokens = total_liquidity_tokens
+        self.addresses = []
+        self.index = {}  # address -> row
+        self._columns = {name: np.zeros(capacity, np.uint64) for name in COLUMNS}
+
+    @classmethod
+    def from_state(cls, params: dict, global_state, local_states) -> "PositionLedger":
+        """
+        Ledger of a pool deployed with the parameters of state.py, given a
+        row of helpers.schema.decode_global_states and the rows of
+        decode_local_states.
+        """
+        ledger = cls(
+            PoolMath.from_params(params),
+            int(global_state["a_balance"]),
+            int(global_state["b_balance"]),
+            int(global_state["total_liquidity_tokens"]),
+            capacity=max(len(local_states), 1),
+        )
+        rows = ledger.rows(local_states["address"])
+        for name in COLUMNS:
+            ledger._columns[name][rows] = local_states[name]
+        return ledger
+
+    def __len__(self) -> int:
+        return len(self.addresses)
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        # View of a column over the known accounts
+        return self._columns[name][: len(self.addresses)]
+
+    def rows(self, addresses) -> np.ndarray:
+        """
+        Rows of the addresses, accounts seen for the first time are added
+        with an empty position like an opt in.
+        """
+        rows, new = self._lookup(addresses)
+        self._register(new)
+        return rows
+
+    def _lookup(self, addresses) -> tuple:
+        # The rows rows() would return and the addresses it would add, without
+        # changing the ledger
+        rows = np.empty(len(addresses), np.int64)
+        new = {}
+        for position, address in enumerate(addresses):
+            row = self.index.get(address)
+            if row is None:
+                row = new.setdefault(address, len(self.addresses) + len(new))
+            rows[position] = row
+        return rows, list(new)
+
+    def _register(self, addresses):
+        for address in addresses:
+            self.index[address] = len(self.addresses)
+            self.addresses.append(address)
+        capacity = len(self._columns[COLUMNS[0]])
+        if len(self.addresses) > capacity:
+            size = max(len(self.addresses), 2 * capacity)
+            for name, column in self._columns.items():
+                self._columns[name] = np.zeros(size, np.uint64)
+                self._columns[name][:capacity] = column
+
+    def _tokens(self, rows) -> np.ndarray:
+        # Liquidity tokens of the rows as Python ints, 0 for new accounts
+        tokens = np.zeros(len(rows), object)
+        known = rows < len(self.addresses)
+        tokens[known] = self._columns["user_liquidity_tokens"][rows[known]].tolist()
+        return tokens
+
+    def position(self, address) -> dict:
+        row = self.index[address]
+        return {name: int(self._columns[name][row]) for name in COLUMNS}
+
+    def add_liquidity(self, addresses, a_amounts, b_amounts) -> np.ndarray:
+        """
+        Applies add liquidity calls in order, returns the liquidity tokens
+        minted by each.
+        """
+        a_amounts, b_amounts = _amounts(addresses, a_amounts, b_amounts)
+        a_balance = _running(self.a_balance, a_amounts)
+        b_balance = _running(self.b_balance, b_amounts)
+        minted = np.zeros(len(addresses), np.uint64)
+        while True:
+            total = _running(self.total_liquidity_tokens, minted.tolist())
+            quote, failed = self.math.add_liquidity_batch(
+                a_balance, b_balance, total, a_amounts, b_amounts
+            )
+            if np.array_equal(quote.minted, minted):
+                break
+            minted = quote.minted
+
+        if failed.any():
+            position = int(np.argmax(failed))
+            _fail(
+                position,
+                self.math.add_liquidity,
+                int(a_balance[position]),
+                int(b_balance[position]),
+                int(total[position]),
+                a_amounts[position],
+                b_amounts[position],
+            )
+        rows = self.rows(addresses)
+        np.add.at(self._columns["user_liquidity_tokens"], rows, minted)
+        self._set_reserves(quote)
+        return minted
+
+    def remove_liquidity(self, addresses, amounts) -> tuple:
+        """
+        Applies remove liquidity calls in order, returns the amounts of the
+        primary and secondary asset credited to the pending withdrawals.
+        """
+        (amounts,) = _amounts(addresses, amounts)
+        rows, new = self._lookup(addresses)
+        # The contract asserts the tokens of the sender before computing
+        # the amounts
+        burnt = np.zeros(len(rows), object)
+        burnt_by_row = {}  # row -> tokens burnt by the calls so far
+        for position, (row, amount) in enumerate(zip(rows.tolist(), amounts)):
+            burnt[position] = burnt_by_row[row] = burnt_by_row.get(row, 0) + amount
+        short = np.asarray(burnt > self._tokens(rows), bool)
+
+        total = _running(self.total_liquidity_tokens, [-amount for amount in amounts])
+        a_out = b_out = np.zeros(len(rows), np.uint64)
+        while True:
+            a_balance = _running(self.a_balance, [-out for out in a_out.tolist()])
+            b_balance = _running(self.b_balance, [-out for out in b_out.tolist()])
+            quote, failed = self.math.remove_liquidity_batch(
+                a_balance, b_balance, total, amounts
+            )
+            if np.array_equal(quote.a_out, a_out) and np.array_equal(
+                quote.b_out, b_out
+            ):
+                break
+            a_out, b_out = quote.a_out, quote.b_out
+
+        if short.any() or failed.any():
+            position = int(np.argmax(short | failed))
+            if short[position]:
+                raise TealArithmeticError(
+                    f"Call {position}: assert failed: not enough liquidity tokens"
+                )
+            _fail(
+                position,
+                self.math.remove_liquidity,
+                int(a_balance[position]),
+                int(b_balance[position]),
+                int(total[position]),
+                amounts[position],
+            )
+        self._register(new)
+        np.subtract.at(
+            self._columns["user_liquidity_tokens"], rows, np.asarray(amounts, np.uint64)
+        )
+        np.add.at(self._columns["a_to_withdraw"], rows, a_out)
+        np.add.at(self._columns["b_to_withdraw"], rows, b_out)
+        self._set_reserves(quote)
+        return a_out, b_out
+
+    def deposit_liquidity(self, addresses, amounts):
+        """
+        Applies Y calls, liquidity tokens transferred back to the escrow.
+        """
+        (amounts,) = _amounts(addresses, amounts)
+        rows, new = self._lookup(addresses)
+        added = np.zeros(len(self.addresses) + len(new), object)
+        np.add.at(added, rows, amounts)
+        held = self._tokens(np.arange(len(added)))
+        if np.any(held + added > UINT64_MAX):
+            raise TealArithmeticError("+ overflowed")
+        self._register(new)
+        np.add.at(
+            self._columns["user_liquidity_tokens"], rows, np.asarray(amounts, np.uint64)
+        )
+
+    def withdraw_liquidity(self, addresses, amounts):
+        """
+        Applies X calls, liquidity tokens transferred out of the escrow.
+        """
+        (amounts,) = _amounts(addresses, amounts)
+        rows, new = self._lookup(addresses)
+        removed = np.zeros(len(self.addresses) + len(new), object)
+        np.add.at(removed, rows, amounts)
+        if np.any(removed > self._tokens(np.arange(len(removed)))):
+            raise TealArithmeticError("assert failed: not enough liquidity tokens")
+        self._register(new)
+        np.subtract.at(
+            self._columns["user_liquidity_tokens"], rows, np.asarray(amounts, np.uint64)
+        )
+
+    def withdraw(self, addresses) -> tuple:
+        """
+        Applies W calls, returns the primary and secondary amounts paid out.
+        """
+        rows = np.unique(self.rows(addresses))
+        paid = []
+        for name in ("a_to_withdraw", "b_to_withdraw"):
+            paid.append(self._columns[name][rows].copy())
+            self._columns[name][rows] = 0
+        return tuple(paid)
+
+    def _set_reserves(self, quote):
+        # The reserves after the last call of a batch
+        if len(quote.a_balance):
+            self.a_balance = int(quote.a_balance[-1])
+            self.b_balance = int(quote.b_balance[-1])
+            self.total_liquidity_tokens = int(quote.total_liquidity_tokens[-1])
+
+    def redeemable(self) -> tuple:
+        """
+        Primary and secondary amounts each account would be credited for
+        removing all of its liquidity tokens from the current reserves, and
+        where the contract would fail to compute them. Accounts without
+        tokens are valued at 0.
+        """
+        quote, failed = self.math.remove_liquidity_batch(
+            self.a_balance,
+            self.b_balance,
+            max(self.total_liquidity_tokens, 1),
+            self["user_liquidity_tokens"],
+        )
+        return quote.a_out, quote.b_out, failed
+
+
+def _amounts(addresses, *amounts) -> list:
+    # Python ints, so that the math is not done in floats or wrapped around
+    amounts = [[int(value) for value in values] for values in amounts]
+    for values in amounts:
+        if len(values) != len(addresses):
+            raise ValueError("Expected an amount for every address")
+        if any(value < 0 or value >= 2 ** 64 for value in values):
+            raise ValueError("Amounts are uint64 values")
+    return amounts
+
+
+def _running(initial: int, changes: list) -> np.ndarray:
+    # The value before each change, clipped to uint64 after a change the
+    # contract would reject, which leaves the later calls irrelevant
+    values = np.cumsum([initial, *changes], dtype=object)[:-1]
+    return np.clip(values, 0, UINT64_MAX).astype(np.uint64)
+
+
+def _fail(position: int, method, *args):
+    # The scalar method raises the error of the call the batch flagged
+    try:
+        method(*args)
+    except TealArithmeticError as error:
+        raise TealArithmeticError(f"Call {position}: {error}") from None
+    raise TealArithmeticError(f"Call {position}: failed")
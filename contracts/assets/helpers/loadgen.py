@@ -0,0 +1,492 @@
+"""
+Signed transaction groups of every pool operation, built offline for load tests.
+
+Every operation is built in the group shape escrow.py and state.py check:
+
+    A  app call, secondary deposit, primary deposit
+    S  app call, deposit (with settle_swaps: payout by the escrow, fee payment)
+    W  app call, secondary payout, primary payout by the escrow, fee payment
+    R  app call
+    X  app call, liquidity token payout by the escrow, fee payment
+    Y  app call, liquidity token deposit
+
+Transactions are encoded as canonical msgpack, like algod expects them. The
+fields which do not change between the groups of an operation are encoded
+once into templates, so a group only encodes its sender and a counter in the
+note of the app call, which keeps every group distinct, hashes the group ID
+and signs. User transactions are signed with ed25519 keys derived from
+``seed`` (PyNaCl), escrow transactions carry the escrow LogicSig, and groups
+are built in chunks over a process pool. Nothing is sent, groups are written
+to a file for replay, each prefixed by its length as a big-endian uint32,
+ready to be posted to ``/v2/transactions``:
+
+    cd assets && python -m helpers.loadgen "{app_id: 14104138, secondary: 14098899, liquidity: 14104147, groups: {S: 100000, A: 1000}, out: groups.bin}"
+
+Swaps alternate between the primary and secondary asset. The amounts of W
+and X have to match the local state of the senders when the groups are
+sent, the accounts themselves are listed with ``addresses`` to be funded
+and opted in beforehand.
+"""
+import base64
+import hashlib
+import struct
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from helpers.interpreter import encode_address
+from helpers.parse import parse_args
+
+try:
+    from nacl.signing import SigningKey
+except ImportError:  # pragma: no cover
+    SigningKey = None
+
+OPERATIONS = ("A", "S", "W", "R", "X", "Y")
+
+FEE = 1000
+
+# Amounts of the groups, the primary amount first
+DEFAULT_AMOUNTS = {
+    "A": [1000000, 1000000],
+    "S": 1000,
+    "W": [1, 1],
+    "R": 1000,
+    "X": 1,
+    "Y": 1,
+}
+
+
+def _empty(value) -> bool:
+    # Canonical encoding leaves out fields with zero values
+    return value is None or (not isinstance(value, int) and not value) or value == 0
+
+
+def _map_header(size: int) -> bytes:
+    return bytes([0x80 | size]) if size < 16 else b"\xde" + struct.pack(">H", size)
+
+
+def pack(value) -> bytes:
+    """
+    Canonical msgpack of the values transactions are made of.
+    """
+    if isinstance(value, int):
+        if value < 0:
+            raise ValueError("Transactions only hold unsigned ints")
+        if value < 0x80:
+            return bytes([value])
+        for prefix, size in ((b"\xcc", 1), (b"\xcd", 2), (b"\xce", 4), (b"\xcf", 8)):
+            if value < 1 << (8 * size):
+                return prefix + value.to_bytes(size, "big")
+        raise ValueError(f"{value} is not a uint64")
+    if isinstance(value, bytes):
+        if len(value) < 1 << 8:
+            return b"\xc4" + bytes([len(value)]) + value
+        if len(value) < 1 << 16:
+            return b"\xc5" + struct.pack(">H", len(value)) + value
+        return b"\xc6" + struct.pack(">I", len(value)) + value
+    if isinstance(value, str):
+        encoded = value.encode()
+        if len(encoded) < 32:
+            return bytes([0xA0 | len(encoded)]) + encoded
+        if len(encoded) < 1 << 8:
+            return b"\xd9" + bytes([len(encoded)]) + encoded
+        return b"\xda" + struct.pack(">H", len(encoded)) + encoded
+    if isinstance(value, (list, tuple)):
+        header = (
+            bytes([0x90 | len(value)])
+            if len(value) < 16
+            else b"\xdc" + struct.pack(">H", len(value))
+        )
+        return header + b"".join(pack(item) for item in value)
+    if isinstance(value, dict):
+        items = sorted((key, item) for key, item in value.items() if not _empty(item))
+        return _map_header(len(items)) + b"".join(
+            pack(key) + pack(item) for key, item in items
+        )
+    raise TypeError(f"Cannot encode {type(value).__name__}")
+
+
+def sha512_256(data: bytes) -> bytes:
+    return hashlib.new("sha512_256", data).digest()
+
+
+class TxnTemplate:
+    """
+    A transaction with its fields encoded once, apart from those named in
+    ``dynamic``, which have to be non-zero, and the group ID.
+    """
+
+    def __init__(self, fields: dict, dynamic=()):
+        keys = {key for key, value in fields.items() if not _empty(value)}
+        keys = sorted(keys | set(dynamic) | {"grp"})
+        # Encoded headers of the transaction without and with its group ID
+        self.header = _map_header(len(keys) - 1)
+        self.grouped_header = _map_header(len(keys))
+        self.head, self.tail = [], []  # static bytes or dynamic keys
+        chunks = self.head
+        for key in keys:
+            if key == "grp":
+                chunks = self.tail
+                continue
+            if key in dynamic:
+                chunks.extend([pack(key), key])
+            else:
+                chunks.append(pack(key) + pack(fields[key]))
+        self.head = self._merge(self.head)
+        self.tail = self._merge(self.tail)
+
+    @staticmethod
+    def _merge(chunks: list) -> list:
+        merged = []
+        for chunk in chunks:
+            if merged and isinstance(chunk, bytes) and isinstance(merged[-1], bytes):
+                merged[-1] += chunk
+            else:
+                merged.append(chunk)
+        return merged
+
+    def encode(self, values: dict) -> tuple:
+        """
+        The encoded fields before and after the group ID.
+        """
+        return tuple(
+            b"".join(
+                chunk if isinstance(chunk, bytes) else pack(values[chunk])
+                for chunk in chunks
+            )
+            for chunks in (self.head, self.tail)
+        )
+
+
+GRP_KEY = pack("grp")
+SIG_PREFIX = b"\x82" + pack("sig")
+TXN_KEY = pack("txn")
+
+
+def account_seed(seed: int, index: int) -> bytes:
+    """
+    ed25519 seed of the ``index``-th account of the load generator.
+    """
+    return sha512_256(b"asaswap-loadgen" + struct.pack(">QQ", seed, index))
+
+
+class GroupBuilder:
+    """
+    Builds the groups of a pool deployed with the parameters of state.py,
+    ``assets`` being its ``primary`` (ASA_TO_ASA only), ``secondary`` and
+    ``liquidity`` asset IDs and ``network`` its ``genesis_id``,
+    ``genesis_hash`` (base64) and ``first_valid`` and ``last_valid`` rounds.
+    """
+
+    def __init__(
+        self,
+        params: dict,
+        app_id: int,
+        escrow_program: bytes,
+        assets: dict,
+        network: dict,
+        accounts: int = 100,
+        seed: int = 0,
+        amounts: dict = None,
+    ):
+        from state import ExchangeType
+
+        if SigningKey is None:
+            raise ImportError("PyNaCl is required to sign the groups")
+        self.asa = params["type"] == ExchangeType.ASA_TO_ASA
+        if self.asa and not assets.get("primary"):
+            raise ValueError("ASA_TO_ASA pools need the primary asset ID")
+        self.settle_swaps = bool(params["settle_swaps"])
+        self.limits = bool(params["limits"])
+        self.app_id = app_id
+        self.assets = assets
+        self.amounts = {**DEFAULT_AMOUNTS, **(amounts or {})}
+        self.escrow = sha512_256(b"Program" + escrow_program)
+        self.lsig = pack("lsig") + pack({"l": escrow_program})
+        self.common = {
+            "fee": FEE,
+            "fv": int(network["first_valid"]),
+            "lv": int(network["last_valid"]),
+            "gen": network["genesis_id"],
+            "gh": base64.b64decode(network["genesis_hash"]),
+        }
+        self.seeds = [account_seed(seed, index) for index in range(accounts)]
+        self.public_keys = [
+            bytes(SigningKey(account).verify_key) for account in self.seeds
+        ]
+        self._keys = None
+        self.shapes = {operation: self._shape(operation) for operation in OPERATIONS}
+
+    def __getstate__(self):
+        # Signing keys are derived again by the worker processes
+        state = dict(self.__dict__)
+        state["_keys"] = None
+        return state
+
+    def addresses(self) -> list:
+        return [encode_address(public_key) for public_key in self.public_keys]
+
+    def _call(self, *args) -> TxnTemplate:
+        return TxnTemplate(
+            dict(
+                self.common,
+                type="appl",
+                apid=self.app_id,
+                apaa=[arg if isinstance(arg, bytes) else pack_arg(arg) for arg in args],
+            ),
+            dynamic=("snd", "note"),
+        )
+
+    def _transfer(self, asset: str, amount: int, to_escrow: bool) -> tuple:
+        # Template and signer of a transfer between the sender and the escrow
+        if asset == "primary" and not self.asa:
+            fields = dict(self.common, type="pay", amt=amount)
+            party = "rcv"
+        else:
+            fields = dict(
+                self.common, type="axfer", aamt=amount, xaid=self.assets[asset]
+            )
+            party = "arcv"
+        if to_escrow:
+            fields[party] = self.escrow
+            return TxnTemplate(fields, dynamic=("snd",)), "sender"
+        fields["snd"] = self.escrow
+        return TxnTemplate(fields, dynamic=(party,)), "escrow"
+
+    def _fee_payment(self, fees: int) -> tuple:
+        return (
+            TxnTemplate(
+                dict(self.common, type="pay", amt=fees * FEE, rcv=self.escrow),
+                dynamic=("snd",),
+            ),
+            "sender",
+        )
+
+    def _shape(self, operation: str) -> list:
+        """
+        Templates and signers of the transactions of the operation, for
+        swaps of the primary and of the secondary asset.
+        """
+        amounts = self.amounts[operation]
+        if operation == "A":
+            primary, secondary = amounts
+            return [
+                (self._call(b"A"), "sender"),
+                self._transfer("secondary", secondary, True),
+                self._transfer("primary", primary, True),
+            ]
+        if operation == "S":
+            args = (b"S", 1) if self.limits else (b"S",)
+            shapes = []
+            for asset, other in (("primary", "secondary"), ("secondary", "primary")):
+                shape = [(self._call(*args), "sender"), self._transfer(asset, amounts, True)]
+                if self.settle_swaps:
+                    # The contract accepts payouts below the swapped amount
+                    shape += [self._transfer(other, 1, False), self._fee_payment(1)]
+                shapes.append(shape)
+            return shapes
+        if operation == "W":
+            primary, secondary = amounts
+            return [
+                (self._call(b"W"), "sender"),
+                self._transfer("secondary", secondary, False),
+                self._transfer("primary", primary, False),
+                self._fee_payment(2),
+            ]
+        if operation == "R":
+            args = (b"R", amounts, 1, 1) if self.limits else (b"R", amounts)
+            return [(self._call(*args), "sender")]
+        if operation == "X":
+            return [
+                (self._call(b"X"), "sender"),
+                self._transfer("liquidity", amounts, False),
+                self._fee_payment(1),
+            ]
+        return [
+            (self._call(b"Y"), "sender"),
+            self._transfer("liquidity", amounts, True),
+        ]
+
+    def group(self, operation: str, index: int) -> bytes:
+        """
+        The ``index``-th signed group of the operation, the signed
+        transactions encoded one after the other.
+        """
+        if self._keys is None:
+            self._keys = [SigningKey(account) for account in self.seeds]
+        shape = self.shapes[operation]
+        if operation == "S":
+            shape = shape[index % 2]
+        account = index % len(self.seeds)
+        public_key = self.public_keys[account]
+        values = {
+            "snd": public_key,
+            "rcv": public_key,
+            "arcv": public_key,
+            "note": pack_arg(index),
+        }
+        parts = [template.encode(values) for template, _ in shape]
+        if len(parts) == 1:
+            template = shape[0][0]
+            txns = [template.header + parts[0][0] + parts[0][1]]
+        else:
+            ids = [
+                sha512_256(b"TX" + template.header + head + tail)
+                for (template, _), (head, tail) in zip(shape, parts)
+            ]
+            group_id = pack(sha512_256(b"TG" + pack({"txlist": ids})))
+            txns = [
+                template.grouped_header + head + GRP_KEY + group_id + tail
+                for (template, _), (head, tail) in zip(shape, parts)
+            ]
+
+        signed = []
+        for (_, signer), txn in zip(shape, txns):
+            if signer == "escrow":
+                signed.append(b"\x82" + self.lsig + TXN_KEY + txn)
+            else:
+                signature = self._keys[account].sign(b"TX" + txn).signature
+                signed.append(SIG_PREFIX + pack(signature) + TXN_KEY + txn)
+        return b"".join(signed)
+
+    def groups(self, operation: str, start: int, count: int) -> list:
+        return [self.group(operation, index) for index in range(start, start + count)]
+
+
+def pack_arg(value: int) -> bytes:
+    # Int app args and notes as 8 byte big-endian values, like Btoi reads them
+    return value.to_bytes(8, "big")
+
+
+def _build_chunk(job) -> list:
+    builder, operation, start, count = job
+    return builder.groups(operation, start, count)
+
+
+def build_groups(
+    builder: GroupBuilder,
+    operation: str,
+    count: int,
+    start: int = 0,
+    jobs: int = None,
+    chunk_size: int = 1000,
+):
+    """
+    Yields ``count`` groups of the operation in order, built in chunks over
+    a process pool.
+    """
+    chunks = [
+        (builder, operation, first, min(chunk_size, start + count - first))
+        for first in range(start, start + count, chunk_size)
+    ]
+    if len(chunks) > 1 and jobs != 1:
+        with ProcessPoolExecutor(jobs) as executor:
+            for groups in executor.map(_build_chunk, chunks):
+                yield from groups
+    else:
+        for chunk in chunks:
+            yield from _build_chunk(chunk)
+
+
+def write_groups(path: str, groups) -> int:
+    """
+    Writes the groups for replay, returns how many were written.
+    """
+    written = 0
+    with open(path, "wb") as f:
+        for group in groups:
+            f.write(struct.pack(">I", len(group)))
+            f.write(group)
+            written += 1
+    return written
+
+
+def read_groups(path: str):
+    """
+    The groups of a file written by ``write_groups``.
+    """
+    with open(path, "rb") as f:
+        while True:
+            size = f.read(4)
+            if not size:
+                return
+            yield f.read(struct.unpack(">I", size)[0])
+
+
+if __name__ == "__main__":
+    from helpers.template import EscrowTemplate, compile_template
+    from state import DEFAULT_PARAMS
+
+    params = {
+        **DEFAULT_PARAMS,
+        "app_id": 123,
+        "template": None,
+        "primary": None,
+        "secondary": 0,
+        "liquidity": 0,
+        "genesis_id": "sandnet-v1",
+        "genesis_hash": base64.b64encode(bytes(32)).decode(),
+        "first_valid": 1,
+        "last_valid": 1001,
+        "accounts": 100,
+        "seed": 0,
+        "amounts": {},
+        "groups": {"S": 10000},
+        "jobs": None,
+        "chunk_size": 1000,
+        "out": None,
+        "addresses": False,
+    }
+
+    # Overwrite params if sys.argv[1] is passed
+    if len(sys.argv) > 1:
+        params = parse_args(sys.argv[1], params)
+
+    if params["template"]:
+        template = EscrowTemplate.load(params["template"])
+        if template.settle_swaps != bool(params["settle_swaps"]):
+            raise ValueError("The escrow template does not match settle_swaps")
+    else:
+        template = compile_template(
+            bool(params["optimize"]), bool(params["settle_swaps"])
+        )
+    builder = GroupBuilder(
+        params,
+        int(params["app_id"]),
+        template.bytecode(int(params["app_id"])),
+        {name: params[name] for name in ("primary", "secondary", "liquidity")},
+        params,
+        int(params["accounts"]),
+        int(params["seed"]),
+        params["amounts"],
+    )
+    if params["addresses"]:
+        print("\n".join(builder.addresses()))
+
+    def generate():
+        for operation, count in params["groups"].items():
+            started = time.perf_counter()
+            size = 0
+            for group in build_groups(
+                builder,
+                operation,
+                int(count),
+                jobs=params["jobs"],
+                chunk_size=int(params["chunk_size"]),
+            ):
+                size += len(group)
+                yield group
+            elapsed = time.perf_counter() - started
+            print(
+                f"{operation}: {count} groups in {elapsed:.2f}s, "
+                f"{int(count) / elapsed:.0f} groups/s, {size} bytes",
+                file=sys.stderr,
+            )
+
+    if params["out"]:
+        written = write_groups(params["out"], generate())
+        print(f"{written} groups written to {params['out']}", file=sys.stderr)
+    else:
+        for _ in generate():
+            pass
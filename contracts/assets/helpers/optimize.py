@@ -0,0 +1,467 @@
+"""
+Peephole optimizer for the TEAL produced by compileTeal.
+
+- Constants are folded: ``int 2; int 3; *`` becomes ``int 6`` unless it
+  fails, and ``int 0; ==`` becomes ``!``.
+- Branches on constants become jumps or are dropped, code after ``b``,
+  ``return`` and ``err`` up to the next used label is dropped as
+  unreachable, and so are jumps to the label right after them.
+- ``bnz L; err; L:`` becomes ``bz`` to a single ``err`` at the end.
+- ``int 0; !=`` is dropped before ops which only test a value for zero.
+- Expressions computed again on the same path, like ``byte "E";
+  app_global_get``, are stored in a scratch slot the first time and loaded
+  afterwards, until the state they read is written.
+- The constants are moved into explicit constant blocks ordered by use, so
+  the four most used ints and byte strings are pushed by single byte opcodes.
+
+Every rewrite is measured and kept only if the program gets neither larger
+nor more expensive.
+"""
+from collections import Counter
+
+from helpers.interpreter import Program, _int_value, _parse_bytes, decode_address
+
+LABEL = "label"
+
+_BINARY = {
+    "+",
+    "-",
+    "/",
+    "*",
+    "%",
+    "<",
+    ">",
+    "<=",
+    ">=",
+    "&&",
+    "||",
+    "==",
+    "!=",
+    "|",
+    "&",
+    "^",
+    "concat",
+}
+_BRANCHES = {"b", "bz", "bnz"}
+# Ops which only test whether the value on top of the stack is zero
+_TESTS = {"&&", "||", "!", "bz", "bnz"}
+_UNARY = {
+    "!",
+    "~",
+    "len",
+    "itob",
+    "btoi",
+    "sha256",
+    "keccak256",
+    "sha512_256",
+    "substring",
+    "balance",
+    "app_global_get",
+}
+_PUSH = {
+    "int",
+    "byte",
+    "addr",
+    "txn",
+    "gtxn",
+    "txna",
+    "gtxna",
+    "global",
+    "load",
+    "arg",
+    "arg_0",
+    "arg_1",
+    "arg_2",
+    "arg_3",
+}
+
+# (popped, pushed) values of each opcode
+STACK_EFFECTS = {
+    **{opcode: (2, 1) for opcode in _BINARY},
+    **{opcode: (1, 1) for opcode in _UNARY},
+    **{opcode: (0, 1) for opcode in _PUSH},
+    "ed25519verify": (3, 1),
+    "substring3": (3, 1),
+    "app_local_get": (2, 1),
+    "app_opted_in": (2, 1),
+    "mulw": (2, 2),
+    "addw": (2, 2),
+    "dup": (1, 2),
+    "dup2": (2, 4),
+    "app_global_get_ex": (2, 2),
+    "app_local_get_ex": (3, 2),
+    "asset_holding_get": (2, 2),
+    "pop": (1, 0),
+    "store": (1, 0),
+    "app_global_put": (2, 0),
+    "app_local_put": (3, 0),
+    "app_global_del": (1, 0),
+    "app_local_del": (2, 0),
+    "bnz": (1, 0),
+    "bz": (1, 0),
+    "return": (1, 0),
+    "b": (0, 0),
+    "err": (0, 0),
+}
+# Single results which are not expressions of their arguments
+_OPAQUE = {"dup", "dup2"}
+_TERMINAL = {"err", "return", "b"}
+
+_FOLDS = {
+    "+": lambda a, b: a + b,
+    "-": lambda a, b: a - b,
+    "*": lambda a, b: a * b,
+    "/": lambda a, b: a // b if b else None,
+    "%": lambda a, b: a % b if b else None,
+    "<": lambda a, b: int(a < b),
+    ">": lambda a, b: int(a > b),
+    "<=": lambda a, b: int(a <= b),
+    ">=": lambda a, b: int(a >= b),
+    "==": lambda a, b: int(a == b),
+    "!=": lambda a, b: int(a != b),
+    "&&": lambda a, b: int(a != 0 and b != 0),
+    "||": lambda a, b: int(a != 0 or b != 0),
+    "|": lambda a, b: a | b,
+    "&": lambda a, b: a & b,
+    "^": lambda a, b: a ^ b,
+    "!": lambda a: int(a == 0),
+    "~": lambda a: a ^ 0xFFFFFFFFFFFFFFFF,
+}
+
+
+def optimize(source: str, out=None) -> str:
+    """
+    Optimized version of a TEAL program, the sizes and costs before and
+    after are printed to ``out`` if given.
+    """
+    version, items = parse(source)
+
+    def measure(items):
+        program = Program(emit(version, reorder_constants(items)))
+        return program.size, program.static_cost
+
+    items = _improve(items, _folds, measure)
+    items = _improve(items, _branch_folds, measure)
+    items = _improve(items, _shared_err, measure)
+    items = _improve(items, _common_subexpressions, measure)
+    optimized = emit(version, reorder_constants(items))
+    if out is not None:
+        before, after = Program(source), Program(optimized)
+        print(
+            f"size {before.size} -> {after.size} bytes, "
+            f"cost {before.static_cost} -> {after.static_cost} opcodes",
+            file=out,
+        )
+    return optimized
+
+
+def parse(source: str):
+    version = 1
+    items = []  # (opcode, args), labels as (LABEL, (name,))
+    for line in source.splitlines():
+        line = line.strip()
+        if not line or line.startswith("//"):
+            continue
+        if line.startswith("#pragma version"):
+            version = int(line.split()[2])
+        elif line.endswith(":") and " " not in line:
+            items.append((LABEL, (line[:-1],)))
+        elif line.startswith(("byte ", "addr ")):
+            opcode, rest = line.split(None, 1)
+            items.append((opcode, (rest,)))
+        else:
+            opcode, *args = line.split()
+            if opcode.startswith(("intc", "bytec")):
+                raise ValueError("The program already has constant blocks")
+            items.append((opcode, tuple(args)))
+    return version, items
+
+
+def emit(version: int, items: list) -> str:
+    lines = [f"#pragma version {version}"]
+    for opcode, args in items:
+        lines.append(f"{args[0]}:" if opcode == LABEL else " ".join((opcode,) + args))
+    return "\n".join(lines)
+
+
+def reorder_constants(items: list) -> list:
+    """
+    Replaces int, byte and addr with references to explicit constant blocks
+    sorted by the number of uses.
+    """
+    values = [_constant(opcode, args) for opcode, args in items]
+    blocks = []
+    references = {}
+    for kind, block_opcode in (("int", "intcblock"), ("byte", "bytecblock")):
+        counts = Counter(value for value in values if value and value[0] == kind)
+        if not counts:
+            continue
+        if len(counts) > 256:
+            raise ValueError(f"Too many {kind} constants")
+        ordered = [value for value, count in counts.most_common()]
+        if kind == "int":
+            blocks.append((block_opcode, tuple(str(value) for _, value in ordered)))
+        else:
+            blocks.append(
+                (block_opcode, tuple("0x" + value.hex() for _, value in ordered))
+            )
+        references.update((value, index) for index, value in enumerate(ordered))
+
+    result = blocks
+    for item, value in zip(items, values):
+        if value is None:
+            result.append(item)
+            continue
+        base = "intc" if value[0] == "int" else "bytec"
+        index = references[value]
+        result.append((f"{base}_{index}", ()) if index < 4 else (base, (str(index),)))
+    return result
+
+
+def _constant(opcode, args):
+    if opcode == "int":
+        return "int", _int_value(args)
+    if opcode == "byte":
+        return "byte", _parse_bytes(args)
+    if opcode == "addr":
+        return "byte", decode_address(args[0])
+    return None
+
+
+def _improve(items, candidates, measure):
+    """
+    Applies the rewrites proposed by ``candidates(items)`` one at a time, as
+    long as they make the program neither larger nor more expensive.
+    """
+    score = measure(items)
+    rejected = set()
+    while True:
+        for key, rewrite in candidates(items):
+            if key in rejected:
+                continue
+            trial = rewrite()
+            trial_score = measure(trial)
+            if trial_score != score and all(map(int.__le__, trial_score, score)):
+                items, score = trial, trial_score
+                break
+            rejected.add(key)
+        else:
+            return items
+
+
+def _folds(items):
+    for index in range(len(items) - 1):
+        first = _constant(*items[index])
+        if first is None or first[0] != "int":
+            continue
+        opcode = items[index + 1][0]
+        if first[1] == 0 and opcode == "==":
+            yield _fold(items, index, 2, ("!", ()))
+        elif (
+            first[1] == 0
+            and opcode == "!="
+            and index + 2 < len(items)
+            and items[index + 2][0] in _TESTS
+        ):
+            yield _fold(items, index, 2, None)
+        elif opcode in ("!", "~"):
+            yield _fold(items, index, 2, _int_item(_FOLDS[opcode](first[1])))
+        elif index + 2 < len(items) and items[index + 2][0] in _FOLDS:
+            second = _constant(*items[index + 1])
+            if second is None or second[0] != "int":
+                continue
+            value = _FOLDS[items[index + 2][0]](first[1], second[1])
+            # Operations which fail are left to fail when evaluated
+            if value is not None and 0 <= value <= 0xFFFFFFFFFFFFFFFF:
+                yield _fold(items, index, 3, _int_item(value))
+
+
+def _branch_folds(items):
+    targets = {args[0] for opcode, args in items if opcode in _BRANCHES}
+    for index in range(len(items) - 1):
+        opcode, args = items[index]
+        following = items[index + 1]
+        if opcode in ("b", "return", "err"):
+            end = index + 1
+            while end < len(items) and (
+                items[end][0] != LABEL or items[end][1][0] not in targets
+            ):
+                end += 1
+            if end > index + 1:
+                yield _fold(items, index + 1, end - index - 1, None)
+        if opcode == "b" and following == (LABEL, args):
+            yield _fold(items, index, 1, None)
+        constant = _constant(opcode, args)
+        if constant is None or constant[0] != "int":
+            continue
+        if following[0] in ("bnz", "bz"):
+            taken = (constant[1] != 0) == (following[0] == "bnz")
+            yield _fold(items, index, 2, ("b", following[1]) if taken else None)
+
+
+def _shared_err(items):
+    matches = [
+        index
+        for index in range(len(items) - 2)
+        if items[index][0] == "bnz"
+        and items[index + 1] == ("err", ())
+        and items[index + 2] == (LABEL, items[index][1])
+    ]
+    # The err is appended where the program cannot fall through or jump to
+    targets = {args[0] for opcode, args in items if opcode in _BRANCHES}
+    last = len(items) - 1
+    while last >= 0 and items[last][0] == LABEL:
+        if items[last][1][0] in targets:
+            return
+        last -= 1
+    if len(matches) < 2 or items[last][0] not in ("b", "return", "err"):
+        return
+    labels = {args[0] for opcode, args in items if opcode == LABEL}
+    label = "fail"
+    while label in labels:
+        label += "_"
+
+    def rewrite():
+        result = list(items)
+        for index in reversed(matches):
+            result[index : index + 2] = [("bz", (label,))]
+        return result + [(LABEL, (label,)), ("err", ())]
+
+    yield ("shared err", tuple(matches)), rewrite
+
+
+def _fold(items, index, length, replacement):
+    key = (tuple(items[index : index + length]), replacement)
+    replaced = [] if replacement is None else [replacement]
+    return key, lambda: items[:index] + replaced + items[index + length :]
+
+
+def _int_item(value):
+    return "int", (str(value),)
+
+
+def _common_subexpressions(items):
+    """
+    Expressions of more than one opcode computed again where their first
+    result is still valid, the most expensive ones first.
+    """
+    groups = [group for group in _repeated_expressions(items) if len(group) > 1]
+    groups.sort(key=lambda group: -(group[0][1] - group[0][0] - 1) * (len(group) - 1))
+    slot = 1 + max(
+        [int(args[0]) for opcode, args in items if opcode in ("load", "store")],
+        default=-1,
+    )
+    if slot > 255:
+        return
+    for group in groups:
+        start, end = group[0]
+        yield tuple(items[start:end]), lambda group=group: _store_group(
+            items, group, slot
+        )
+
+
+def _store_group(items, group, slot):
+    (first_start, first_end), *others = group
+    result = list(items)
+    # Later segments first, so that the earlier positions stay valid
+    for start, end in reversed(others):
+        result[start:end] = [("load", (str(slot),))]
+    result[first_end:first_end] = [("dup", ()), ("store", (str(slot),))]
+    return result
+
+
+def _repeated_expressions(items):
+    """
+    Groups of (start, end) segments evaluating the same expression, the
+    first segment of each group is evaluated before all the others on every
+    path reaching them.
+
+    Availability follows branches into labels with a single way in, like
+    the label after the ``bnz; err`` of an Assert or the handlers of a
+    Cond, and is dropped at labels reached in more than one way.
+    """
+    incoming = Counter(
+        args[0] for opcode, args in items if opcode in ("bnz", "bz", "b")
+    )
+    snapshots = {}  # label -> expressions available where it is branched to
+    groups = []
+    available = {}  # key -> (group, reads)
+    stack = []  # (key, start, end, reads), key None for unknown values
+    terminal = True
+    for index, (opcode, args) in enumerate(items):
+        if opcode == LABEL:
+            ways = incoming[args[0]] + (0 if terminal else 1)
+            if ways != 1:
+                available = {}
+            elif args[0] in snapshots:
+                available = dict(snapshots[args[0]])
+            stack = []
+            terminal = False
+            continue
+        terminal = opcode in _TERMINAL
+        if opcode in ("bnz", "bz", "b"):
+            snapshots[args[0]] = dict(available)
+        if opcode not in STACK_EFFECTS:
+            available, stack = {}, []
+            continue
+
+        popped, pushed = STACK_EFFECTS[opcode]
+        children = stack[len(stack) - popped :] if popped else []
+        del stack[len(stack) - popped :]
+        children = [None] * (popped - len(children)) + children
+        node = None
+        if pushed == 1 and opcode not in _OPAQUE:
+            node = _node(opcode, args, index, children)
+        stack.extend([node] if node else [(None, index, index + 1, ())] * pushed)
+
+        if node and node[0] and children:
+            key, start, end, reads = node
+            if key in available:
+                available[key][0].append((start, end))
+            else:
+                group = [(start, end)]
+                groups.append(group)
+                available[key] = group, reads
+
+        for written in _writes(opcode, args):
+            available = {
+                key: value for key, value in available.items() if written not in value[1]
+            }
+    return groups
+
+
+def _node(opcode, args, index, children):
+    # Children have to be evaluated one right after another, otherwise the
+    # segment would include other side effects
+    position = children[0][1] if children and children[0] else index
+    for child in children:
+        if child is None or child[0] is None or child[1] != position:
+            return None, index, index + 1, ()
+        position = child[2]
+    if position != index:
+        return None, index, index + 1, ()
+    constant = _constant(opcode, args)
+    key = (constant or (opcode, args),) + tuple(child[0] for child in children)
+    reads = set().union(*(child[3] for child in children), _reads(opcode, args))
+    start = children[0][1] if children else index
+    return key, start, index + 1, frozenset(reads)
+
+
+def _reads(opcode, args):
+    if opcode in ("app_global_get", "app_global_get_ex"):
+        return {"global"}
+    if opcode in ("app_local_get", "app_local_get_ex"):
+        return {"local"}
+    if opcode == "load":
+        return {("slot", args[0])}
+    return set()
+
+
+def _writes(opcode, args):
+    if opcode in ("app_global_put", "app_global_del"):
+        return {"global"}
+    if opcode in ("app_local_put", "app_local_del"):
+        return {"local"}
+    if opcode == "store":
+        return {("slot", args[0])}
+    return set()
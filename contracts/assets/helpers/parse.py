@@ -5,10 +5,18 @@ import yaml
 def parse_args(args, sc_param):
     # decode external parameter and update current values.
     # (if an external paramter is passed)
+    # A list of parameters (a build manifest) is decoded into a list of
+    # current values updated by each of its entries.
     try:
         param = yaml.safe_load(args)
-        for key, value in param.items():
-            sc_param[key] = value
-        return sc_param
+        if isinstance(param, list):
+            return [update_params(dict(sc_param), entry) for entry in param]
+        return update_params(sc_param, param)
     except yaml.YAMLError as exc:
         print(exc)
+
+
+def update_params(sc_param, param):
+    for key, value in param.items():
+        sc_param[key] = value
+    return sc_param
@@ -0,0 +1,245 @@
+"""
+Attributes the executed cost of state.py programs to the contract methods
+which built each instruction.
+
+The contract is compiled with its methods wrapped, so that every expression
+is mapped to the methods on the call stack when it was built, for instance
+``get_contract;on_swap;swap_ops;get_secondary_out;get_exchange_rate``. The
+executed instructions are counted either by evaluating the representative
+groups of helpers.benchmark, or from the ``app-call-trace`` of dry-run
+responses returned by algod (``POST /v2/teal/dryrun``):
+
+    cd assets && python -m helpers.profiler "{type: ASA_TO_ASA}"
+    cd assets && python -m helpers.profiler "{dryrun: [swaps.json, withdrawals.json]}"
+
+The report lists the cost spent in each method and in the methods it
+called. ``folded: <path>`` also writes the stacks in the folded format read
+by flamegraph.pl and speedscope.
+"""
+import functools
+import json
+import sys
+
+import pyteal.compiler as compiler
+from pyteal import Expr, Mode, TealLabel, compileTeal
+
+from helpers.interpreter import Program
+from helpers.parse import parse_args
+
+CONSTANT_BLOCKS = ("(constant blocks)",)
+
+
+def record_origins(contract) -> dict:
+    """
+    Wraps the methods of ``contract`` to map every expression they return to
+    the methods on the call stack. Returns the mapping, filled in as the
+    contract is built.
+    """
+    origins = {}  # id(expr) -> (expr, frames), keeping the expr alive
+    stack = []
+    for name in dir(type(contract)):
+        if name.startswith("__") or not callable(getattr(type(contract), name)):
+            continue
+        method = getattr(contract, name)
+        setattr(contract, name, _recorded(method, name, stack, origins))
+    return origins
+
+
+def _recorded(method, name, stack, origins):
+    @functools.wraps(method)
+    def recorded(*args, **kwargs):
+        stack.append(name)
+        try:
+            result = method(*args, **kwargs)
+            # Expressions built by the methods called from here are already
+            # mapped to the deeper stacks
+            _map_origin(result, tuple(stack), origins)
+        finally:
+            stack.pop()
+        return result
+
+    return recorded
+
+
+def _map_origin(value, frames, origins):
+    if isinstance(value, Expr):
+        if id(value) in origins:
+            return
+        origins[id(value)] = (value, frames)
+        value = vars(value).values()
+    elif isinstance(value, dict):
+        value = value.values()
+    elif not isinstance(value, (list, tuple)):
+        return
+    for item in value:
+        _map_origin(item, frames, origins)
+
+
+def compile_with_origins(contract, mode: Mode = Mode.Application):
+    """
+    Compiles the contract like compileTeal does, and returns the TEAL with
+    the stack of methods which built each instruction.
+    """
+    origins = record_origins(contract)
+    ast = contract.get_contract()
+
+    components = []
+    flatten_blocks = compiler.flattenBlocks
+
+    def capture(blocks):
+        components.extend(flatten_blocks(blocks))
+        return components
+
+    compiler.flattenBlocks = capture
+    try:
+        teal = compileTeal(ast, mode)
+    finally:
+        compiler.flattenBlocks = flatten_blocks
+
+    frames = []
+    for component in components:
+        if isinstance(component, TealLabel):
+            continue
+        origin = origins.get(id(component.expr))
+        if origin is not None:
+            frames.append(origin[1])
+        else:
+            # Branches added by the compiler, and expressions built while
+            # compiling, belong to the instruction before them
+            frames.append(frames[-1] if frames else ())
+    return teal, frames
+
+
+class Profile:
+    """
+    Executions of every instruction of a program, attributed to the stacks
+    of methods in ``frames``.
+    """
+
+    def __init__(self, program: Program, frames: list):
+        if len(frames) != len(program.instructions):
+            raise ValueError("Expected the stack of every instruction")
+        self.program = program
+        self.frames = frames
+        self.counts = [0] * len(frames)
+        self.constant_blocks = 0
+        self._indices = {
+            offset: index for index, offset in enumerate(program.offsets())
+        }
+
+    def add_trace(self, pcs):
+        """
+        Counts the instructions at the given pcs, the steps of a dry-run
+        trace.
+        """
+        first = self.program.offsets()[0] if self.frames else 0
+        for pc in pcs:
+            if pc < first:
+                self.constant_blocks += 1
+                continue
+            index = self._indices.get(pc)
+            if index is None:
+                raise ValueError(f"pc {pc} is not an instruction of the program")
+            self.counts[index] += 1
+
+    @property
+    def transactions(self) -> int:
+        # Every evaluation starts at the first instruction
+        return self.counts[0] if self.counts else 0
+
+    def stacks(self) -> dict:
+        """
+        Cost and opcodes executed in each stack of methods.
+        """
+        stacks = {}
+        if self.constant_blocks:
+            stacks[CONSTANT_BLOCKS] = [self.constant_blocks, self.constant_blocks]
+        for frames, count, cost in zip(self.frames, self.counts, self.program.costs):
+            if count:
+                totals = stacks.setdefault(frames, [0, 0])
+                totals[0] += count * cost
+                totals[1] += count
+        return stacks
+
+    def report(self, out=sys.stdout):
+        stacks = self.stacks()
+        total = sum(cost for cost, _ in stacks.values())
+        tree = {}  # frames -> [cost, opcodes, self cost]
+        for frames, (cost, opcodes) in stacks.items():
+            for depth in range(1, len(frames) + 1):
+                node = tree.setdefault(frames[:depth], [0, 0, 0])
+                node[0] += cost
+                node[1] += opcodes
+            tree[frames][2] += cost
+
+        print(
+            f"{self.transactions} evaluations, {total} cost "
+            f"({total / max(self.transactions, 1):.1f} per evaluation)",
+            file=out,
+        )
+        print(f"{'cost':>9}{'%':>7}{'self':>9}{'opcodes':>9}  method", file=out)
+
+        def print_children(parent):
+            children = [
+                frames
+                for frames in tree
+                if len(frames) == len(parent) + 1 and frames[: len(parent)] == parent
+            ]
+            for frames in sorted(children, key=lambda frames: -tree[frames][0]):
+                cost, opcodes, self_cost = tree[frames]
+                print(
+                    f"{cost:>9}{100 * cost / max(total, 1):>7.1f}{self_cost:>9}"
+                    f"{opcodes:>9}  {'  ' * (len(frames) - 1)}{frames[-1]}",
+                    file=out,
+                )
+                print_children(frames)
+
+        print_children(())
+
+    def folded(self, out):
+        for frames, (cost, _) in sorted(self.stacks().items()):
+            print(f"{';'.join(frames)} {cost}", file=out)
+
+
+def profile_state(params: dict, dryrun=()) -> Profile:
+    """
+    Profile of the state.py program built with ``params``, over the given
+    dry-run responses or else over the groups of helpers.benchmark.
+    """
+    from state import build_contract
+
+    if params["optimize"]:
+        raise ValueError("The optimized program can not be mapped to the methods")
+    teal, frames = compile_with_origins(build_contract(params))
+    program = Program(teal)
+    profile = Profile(program, frames)
+    for path in dryrun:
+        with open(path) as f:
+            response = json.load(f)
+        for txn in response["txns"]:
+            trace = txn.get("app-call-trace")
+            if trace:
+                profile.add_trace(step["pc"] for step in trace)
+    if not dryrun:
+        from helpers.benchmark import measure
+
+        program.record(profile.counts)
+        measure(params, program)
+        program.record(None)
+    return profile
+
+
+if __name__ == "__main__":
+    from state import DEFAULT_PARAMS
+
+    params = {**DEFAULT_PARAMS, "dryrun": [], "folded": None}
+
+    # Overwrite params if sys.argv[1] is passed
+    if len(sys.argv) > 1:
+        params = parse_args(sys.argv[1], params)
+
+    profile = profile_state(params, params["dryrun"] or ())
+    profile.report()
+    if params["folded"]:
+        with open(params["folded"], "w") as f:
+            profile.folded(f)
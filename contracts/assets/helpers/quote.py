@@ -0,0 +1,608 @@
+"""
+Off-chain model of the pool math in state.py.
+
+Every operation is evaluated in the same order as the TEAL program, with
+uint64 truncation after each step, so results are equal to what the
+contract writes into global and local state. The scalar methods raise
+TealArithmeticError wherever the program would fail, the batch methods
+take NumPy arrays and return a per-element ``failed`` mask instead.
+"""
+from collections import namedtuple
+from contextlib import contextmanager
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None
+
+UINT64_MAX = 2 ** 64 - 1
+
+SwapQuote = namedtuple("SwapQuote", ["amount_out", "a_balance", "b_balance"])
+LiquidityQuote = namedtuple(
+    "LiquidityQuote", ["minted", "a_balance", "b_balance", "total_liquidity_tokens"]
+)
+RemoveQuote = namedtuple(
+    "RemoveQuote",
+    ["a_out", "b_out", "a_balance", "b_balance", "total_liquidity_tokens"],
+)
+
+
+class TealArithmeticError(ArithmeticError):
+    """
+    Raised when the contract would reject the call because of uint64
+    overflow, underflow or division by zero.
+    """
+
+
+class _ToleranceError(TealArithmeticError):
+    """
+    Raised by check_ratio on a deposit off the pool ratio by 1% or more.
+    """
+
+
+def mul(a: int, b: int) -> int:
+    result = a * b
+    if result > UINT64_MAX:
+        raise TealArithmeticError("* overflowed")
+    return result
+
+
+def add(a: int, b: int) -> int:
+    result = a + b
+    if result > UINT64_MAX:
+        raise TealArithmeticError("+ overflowed")
+    return result
+
+
+def sub(a: int, b: int) -> int:
+    if b > a:
+        raise TealArithmeticError("- would result negative")
+    return a - b
+
+
+def div(a: int, b: int) -> int:
+    if b == 0:
+        raise TealArithmeticError("/ 0")
+    return a // b
+
+
+def mod(a: int, b: int) -> int:
+    if b == 0:
+        raise TealArithmeticError("% 0")
+    return a % b
+
+
+def mul_div(a: int, b: int, c: int) -> int:
+    """
+    helpers.wide.mul_div, a * b / c from the 128 bit product.
+    """
+    high, low = divmod(a * b, 2 ** 64)
+    if high >= div(UINT64_MAX, c):
+        raise TealArithmeticError("assert failed: product too wide for the divisor")
+    return add(
+        add(mul(high, div(UINT64_MAX, c)), div(low, c)),
+        div(add(mul(high, add(mod(UINT64_MAX, c), 1)), mod(low, c)), c),
+    )
+
+
+def minimum_out(amount_out: int, slippage_bps: int = 0) -> int:
+    """
+    Least output to accept for a quoted amount, ``slippage_bps`` basis
+    points below it. The quote itself only accepts the quoted reserves or
+    better ones.
+    """
+    return amount_out * (10000 - slippage_bps) // 10000
+
+
+def swap_args(quote: SwapQuote, slippage_bps: int = 0) -> list:
+    """
+    Arguments of an S call to a pool built with limits, which fails if it
+    would credit less than the quote allows. Pools without limits ignore
+    the minimum.
+    """
+    return [b"S", minimum_out(quote.amount_out, slippage_bps).to_bytes(8, "big")]
+
+
+def remove_args(amount: int, quote: RemoveQuote, slippage_bps: int = 0) -> list:
+    """
+    Arguments of an R call burning ``amount`` liquidity tokens, with the
+    least amounts of both assets like ``swap_args``.
+    """
+    return [
+        b"R",
+        amount.to_bytes(8, "big"),
+        minimum_out(quote.a_out, slippage_bps).to_bytes(8, "big"),
+        minimum_out(quote.b_out, slippage_bps).to_bytes(8, "big"),
+    ]
+
+
+class PoolMath:
+    """
+    Mirrors AlgosToAsaContract/AsaToAsaContract for the given parameters.
+    """
+
+    def __init__(
+        self,
+        ratio_decimal_points: int,
+        fee_pct: int,
+        direct_math: bool = False,
+        wide_math: str = "",
+    ):
+        if set(wide_math) - set("SAR"):
+            raise ValueError("Wide math is only available for S, A and R calls")
+        if wide_math and not direct_math:
+            raise ValueError("Wide math requires direct math")
+        self.ratio_decimal_points = ratio_decimal_points
+        self.fee_pct = fee_pct
+        self.direct_math = direct_math
+        self.wide_math = wide_math
+        # Both values are compiled into the program as constants
+        self.fee_factor = 100 - fee_pct
+        self.tolerance = int(0.01 * ratio_decimal_points)
+
+    @classmethod
+    def from_params(cls, params: dict) -> "PoolMath":
+        """
+        Math of a pool compiled with the parameters of state.py.
+        """
+        return cls(
+            int(params["ratio_decimal_points"]),
+            int(params["fee_pct"]),
+            direct_math=bool(params["direct_math"]),
+            wide_math=str(params["wide_math"] or ""),
+        )
+
+    def mul_div(self, handler: str, a: int, b: int, c: int) -> int:
+        if handler not in self.wide_math:
+            return div(mul(a, b), c)
+        return mul_div(a, b, c)
+
+    def exchange_rate(self, a_balance: int, b_balance: int) -> int:
+        # get_exchange_rate(inline=True)
+        return div(mul(a_balance, self.ratio_decimal_points), b_balance)
+
+    def swap_primary(self, a_balance: int, b_balance: int, amount: int) -> SwapQuote:
+        """
+        Primary asset deposited, secondary asset credited to b_to_withdraw.
+        """
+        a_balance = add(a_balance, amount)
+        if "S" in self.wide_math:
+            amount_out = div(
+                self.mul_div("S", mul(amount, self.fee_factor), b_balance, a_balance),
+                100,
+            )
+        elif self.direct_math:
+            amount_out = div(
+                mul(mul(amount, self.fee_factor), b_balance), mul(a_balance, 100)
+            )
+        else:
+            amount_out = div(
+                div(
+                    mul(mul(amount, self.fee_factor), self.ratio_decimal_points), 100
+                ),
+                self.exchange_rate(a_balance, b_balance),
+            )
+        return SwapQuote(amount_out, a_balance, sub(b_balance, amount_out))
+
+    def swap_secondary(
+        self, a_balance: int, b_balance: int, amount: int
+    ) -> SwapQuote:
+        """
+        Secondary asset deposited, primary asset credited to a_to_withdraw.
+        """
+        b_balance = add(b_balance, amount)
+        if "S" in self.wide_math:
+            amount_out = div(
+                self.mul_div("S", mul(amount, self.fee_factor), a_balance, b_balance),
+                100,
+            )
+        elif self.direct_math:
+            amount_out = div(
+                mul(mul(amount, self.fee_factor), a_balance), mul(b_balance, 100)
+            )
+        else:
+            amount_out = div(
+                div(
+                    mul(
+                        mul(self.exchange_rate(a_balance, b_balance), amount),
+                        self.fee_factor,
+                    ),
+                    self.ratio_decimal_points,
+                ),
+                100,
+            )
+        return SwapQuote(amount_out, sub(a_balance, amount_out), b_balance)
+
+    def check_ratio(self, a_balance: int, b_balance: int, a_amount: int, b_amount: int):
+        """
+        The 1% tolerance check of on_add_liquidity.
+        """
+        if b_balance == 0 or a_balance == 0:
+            return
+        if "A" in self.wide_math:
+            tx_product = self.mul_div("A", mul(100, a_amount), b_balance, a_balance)
+            if not mul(99, b_amount) < tx_product < mul(101, b_amount):
+                raise _ToleranceError("assert failed: ratio out of tolerance")
+            return
+        if self.direct_math:
+            pool_product = mul(a_balance, b_amount)
+            tx_product = mul(mul(100, a_amount), b_balance)
+            if not mul(99, pool_product) < tx_product < mul(101, pool_product):
+                raise _ToleranceError("assert failed: ratio out of tolerance")
+            return
+        exchange_rate = self.exchange_rate(a_balance, b_balance)
+        tx_ratio = div(mul(a_amount, self.ratio_decimal_points), b_amount)
+        if exchange_rate >= tx_ratio:
+            diff = sub(exchange_rate, tx_ratio)
+        else:
+            diff = sub(tx_ratio, exchange_rate)
+        try:
+            scaled_diff = mul(diff, self.ratio_decimal_points)
+        except TealArithmeticError as exc:
+            # Only a deposit far off the pool ratio overflows here
+            raise _ToleranceError(*exc.args)
+        if div(scaled_diff, exchange_rate) >= self.tolerance:
+            raise _ToleranceError("assert failed: ratio out of tolerance")
+
+    def add_liquidity(
+        self,
+        a_balance: int,
+        b_balance: int,
+        total_liquidity_tokens: int,
+        a_amount: int,
+        b_amount: int,
+    ) -> LiquidityQuote:
+        self.check_ratio(a_balance, b_balance, a_amount, b_amount)
+        return self._deposit(
+            a_balance, b_balance, total_liquidity_tokens, a_amount, b_amount
+        )
+
+    def _deposit(
+        self,
+        a_balance: int,
+        b_balance: int,
+        total_liquidity_tokens: int,
+        a_amount: int,
+        b_amount: int,
+    ) -> LiquidityQuote:
+        if total_liquidity_tokens == 0:
+            minted = a_amount
+        else:
+            minted = self.mul_div("A", a_amount, total_liquidity_tokens, a_balance)
+        return LiquidityQuote(
+            minted,
+            add(a_balance, a_amount),
+            add(b_balance, b_amount),
+            add(total_liquidity_tokens, minted),
+        )
+
+    def remove_liquidity(
+        self, a_balance: int, b_balance: int, total_liquidity_tokens: int, amount: int
+    ) -> RemoveQuote:
+        # a_calc and b_calc from setup_calculations
+        a_out = self.mul_div("R", a_balance, amount, total_liquidity_tokens)
+        b_out = self.mul_div("R", b_balance, amount, total_liquidity_tokens)
+        return RemoveQuote(
+            a_out,
+            b_out,
+            sub(a_balance, a_out),
+            sub(b_balance, b_out),
+            sub(total_liquidity_tokens, amount),
+        )
+
+    def max_swap_primary(self, a_balance: int, b_balance: int) -> int:
+        """
+        Largest primary asset amount which can be swapped.
+        """
+        return self._largest_amount(
+            lambda amount: self.swap_primary(a_balance, b_balance, amount)
+        )
+
+    def max_swap_secondary(self, a_balance: int, b_balance: int) -> int:
+        """
+        Largest secondary asset amount which can be swapped.
+        """
+        return self._largest_amount(
+            lambda amount: self.swap_secondary(a_balance, b_balance, amount)
+        )
+
+    def max_add_liquidity(
+        self, a_balance: int, b_balance: int, total_liquidity_tokens: int
+    ) -> int:
+        """
+        Largest primary asset amount which can be added to a pool which is
+        not empty, along with the secondary asset amount in the pool ratio.
+        """
+        if a_balance == 0:
+            raise ValueError("The pool is empty, the deposit sets its ratio")
+
+        def add_liquidity(amount: int, check: bool = True) -> LiquidityQuote:
+            b_amount = amount * b_balance // a_balance
+            try:
+                if check or b_amount:
+                    self.check_ratio(a_balance, b_balance, amount, b_amount)
+            except _ToleranceError:
+                if check:
+                    raise
+            return self._deposit(
+                a_balance, b_balance, total_liquidity_tokens, amount, b_amount
+            )
+
+        # Only the overflows grow with the amount, the ratio check fails on
+        # amounts small enough for the rounding of the secondary amount
+        amount = self._largest_amount(lambda amount: add_liquidity(amount, False))
+        # Of the amounts rounded to the same secondary amount, the smaller
+        # ones are the closer to the pool ratio, so those passing the check
+        # come first
+        while amount:
+            b_amount = amount * b_balance // a_balance
+            if b_amount == 0:
+                break
+            first = -(-b_amount * a_balance // b_balance)
+            try:
+                add_liquidity(first)
+            except TealArithmeticError:
+                amount = first - 1
+                continue
+            return first + self._largest_amount(
+                lambda extra: add_liquidity(first + extra), amount - first + 1
+            )
+        return 0
+
+    def max_remove_liquidity(
+        self, a_balance: int, b_balance: int, total_liquidity_tokens: int
+    ) -> int:
+        """
+        Largest amount of liquidity tokens which can be removed at once.
+        """
+        return self._largest_amount(
+            lambda amount: self.remove_liquidity(
+                a_balance, b_balance, total_liquidity_tokens, amount
+            )
+        )
+
+    def _largest_amount(self, quote, limit: int = UINT64_MAX + 1) -> int:
+        # The operations overflow above some amount below ``limit``, which is
+        # found by bisection
+        low, high = 0, limit
+        while high - low > 1:
+            middle = (low + high) // 2
+            try:
+                quote(middle)
+                low = middle
+            except TealArithmeticError:
+                high = middle
+        return low
+
+    def swap_primary_batch(self, a_balance, b_balance, amount):
+        """
+        Vectorized swap_primary, returns (SwapQuote, failed).
+        """
+        ops = _BatchOps(a_balance, b_balance, amount)
+        a_balance, b_balance, amount = ops.inputs
+        a_balance = ops.add(a_balance, amount)
+        if "S" in self.wide_math:
+            amount_out = ops.div(
+                ops.mul_div(ops.mul(amount, self.fee_factor), b_balance, a_balance),
+                100,
+            )
+        elif self.direct_math:
+            amount_out = ops.div(
+                ops.mul(ops.mul(amount, self.fee_factor), b_balance),
+                ops.mul(a_balance, 100),
+            )
+        else:
+            rate = ops.div(ops.mul(a_balance, self.ratio_decimal_points), b_balance)
+            amount_out = ops.div(
+                ops.div(
+                    ops.mul(
+                        ops.mul(amount, self.fee_factor), self.ratio_decimal_points
+                    ),
+                    100,
+                ),
+                rate,
+            )
+        b_balance = ops.sub(b_balance, amount_out)
+        return ops.result(SwapQuote(amount_out, a_balance, b_balance))
+
+    def swap_secondary_batch(self, a_balance, b_balance, amount):
+        """
+        Vectorized swap_secondary, returns (SwapQuote, failed).
+        """
+        ops = _BatchOps(a_balance, b_balance, amount)
+        a_balance, b_balance, amount = ops.inputs
+        b_balance = ops.add(b_balance, amount)
+        if "S" in self.wide_math:
+            amount_out = ops.div(
+                ops.mul_div(ops.mul(amount, self.fee_factor), a_balance, b_balance),
+                100,
+            )
+        elif self.direct_math:
+            amount_out = ops.div(
+                ops.mul(ops.mul(amount, self.fee_factor), a_balance),
+                ops.mul(b_balance, 100),
+            )
+        else:
+            rate = ops.div(ops.mul(a_balance, self.ratio_decimal_points), b_balance)
+            amount_out = ops.div(
+                ops.div(
+                    ops.mul(ops.mul(rate, amount), self.fee_factor),
+                    self.ratio_decimal_points,
+                ),
+                100,
+            )
+        a_balance = ops.sub(a_balance, amount_out)
+        return ops.result(SwapQuote(amount_out, a_balance, b_balance))
+
+    def add_liquidity_batch(
+        self, a_balance, b_balance, total_liquidity_tokens, a_amount, b_amount
+    ):
+        """
+        Vectorized add_liquidity, returns (LiquidityQuote, failed).
+        """
+        ops = _BatchOps(a_balance, b_balance, total_liquidity_tokens, a_amount, b_amount)
+        a_balance, b_balance, total_liquidity_tokens, a_amount, b_amount = ops.inputs
+
+        checked = (a_balance != 0) & (b_balance != 0)
+        with ops.only(checked):
+            if "A" in self.wide_math:
+                tx_product = ops.mul_div(ops.mul(100, a_amount), b_balance, a_balance)
+                ops.fail(
+                    (ops.mul(99, b_amount) >= tx_product)
+                    | (tx_product >= ops.mul(101, b_amount))
+                )
+            elif self.direct_math:
+                pool_product = ops.mul(a_balance, b_amount)
+                tx_product = ops.mul(ops.mul(100, a_amount), b_balance)
+                ops.fail(
+                    (ops.mul(99, pool_product) >= tx_product)
+                    | (tx_product >= ops.mul(101, pool_product))
+                )
+            else:
+                rate = ops.div(ops.mul(a_balance, self.ratio_decimal_points), b_balance)
+                tx_ratio = ops.div(
+                    ops.mul(a_amount, self.ratio_decimal_points), b_amount
+                )
+                diff = np.where(rate >= tx_ratio, rate - tx_ratio, tx_ratio - rate)
+                deviation = ops.div(ops.mul(diff, self.ratio_decimal_points), rate)
+                ops.fail(deviation >= self.tolerance)
+
+        first = total_liquidity_tokens == 0
+        with ops.only(~first):
+            minted = self._batch_mul_div(
+                ops, "A", a_amount, total_liquidity_tokens, a_balance
+            )
+        minted = np.where(first, a_amount, minted)
+
+        return ops.result(
+            LiquidityQuote(
+                minted,
+                ops.add(a_balance, a_amount),
+                ops.add(b_balance, b_amount),
+                ops.add(total_liquidity_tokens, minted),
+            )
+        )
+
+    def remove_liquidity_batch(self, a_balance, b_balance, total_liquidity_tokens, amount):
+        """
+        Vectorized remove_liquidity, returns (RemoveQuote, failed).
+        """
+        ops = _BatchOps(a_balance, b_balance, total_liquidity_tokens, amount)
+        a_balance, b_balance, total_liquidity_tokens, amount = ops.inputs
+        a_out = self._batch_mul_div(ops, "R", a_balance, amount, total_liquidity_tokens)
+        b_out = self._batch_mul_div(ops, "R", b_balance, amount, total_liquidity_tokens)
+        return ops.result(
+            RemoveQuote(
+                a_out,
+                b_out,
+                ops.sub(a_balance, a_out),
+                ops.sub(b_balance, b_out),
+                ops.sub(total_liquidity_tokens, amount),
+            )
+        )
+
+    def _batch_mul_div(self, ops, handler: str, a, b, c):
+        if handler in self.wide_math:
+            return ops.mul_div(a, b, c)
+        return ops.div(ops.mul(a, b), c)
+
+
+class _BatchOps:
+    """
+    uint64 array arithmetic which records failing elements instead of raising.
+    """
+
+    def __init__(self, *arrays):
+        if np is None:
+            raise ImportError("numpy is required for the batch quote methods")
+        self.inputs = np.broadcast_arrays(
+            *(np.atleast_1d(np.asarray(array, dtype=np.uint64)) for array in arrays)
+        )
+        self.failed = np.zeros(self.inputs[0].shape, dtype=bool)
+        self._active = np.ones(self.inputs[0].shape, dtype=bool)
+
+    @contextmanager
+    def only(self, mask):
+        # Branches of If() only fail for the elements which take them
+        previous = self._active
+        self._active = previous & mask
+        try:
+            yield
+        finally:
+            self._active = previous
+
+    def fail(self, mask):
+        self.failed |= mask & self._active
+
+    def mul(self, a, b):
+        a = np.asarray(a, dtype=np.uint64)
+        b = np.asarray(b, dtype=np.uint64)
+        limit = np.uint64(UINT64_MAX) // np.where(a == 0, np.uint64(1), a)
+        self.fail((a != 0) & (b > limit))
+        return a * b
+
+    def add(self, a, b):
+        a = np.asarray(a, dtype=np.uint64)
+        b = np.asarray(b, dtype=np.uint64)
+        result = a + b
+        self.fail(result < a)
+        return result
+
+    def sub(self, a, b):
+        a = np.asarray(a, dtype=np.uint64)
+        b = np.asarray(b, dtype=np.uint64)
+        self.fail(b > a)
+        return a - b
+
+    def div(self, a, b):
+        a = np.asarray(a, dtype=np.uint64)
+        b = np.asarray(b, dtype=np.uint64)
+        zero = b == 0
+        self.fail(zero)
+        return a // np.where(zero, np.uint64(1), b)
+
+    def mod(self, a, b):
+        a = np.asarray(a, dtype=np.uint64)
+        b = np.asarray(b, dtype=np.uint64)
+        zero = b == 0
+        self.fail(zero)
+        return a % np.where(zero, np.uint64(1), b)
+
+    @staticmethod
+    def mulw(a, b):
+        # The 128 bit product from the 32 bit halves of both factors
+        a = np.asarray(a, dtype=np.uint64)
+        b = np.asarray(b, dtype=np.uint64)
+        mask, shift = np.uint64(0xFFFFFFFF), np.uint64(32)
+        a_low, a_high = a & mask, a >> shift
+        b_low, b_high = b & mask, b >> shift
+        low_low, low_high = a_low * b_low, a_low * b_high
+        high_low, high_high = a_high * b_low, a_high * b_high
+        middle = (low_low >> shift) + (low_high & mask) + (high_low & mask)
+        high = high_high + (low_high >> shift) + (high_low >> shift) + (middle >> shift)
+        return high, (low_low & mask) | (middle << shift)
+
+    def mul_div(self, a, b, c):
+        high, low = self.mulw(a, b)
+        uint64_max = np.uint64(UINT64_MAX)
+        self.fail(high >= self.div(uint64_max, c))
+        return self.add(
+            self.add(self.mul(high, self.div(uint64_max, c)), self.div(low, c)),
+            self.div(
+                self.add(
+                    self.mul(high, self.add(self.mod(uint64_max, c), 1)),
+                    self.mod(low, c),
+                ),
+                c,
+            ),
+        )
+
+    def result(self, quote):
+        failed = self.failed
+        return (
+            type(quote)(
+                *(np.where(failed, np.uint64(0), value) for value in quote)
+            ),
+            failed,
+        )
+
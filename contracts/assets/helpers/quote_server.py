@@ -0,0 +1,306 @@
+"""Quote server polling the state of the pools once per round for all clients."""
+import asyncio
+import base64
+import json
+import sys
+import threading
+import urllib.request
+from collections import OrderedDict
+
+from helpers.parse import parse_args
+from helpers.quote import PoolMath, TealArithmeticError
+from helpers.schema import decode_reserves
+
+OPERATIONS = ("swap_primary", "swap_secondary", "add_liquidity", "remove_liquidity")
+
+
+class Algod:
+    """
+    The algod v2 endpoints the server reads, as blocking calls.
+    """
+
+    def __init__(self, address: str, token: str):
+        self.address = address.rstrip("/")
+        self.token = token
+
+    def _get(self, path: str) -> dict:
+        request = urllib.request.Request(
+            self.address + path, headers={"X-Algo-API-Token": self.token}
+        )
+        with urllib.request.urlopen(request) as response:
+            return json.load(response)
+
+    def status(self) -> dict:
+        return self._get("/v2/status")
+
+    def wait_for_block_after(self, round: int) -> dict:
+        return self._get(f"/v2/status/wait-for-block-after/{round}")
+
+    def application(self, app_id: int) -> dict:
+        return self._get(f"/v2/applications/{app_id}")
+
+
+class LocalAlgod:
+    """
+    Stand-in for algod serving the applications of an interpreter Ledger.
+    Call ``next_round`` after evaluating the groups of a round.
+    """
+
+    def __init__(self, ledger):
+        self.ledger = ledger
+        self._round = threading.Condition()
+
+    def next_round(self):
+        with self._round:
+            self.ledger.round += 1
+            self._round.notify_all()
+
+    def status(self) -> dict:
+        return {"last-round": self.ledger.round}
+
+    def wait_for_block_after(self, round: int, timeout: float = 1.0) -> dict:
+        with self._round:
+            self._round.wait_for(lambda: self.ledger.round > round, timeout)
+        return self.status()
+
+    def application(self, app_id: int) -> dict:
+        global_state = []
+        for key, value in self.ledger.global_state[app_id].items():
+            if isinstance(value, int):
+                value = {"type": 2, "uint": value, "bytes": ""}
+            else:
+                value = {
+                    "type": 1,
+                    "uint": 0,
+                    "bytes": base64.b64encode(value).decode(),
+                }
+            global_state.append({"key": base64.b64encode(key).decode(), "value": value})
+        return {"id": app_id, "params": {"global-state": global_state}}
+
+
+def decode_global_state(application: dict) -> dict:
+    """
+    Global state of an algod application response keyed by name, with
+    uint values as ints and byte values as bytes.
+    """
+    state = {}
+    for entry in application["params"].get("global-state", []):
+        key = base64.b64decode(entry["key"]).decode("latin-1")
+        value = entry["value"]
+        if value["type"] == 1:
+            state[key] = base64.b64decode(value["bytes"])
+        else:
+            state[key] = value["uint"]
+    return state
+
+
+class QuoteServer:
+    """
+    Keeps the reserves of ``pools``, a dict of app IDs to the parameters of
+    state.py, and serves quotes and updates to the connected clients.
+    Subscribers which do not take an update within ``send_timeout`` seconds
+    are disconnected.
+    """
+
+    def __init__(
+        self,
+        algod,
+        pools: dict,
+        cache_size: int = 4096,
+        retry_delay: float = 1.0,
+        send_timeout: float = 5.0,
+    ):
+        self.algod = algod
+        self.math = {
+            app_id: PoolMath.from_params(params) for app_id, params in pools.items()
+        }
+        self.reserves = {}  # app_id -> {"L", "A", "B"}
+        self.round = None
+        self.cache_size = cache_size
+        self._cache = OrderedDict()  # (app_id, operation, amounts) -> result
+        self._subscribers = {}  # writer -> set of app IDs
+        self.retry_delay = retry_delay
+        self.send_timeout = send_timeout
+
+    async def _call(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(None, func, *args)
+
+    async def refresh(self, round: int):
+        """
+        Reads every application once and pushes the reserves which changed.
+        """
+        applications = await asyncio.gather(
+            *(self._call(self.algod.application, app_id) for app_id in self.math)
+        )
+        changed = []
+        for app_id, application in zip(self.math, applications):
+            reserves = decode_reserves(decode_global_state(application))
+            if reserves != self.reserves.get(app_id):
+                self.reserves[app_id] = reserves
+                changed.append(app_id)
+        self.round = round
+        self._cache.clear()
+        for app_id in changed:
+            await self.publish(app_id)
+
+    async def poll(self):
+        """
+        Refreshes the reserves after every round, until cancelled. Errors of
+        algod are logged and retried, the clients keep the last reserves.
+        """
+        while True:
+            try:
+                if self.round is None:
+                    status = await self._call(self.algod.status)
+                else:
+                    status = await self._call(
+                        self.algod.wait_for_block_after, self.round
+                    )
+                # algod answers with the same round once the wait times out
+                if self.round is None or status["last-round"] > self.round:
+                    await self.refresh(status["last-round"])
+            except (OSError, ValueError, KeyError) as exc:
+                print(f"Reading algod failed: {exc!r}", file=sys.stderr)
+                await asyncio.sleep(self.retry_delay)
+
+    def quote(self, app_id: int, operation: str, amount: int, b_amount: int = None):
+        """
+        Result of an operation on the current reserves of a pool, raises
+        TealArithmeticError where the contract would fail.
+        """
+        if operation not in OPERATIONS:
+            raise ValueError(f"Unknown operation {operation}")
+        if app_id not in self.reserves:
+            raise ValueError(f"Unknown application {app_id}")
+        key = (app_id, operation, amount, b_amount)
+        result = self._cache.get(key)
+        if result is not None:
+            self._cache.move_to_end(key)
+            return result
+
+        math, reserves = self.math[app_id], self.reserves[app_id]
+        a_balance, b_balance, total = reserves["A"], reserves["B"], reserves["L"]
+        if operation == "swap_primary":
+            quote = math.swap_primary(a_balance, b_balance, amount)
+            result = {"amount_out": quote.amount_out}
+        elif operation == "swap_secondary":
+            quote = math.swap_secondary(a_balance, b_balance, amount)
+            result = {"amount_out": quote.amount_out}
+        elif operation == "add_liquidity":
+            if b_amount is None:
+                if a_balance == 0:
+                    raise ValueError("The pool is empty, b_amount sets its ratio")
+                # Secondary amount in the pool ratio
+                b_amount = amount * b_balance // a_balance
+            quote = math.add_liquidity(a_balance, b_balance, total, amount, b_amount)
+            result = {"b_amount": b_amount, "minted": quote.minted}
+        else:
+            quote = math.remove_liquidity(a_balance, b_balance, total, amount)
+            result = {"a_out": quote.a_out, "b_out": quote.b_out}
+
+        self._cache[key] = result
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return result
+
+    async def publish(self, app_id: int):
+        message = self._message(
+            {"round": self.round, "app_id": app_id, "reserves": self.reserves[app_id]}
+        )
+        # Sent to every subscriber at once, so a slow one does not hold up the rest
+        await asyncio.gather(
+            *(
+                self._send(writer, message)
+                for writer, app_ids in list(self._subscribers.items())
+                if app_id in app_ids
+            )
+        )
+
+    async def _send(self, writer, message: bytes):
+        try:
+            writer.write(message)
+            await asyncio.wait_for(writer.drain(), self.send_timeout)
+        except ConnectionError:
+            # The handler of the connection closes it
+            self._subscribers.pop(writer, None)
+        except asyncio.TimeoutError:
+            # Closing would wait for the buffer to be flushed, the handler
+            # sees the connection lost once it is aborted
+            self._subscribers.pop(writer, None)
+            writer.transport.abort()
+
+    @staticmethod
+    def _message(document: dict) -> bytes:
+        return json.dumps(document).encode() + b"\n"
+
+    async def handle(self, reader, writer):
+        """
+        Answers the requests of a client connection.
+        """
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                writer.write(self._message(self._answer(json.loads(line), writer)))
+                await writer.drain()
+        except (ConnectionError, ValueError):
+            pass
+        finally:
+            self._subscribers.pop(writer, None)
+            writer.close()
+
+    def _answer(self, request: dict, writer) -> dict:
+        answer = {"id": request.get("id"), "round": self.round}
+        try:
+            if "subscribe" in request:
+                app_ids = {int(app_id) for app_id in request["subscribe"]}
+                self._subscribers.setdefault(writer, set()).update(app_ids)
+                answer["reserves"] = {
+                    app_id: self.reserves[app_id]
+                    for app_id in app_ids
+                    if app_id in self.reserves
+                }
+            else:
+                quote = request["quote"]
+                b_amount = quote.get("b_amount")
+                answer["result"] = self.quote(
+                    int(quote["app_id"]),
+                    quote["operation"],
+                    int(quote["amount"]),
+                    None if b_amount is None else int(b_amount),
+                )
+        except (KeyError, TypeError, ValueError, TealArithmeticError) as exc:
+            answer["error"] = str(exc)
+        return answer
+
+    async def serve(self, host: str = "127.0.0.1", port: int = 8980):
+        """
+        Polls algod and serves the clients until cancelled.
+        """
+        server = await asyncio.start_server(self.handle, host, port)
+        async with server:
+            await asyncio.gather(server.serve_forever(), self.poll())
+
+
+if __name__ == "__main__":
+    from state import DEFAULT_PARAMS
+
+    params = {
+        "algod": "http://localhost:4001",
+        "token": "",
+        "host": "127.0.0.1",
+        "port": 8980,
+        "pools": {},
+    }
+
+    # Overwrite params if sys.argv[1] is passed
+    if len(sys.argv) > 1:
+        params = parse_args(sys.argv[1], params)
+
+    pools = {
+        int(app_id): {**DEFAULT_PARAMS, **(pool or {})}
+        for app_id, pool in params["pools"].items()
+    }
+    server = QuoteServer(Algod(params["algod"], params["token"]), pools)
+    asyncio.run(server.serve(params["host"], params["port"]))
@@ -0,0 +1,267 @@
+"""Off-chain router for swaps between assets without a direct pool."""
+from collections import OrderedDict, defaultdict, namedtuple
+
+from helpers.interpreter import ON_COMPLETION, TXN_TYPES
+from helpers.quote import PoolMath, TealArithmeticError
+from helpers.schema import decode_reserves
+
+ALGO = 0
+ESCROW_FEE = 1000
+
+Hop = namedtuple("Hop", ["pool", "asset_in", "asset_out", "amount_in", "amount_out"])
+Route = namedtuple("Route", ["amount_in", "amount_out", "hops"])
+
+
+class RoutedPool:
+    """
+    A pool known to the router with its current reserves. ``lsig`` is the
+    escrow Program, added to the transactions the escrow has to sign. The
+    last ``cache_size`` quotes are kept until the reserves change.
+    """
+
+    def __init__(
+        self,
+        app_id: int,
+        escrow: bytes,
+        primary: int,
+        secondary: int,
+        math: PoolMath,
+        a_balance: int,
+        b_balance: int,
+        settle_swaps: bool = False,
+        lsig=None,
+        cache_size: int = 4096,
+    ):
+        if primary == secondary:
+            raise ValueError("A pool swaps between two different assets")
+        self.app_id = app_id
+        self.escrow = escrow
+        self.primary = primary
+        self.secondary = secondary
+        self.math = math
+        self.a_balance = a_balance
+        self.b_balance = b_balance
+        self.settle_swaps = settle_swaps
+        self.lsig = lsig
+        self.cache_size = cache_size
+        self._quotes = OrderedDict()  # (asset_in, amount) -> amount out
+
+    @classmethod
+    def from_state(
+        cls, params: dict, app_id: int, escrow: bytes, global_state: dict, lsig=None
+    ) -> "RoutedPool":
+        """
+        Pool deployed with the parameters of state.py, given its global
+        state keyed by the names of the contract's keys.
+        """
+        from state import ExchangeType
+
+        global_state = {
+            key.decode() if isinstance(key, bytes) else key: value
+            for key, value in global_state.items()
+        }
+        balances = decode_reserves(global_state)
+        asa = params["type"] == ExchangeType.ASA_TO_ASA
+        return cls(
+            app_id,
+            escrow,
+            global_state["X"] if asa else ALGO,
+            global_state["Y"],
+            PoolMath(
+                int(params["ratio_decimal_points"]),
+                int(params["fee_pct"]),
+                direct_math=bool(params["direct_math"]),
+                wide_math=str(params["wide_math"] or ""),
+            ),
+            balances["A"],
+            balances["B"],
+            settle_swaps=bool(params["settle_swaps"]),
+            lsig=lsig,
+        )
+
+    def update(self, a_balance: int, b_balance: int):
+        if (a_balance, b_balance) != (self.a_balance, self.b_balance):
+            self.a_balance, self.b_balance = a_balance, b_balance
+            self._quotes.clear()
+
+    def other(self, asset: int) -> int:
+        return self.secondary if asset == self.primary else self.primary
+
+    def quote(self, asset_in: int, amount: int) -> int:
+        """
+        Amount of the other asset paid out for ``amount`` of ``asset_in``,
+        raises TealArithmeticError where the contract would fail.
+        """
+        key = (asset_in, amount)
+        amount_out = self._quotes.get(key)
+        if amount_out is not None:
+            self._quotes.move_to_end(key)
+            return amount_out
+        if asset_in == self.primary:
+            swap = self.math.swap_primary
+        else:
+            swap = self.math.swap_secondary
+        amount_out = swap(self.a_balance, self.b_balance, amount).amount_out
+        self._quotes[key] = amount_out
+        if len(self._quotes) > self.cache_size:
+            self._quotes.popitem(last=False)
+        return amount_out
+
+
+class Router:
+    """
+    Finds the swaps between two assets which pay out the most, over paths of
+    up to ``max_hops`` pools.
+    """
+
+    def __init__(self, pools=(), max_hops: int = 3):
+        self.max_hops = max_hops
+        self.pools = []
+        self.graph = defaultdict(list)  # asset -> [(pool, asset out)]
+        self._paths = {}  # (asset in, asset out) -> [((pool, asset in), ...)]
+        for pool in pools:
+            self.add(pool)
+
+    def add(self, pool: RoutedPool):
+        self.pools.append(pool)
+        self.graph[pool.primary].append((pool, pool.secondary))
+        self.graph[pool.secondary].append((pool, pool.primary))
+        self._paths.clear()
+
+    def paths(self, asset_in: int, asset_out: int) -> list:
+        """
+        Paths from ``asset_in`` to ``asset_out`` visiting every asset at most
+        once, as tuples of (pool, asset in) hops.
+        """
+        key = (asset_in, asset_out)
+        if key not in self._paths:
+            paths = []
+            self._find_paths(asset_in, asset_out, (), {asset_in}, paths)
+            self._paths[key] = paths
+        return self._paths[key]
+
+    def _find_paths(self, asset, asset_out, path, visited, paths):
+        if len(path) == self.max_hops:
+            return
+        for pool, other in self.graph[asset]:
+            if other == asset_out:
+                paths.append(path + ((pool, asset),))
+            elif other not in visited:
+                visited.add(other)
+                self._find_paths(
+                    other, asset_out, path + ((pool, asset),), visited, paths
+                )
+                visited.remove(other)
+
+    def best_route(self, asset_in: int, asset_out: int, amount: int) -> Route:
+        """
+        Route paying out the most for ``amount`` of ``asset_in``, or None if
+        no pool path can swap it.
+        """
+        if asset_in == asset_out:
+            raise ValueError("Can not route an asset to itself")
+        best, best_out = None, 0
+        for path in self.paths(asset_in, asset_out):
+            amount_out = amount
+            try:
+                for pool, asset in path:
+                    amount_out = pool.quote(asset, amount_out)
+                    if amount_out == 0:
+                        break
+            except TealArithmeticError:
+                continue
+            if amount_out > best_out:
+                best, best_out = path, amount_out
+        if best is None:
+            return None
+
+        hops = []
+        amount_out = amount
+        for pool, asset in best:
+            amount_hop = amount_out
+            amount_out = pool.quote(asset, amount_hop)
+            hops.append(Hop(pool, asset, pool.other(asset), amount_hop, amount_out))
+        return Route(amount, best_out, hops)
+
+    def groups(self, route: Route, sender: bytes, pending: dict = None) -> list:
+        """
+        Transaction groups swapping along the route, to be sent in order.
+
+        The sender has to be opted in to the application and the assets of
+        every pool. A hop through a pool built with settle_swaps is a single
+        group, otherwise the swap is followed by a withdrawal of the exact
+        quoted amount, which is rejected if the reserves changed meanwhile.
+        W pays out everything the sender has pending, so ``pending`` maps
+        app IDs to the sender's ``a_to_withdraw`` and ``b_to_withdraw``
+        before the route, which are withdrawn along with the swap.
+        """
+        pending = pending or {}
+        groups = []
+        for hop in route.hops:
+            pool = hop.pool
+            call = {
+                "TypeEnum": TXN_TYPES["appl"],
+                "Sender": sender,
+                "ApplicationID": pool.app_id,
+                "ApplicationArgs": [b"S"],
+                "OnCompletion": ON_COMPLETION["NoOp"],
+            }
+            deposit = _transfer(hop.asset_in, sender, pool.escrow, hop.amount_in)
+            if pool.settle_swaps:
+                payout = _transfer(hop.asset_out, pool.escrow, sender, hop.amount_out)
+                groups.append(
+                    [call, deposit, _signed(pool, payout), _fee(pool, sender, 1)]
+                )
+                continue
+            # Pools built with limits reject the swap instead of crediting
+            # less than the withdrawal takes
+            swap = dict(
+                call, ApplicationArgs=[b"S", hop.amount_out.to_bytes(8, "big")]
+            )
+            groups.append([swap, deposit])
+            a_pending, b_pending = pending.get(pool.app_id, (0, 0))
+            if hop.asset_out == pool.primary:
+                a_pending += hop.amount_out
+            else:
+                b_pending += hop.amount_out
+            withdraw = dict(call, ApplicationArgs=[b"W"])
+            secondary = _transfer(pool.secondary, pool.escrow, sender, b_pending)
+            primary = _transfer(pool.primary, pool.escrow, sender, a_pending)
+            groups.append(
+                [
+                    withdraw,
+                    _signed(pool, secondary),
+                    _signed(pool, primary),
+                    _fee(pool, sender, 2),
+                ]
+            )
+        return groups
+
+
+def _transfer(asset: int, sender: bytes, receiver: bytes, amount: int) -> dict:
+    if asset == ALGO:
+        return {
+            "TypeEnum": TXN_TYPES["pay"],
+            "Sender": sender,
+            "Receiver": receiver,
+            "Amount": amount,
+        }
+    return {
+        "TypeEnum": TXN_TYPES["axfer"],
+        "Sender": sender,
+        "XferAsset": asset,
+        "AssetReceiver": receiver,
+        "AssetAmount": amount,
+    }
+
+
+def _signed(pool: RoutedPool, txn: dict) -> dict:
+    txn["Fee"] = ESCROW_FEE
+    if pool.lsig is not None:
+        txn["LogicSig"] = pool.lsig
+    return txn
+
+
+def _fee(pool: RoutedPool, sender: bytes, transactions: int) -> dict:
+    # Reimburses the fees of the transactions signed by the escrow
+    return _transfer(ALGO, sender, pool.escrow, transactions * ESCROW_FEE)
@@ -0,0 +1,227 @@
+"""Keys of the global and local state of the pools, declared once."""
+import base64
+import json
+from collections import namedtuple
+
+UINT = "uint"
+BYTES = "bytes"
+GLOBAL = "global"
+LOCAL = "local"
+
+# Fixed-width byte values of algod, NumPy keeps addresses as 32 raw bytes.
+# Its S dtype strips trailing NUL bytes, which belong to the address here.
+ADDRESS_SIZE = 32
+PACKED_WIDTH = 8
+
+Field = namedtuple("Field", ["name", "key", "type", "scope", "packed"])
+
+
+def _field(name, key, type, scope=GLOBAL, packed=()):
+    return Field(name, key, type, scope, packed)
+
+
+FIELDS = (
+    _field("total_liquidity_tokens", "L", UINT),
+    _field("a_balance", "A", UINT),
+    _field("b_balance", "B", UINT),
+    # L, A and B of pools built with packed_state
+    _field("reserves", "P", BYTES, packed=("L", "A", "B")),
+    _field("escrow_addr", "E", BYTES),
+    _field("creator_addr", "C", BYTES),
+    # Only kept by ASA_TO_ASA pools
+    _field("a_idx", "X", UINT),
+    _field("b_idx", "Y", UINT),
+    _field("liq_idx", "Z", UINT),
+    # Only kept by pools built with twap
+    _field("price_timestamp", "T", UINT),
+    _field("a_price_sum", "M", UINT),
+    _field("b_price_sum", "N", UINT),
+    _field("a_to_withdraw", "1", UINT, LOCAL),
+    _field("b_to_withdraw", "2", UINT, LOCAL),
+    _field("user_liquidity_tokens", "3", UINT, LOCAL),
+)
+
+BY_NAME = {field.name: field for field in FIELDS}
+BY_KEY = {(field.scope, field.key): field for field in FIELDS}
+
+
+def state_var(name: str):
+    """
+    The state var of the contract for the field ``name``.
+    """
+    from helpers.state import GlobalState, LocalState, PackedGlobalState
+
+    field = BY_NAME[name]
+    if field.packed:
+        return PackedGlobalState(field.key, *field.packed)
+    if field.scope == LOCAL:
+        return LocalState(field.key)
+    return GlobalState(field.key)
+
+
+def unpack(field: Field, value: bytes) -> dict:
+    """
+    Values of the fields packed into ``value``, keyed by their keys.
+    """
+    if isinstance(value, str):
+        value = base64.b64decode(value)
+    if len(value) != len(field.packed) * PACKED_WIDTH:
+        raise ValueError(
+            f"Expected {len(field.packed) * PACKED_WIDTH} bytes for {field.key}, "
+            f"got {len(value)}"
+        )
+    return {
+        key: int.from_bytes(
+            value[index * PACKED_WIDTH : (index + 1) * PACKED_WIDTH], "big"
+        )
+        for index, key in enumerate(field.packed)
+    }
+
+
+def decode_reserves(global_state: dict) -> dict:
+    """
+    L, A and B of a pool given its global state keyed by key, as stored
+    with or without packed_state.
+    """
+    reserves = BY_NAME["reserves"]
+    if reserves.key in global_state:
+        return unpack(reserves, global_state[reserves.key])
+    return {key: global_state.get(key, 0) for key in reserves.packed}
+
+
+def decode_state(entries, scope: str = GLOBAL) -> dict:
+    """
+    A key-value list of algod keyed by field name, with packed values
+    unpacked. Keys outside of the schema are left out.
+    """
+    state = {}
+    for entry in entries:
+        field = BY_KEY.get((scope, base64.b64decode(entry["key"]).decode("latin-1")))
+        if field is None:
+            continue
+        value = entry["value"]
+        if value["type"] != 1:
+            state[field.name] = value.get("uint", 0)
+        elif field.packed:
+            for key, packed_value in unpack(field, value.get("bytes", "")).items():
+                state[BY_KEY[(scope, key)].name] = packed_value
+        else:
+            state[field.name] = base64.b64decode(value.get("bytes", ""))
+    return state
+
+
+def _dtype(scope: str, first: tuple):
+    import numpy as np
+
+    columns = [first]
+    for field in FIELDS:
+        if field.scope != scope or field.packed:
+            continue
+        if field.type == UINT:
+            columns.append((field.name, np.uint64))
+        else:
+            columns.append((field.name, f"V{ADDRESS_SIZE}"))
+    return np.dtype(columns)
+
+
+def _decoders(scope: str, dtype) -> dict:
+    # base64 key as returned by algod -> (field, columns of its values)
+    decoders = {}
+    for field in FIELDS:
+        if field.scope != scope:
+            continue
+        key = base64.b64encode(field.key.encode()).decode()
+        if field.packed:
+            names = [BY_KEY[(scope, packed)].name for packed in field.packed]
+        else:
+            names = [field.name]
+        decoders[key] = (field, [dtype.names.index(name) for name in names])
+    return decoders
+
+
+def _decode_row(row: list, entries, decoders: dict):
+    for entry in entries:
+        decoder = decoders.get(entry["key"])
+        if decoder is None:
+            continue
+        field, columns = decoder
+        value = entry["value"]
+        if field.packed:
+            for column, packed_value in zip(
+                columns, unpack(field, value.get("bytes", "")).values()
+            ):
+                row[column] = packed_value
+        elif field.type == UINT:
+            row[columns[0]] = value.get("uint", 0)
+        else:
+            row[columns[0]] = base64.b64decode(value.get("bytes", ""))
+
+
+def decode_global_states(applications):
+    """
+    Global state of algod application responses, one row per application
+    with its ``app_id``. Missing keys are 0.
+    """
+    import numpy as np
+
+    dtype = _dtype(GLOBAL, ("app_id", np.uint64))
+    decoders = _decoders(GLOBAL, dtype)
+    empty = [0 if dtype[name].kind == "u" else b"" for name in dtype.names]
+    rows = []
+    for application in applications:
+        row = list(empty)
+        row[0] = application["id"]
+        _decode_row(row, application["params"].get("global-state") or (), decoders)
+        rows.append(tuple(row))
+    return np.array(rows, dtype)
+
+
+def decode_local_states(accounts, app_id: int):
+    """
+    Local state of the accounts opted in to ``app_id``, one row per account
+    with its ``address``. Accounts which are not opted in are left out.
+    """
+    import numpy as np
+
+    dtype = _dtype(LOCAL, ("address", "U58"))
+    decoders = _decoders(LOCAL, dtype)
+    empty = [0 if dtype[name].kind == "u" else b"" for name in dtype.names]
+    rows = []
+    for account in _accounts(accounts):
+        for local_state in account.get("apps-local-state") or ():
+            if local_state["id"] != app_id:
+                continue
+            row = list(empty)
+            row[0] = account["address"]
+            _decode_row(row, local_state.get("key-value") or (), decoders)
+            rows.append(tuple(row))
+            break
+    return np.array(rows, dtype)
+
+
+def _accounts(accounts):
+    for account in accounts:
+        if "accounts" in account:
+            yield from account["accounts"]
+        elif "account" in account:
+            yield account["account"]
+        else:
+            yield account
+
+
+def schema_json() -> dict:
+    return {
+        scope: {
+            field.name: dict(
+                {"key": field.key, "type": field.type},
+                **({"packed": list(field.packed)} if field.packed else {}),
+            )
+            for field in FIELDS
+            if field.scope == scope
+        }
+        for scope in (GLOBAL, LOCAL)
+    }
+
+
+if __name__ == "__main__":
+    print(json.dumps(schema_json(), indent=2))
@@ -0,0 +1,360 @@
+"""
+Monte Carlo simulation of order flow against the integer math of a pool.
+
+Every run starts from the same reserves and applies ``steps`` operations
+drawn from an order flow: swaps in both directions, liquidity added off the
+pool ratio by a drawn skew, which the 1% tolerance check of the contract
+rejects past a point, and liquidity removed. Amounts are drawn as fractions
+of the reserves from pluggable distributions:
+
+    flow = {
+        "swap_primary": {"weight": 0.4, "size": {"distribution": "lognormal", "mean": -8, "sigma": 1.5}},
+        "add_liquidity": {"weight": 0.1, "size": {...}, "skew": {"distribution": "normal", "sigma": 0.005}},
+        ...
+    }
+
+The runs of a shard advance together, one PoolMath batch per operation and
+step, and what they do is folded into running statistics instead of being
+kept. Shards are simulated in a process pool and their statistics merged.
+A list of parameters simulates each of them with the same order flow:
+
+    cd assets && python -m helpers.simulate "{fee_pct: 3, runs: 100000, steps: 1000}"
+    cd assets && python -m helpers.simulate "[{fee_pct: 2}, {fee_pct: 3}, {fee_pct: 4}]"
+"""
+import json
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from helpers.parse import parse_args
+from helpers.quote import PoolMath
+
+OPERATIONS = ("swap_primary", "swap_secondary", "add_liquidity", "remove_liquidity")
+
+# Sizes are fractions of the primary reserve for swap_primary and
+# add_liquidity, of the secondary reserve for swap_secondary and of the
+# liquidity tokens for remove_liquidity
+DEFAULT_FLOW = {
+    "swap_primary": {
+        "weight": 0.4,
+        "size": {"distribution": "lognormal", "mean": -8.0, "sigma": 1.5},
+    },
+    "swap_secondary": {
+        "weight": 0.4,
+        "size": {"distribution": "lognormal", "mean": -8.0, "sigma": 1.5},
+    },
+    "add_liquidity": {
+        "weight": 0.1,
+        "size": {"distribution": "lognormal", "mean": -6.0, "sigma": 1.0},
+        "skew": {"distribution": "normal", "sigma": 0.005},
+    },
+    "remove_liquidity": {
+        "weight": 0.1,
+        "size": {"distribution": "uniform", "low": 0.0, "high": 0.01},
+    },
+}
+
+
+def lognormal(rng, size: int, mean: float = -8.0, sigma: float = 1.0):
+    return rng.lognormal(mean, sigma, size)
+
+
+def uniform(rng, size: int, low: float = 0.0, high: float = 0.01):
+    return rng.uniform(low, high, size)
+
+
+def pareto(rng, size: int, shape: float = 1.5, scale: float = 1e-4):
+    return scale * (1 + rng.pareto(shape, size))
+
+
+def normal(rng, size: int, mean: float = 0.0, sigma: float = 0.005):
+    return rng.normal(mean, sigma, size)
+
+
+def constant(rng, size: int, value: float = 0.0):
+    return np.full(size, float(value))
+
+
+# Other distributions are passed as module-level functions of (rng, size,
+# **params), so that they can be sent to the process pool
+DISTRIBUTIONS = {
+    "lognormal": lognormal,
+    "uniform": uniform,
+    "pareto": pareto,
+    "normal": normal,
+    "constant": constant,
+}
+
+
+def sample(spec: dict, rng, size: int) -> np.ndarray:
+    spec = dict(spec)
+    distribution = spec.pop("distribution")
+    if not callable(distribution):
+        distribution = DISTRIBUTIONS[distribution]
+    return distribution(rng, size, **spec)
+
+
+class RunningStats:
+    """
+    Count, mean, variance, minimum and maximum of a stream of values,
+    merged from batches with the parallel algorithm of Chan et al.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.minimum = float("inf")
+        self.maximum = float("-inf")
+
+    def add(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        if values.size:
+            mean = float(values.mean())
+            self._merge(
+                values.size,
+                mean,
+                float(np.square(values - mean).sum()),
+                float(values.min()),
+                float(values.max()),
+            )
+
+    def merge(self, other: "RunningStats"):
+        self._merge(other.count, other.mean, other.m2, other.minimum, other.maximum)
+
+    def _merge(self, count: int, mean: float, m2: float, minimum: float, maximum: float):
+        if not count:
+            return
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean += delta * count / total
+        self.m2 += m2 + delta * delta * self.count * count / total
+        self.count = total
+        self.minimum = min(self.minimum, minimum)
+        self.maximum = max(self.maximum, maximum)
+
+    def to_dict(self) -> dict:
+        if not self.count:
+            return {"count": 0}
+        return {
+            "count": self.count,
+            "mean": self.mean,
+            "std": (self.m2 / self.count) ** 0.5,
+            "min": self.minimum,
+            "max": self.maximum,
+        }
+
+
+class SimulationStats:
+    """
+    Calls and failed calls of every operation, and running statistics of:
+
+    - ``a_balance`` and ``b_balance`` after every step
+    - ``slippage_bps`` of every executed swap, fee included, against the
+      price of the reserves it was computed with
+    - the final reserves, ``a_fees`` and ``b_fees`` accrued and the
+      ``depth_growth`` of sqrt(A * B) per liquidity token of every run
+    """
+
+    METRICS = (
+        "a_balance",
+        "b_balance",
+        "slippage_bps",
+        "final_a_balance",
+        "final_b_balance",
+        "final_total_liquidity_tokens",
+        "a_fees",
+        "b_fees",
+        "depth_growth",
+    )
+
+    def __init__(self):
+        self.runs = 0
+        self.calls = dict.fromkeys(OPERATIONS, 0)
+        self.failed = dict.fromkeys(OPERATIONS, 0)
+        self.metrics = {name: RunningStats() for name in self.METRICS}
+
+    def merge(self, other: "SimulationStats"):
+        self.runs += other.runs
+        for name in OPERATIONS:
+            self.calls[name] += other.calls[name]
+            self.failed[name] += other.failed[name]
+        for name, stats in other.metrics.items():
+            self.metrics[name].merge(stats)
+
+    def to_dict(self) -> dict:
+        return {
+            "runs": self.runs,
+            "operations": {
+                name: {
+                    "calls": self.calls[name],
+                    "failed": self.failed[name],
+                    "failure_rate": self.failed[name] / self.calls[name]
+                    if self.calls[name]
+                    else 0.0,
+                }
+                for name in OPERATIONS
+            },
+            "metrics": {name: stats.to_dict() for name, stats in self.metrics.items()},
+        }
+
+
+def _amounts(fractions, reserves) -> np.ndarray:
+    # Truncated like the amounts of transactions, large draws are left to
+    # overflow in the pool math
+    amounts = np.clip(fractions, 0, None) * reserves.astype(np.float64)
+    return np.minimum(amounts, 2.0 ** 63).astype(np.uint64)
+
+
+def simulate_shard(job) -> SimulationStats:
+    """
+    Runs ``runs`` sequences of ``steps`` operations of the flow from the
+    reserves, with the random generator seeded by ``seed``.
+    """
+    params, flow, reserves, runs, steps, seed = job
+    math = PoolMath.from_params(params)
+    fee_share = int(params["fee_pct"]) / 100
+    rng = np.random.default_rng(seed)
+    names = [name for name in OPERATIONS if flow.get(name, {}).get("weight")]
+    weights = np.array([float(flow[name]["weight"]) for name in names])
+    stats = SimulationStats()
+    stats.runs = runs
+
+    a_balance = np.full(runs, reserves[0], np.uint64)
+    b_balance = np.full(runs, reserves[1], np.uint64)
+    # Minted by the first add liquidity call
+    total = np.full(runs, reserves[0], np.uint64)
+    a_fees = np.zeros(runs)
+    b_fees = np.zeros(runs)
+    start_depth = (float(reserves[0]) * float(reserves[1])) ** 0.5 / reserves[0]
+
+    for _ in range(steps):
+        chosen = rng.choice(len(names), runs, p=weights / weights.sum())
+        for choice, name in enumerate(names):
+            index = np.flatnonzero(chosen == choice)
+            if not index.size:
+                continue
+            spec = flow[name]
+            sizes = sample(spec["size"], rng, index.size)
+            a, b, supply = a_balance[index], b_balance[index], total[index]
+            if name == "swap_primary":
+                amount = _amounts(sizes, a)
+                quote, failed = math.swap_primary_batch(a, b, amount)
+                spot, fees, paid = b / a, a_fees, amount
+            elif name == "swap_secondary":
+                amount = _amounts(sizes, b)
+                quote, failed = math.swap_secondary_batch(a, b, amount)
+                spot, fees, paid = a / b, b_fees, amount
+            elif name == "add_liquidity":
+                a_amount = _amounts(sizes, a)
+                skew = 1 + sample(spec["skew"], rng, index.size)
+                b_amount = _amounts(a_amount / a * skew, b)
+                quote, failed = math.add_liquidity_batch(
+                    a, b, supply, a_amount, b_amount
+                )
+            else:
+                amount = _amounts(np.minimum(sizes, 1), supply)
+                quote, failed = math.remove_liquidity_batch(a, b, supply, amount)
+
+            stats.calls[name] += index.size
+            stats.failed[name] += int(failed.sum())
+            done = ~failed
+            executed = index[done]
+            a_balance[executed] = quote.a_balance[done]
+            b_balance[executed] = quote.b_balance[done]
+            if name.startswith("swap"):
+                priced = done & (paid > 0)
+                price = quote.amount_out[priced] / paid[priced]
+                stats.metrics["slippage_bps"].add(10000 * (1 - price / spot[priced]))
+                fees[executed] += paid[done] * fee_share
+            else:
+                total[executed] = quote.total_liquidity_tokens[done]
+
+        stats.metrics["a_balance"].add(a_balance)
+        stats.metrics["b_balance"].add(b_balance)
+
+    stats.metrics["final_a_balance"].add(a_balance)
+    stats.metrics["final_b_balance"].add(b_balance)
+    stats.metrics["final_total_liquidity_tokens"].add(total)
+    stats.metrics["a_fees"].add(a_fees)
+    stats.metrics["b_fees"].add(b_fees)
+    held = total > 0
+    depth = np.sqrt(a_balance[held] * 1.0 * b_balance[held]) / total[held]
+    stats.metrics["depth_growth"].add(depth / start_depth)
+    return stats
+
+
+def simulate(
+    params: dict,
+    flow: dict = DEFAULT_FLOW,
+    reserves=(10 ** 9, 10 ** 9),
+    runs: int = 10000,
+    steps: int = 1000,
+    seed: int = 0,
+    shard_size: int = 1000,
+    jobs: int = None,
+) -> SimulationStats:
+    """
+    Simulates ``runs`` runs in shards of ``shard_size``. Every shard is
+    seeded from ``seed`` by its position, so the results do not depend on
+    ``jobs``.
+    """
+    for name in flow:
+        if name not in OPERATIONS:
+            raise ValueError(f"Unknown operation {name}")
+    shards = [shard_size] * (runs // shard_size)
+    if runs % shard_size:
+        shards.append(runs % shard_size)
+    seeds = np.random.SeedSequence(seed).spawn(len(shards))
+    shard_jobs = [
+        (params, flow, tuple(reserves), size, steps, shard_seed)
+        for size, shard_seed in zip(shards, seeds)
+    ]
+
+    stats = SimulationStats()
+    if len(shard_jobs) > 1 and jobs != 1:
+        with ProcessPoolExecutor(jobs) as executor:
+            for shard in executor.map(simulate_shard, shard_jobs):
+                stats.merge(shard)
+    else:
+        for job in shard_jobs:
+            stats.merge(simulate_shard(job))
+    return stats
+
+
+if __name__ == "__main__":
+    from state import DEFAULT_PARAMS
+
+    params = {
+        **DEFAULT_PARAMS,
+        "runs": 10000,
+        "steps": 1000,
+        "seed": 0,
+        "shard_size": 1000,
+        "jobs": None,
+        "reserves": [10 ** 9, 10 ** 9],
+        "flow": {},
+    }
+
+    # Overwrite params if sys.argv[1] is passed
+    if len(sys.argv) > 1:
+        params = parse_args(sys.argv[1], params)
+
+    results = []
+    for entry in params if isinstance(params, list) else [params]:
+        # Operations of the flow replace those of DEFAULT_FLOW, weight 0 drops one
+        flow = {**DEFAULT_FLOW, **entry["flow"]}
+        stats = simulate(
+            entry,
+            flow,
+            entry["reserves"],
+            int(entry["runs"]),
+            int(entry["steps"]),
+            int(entry["seed"]),
+            int(entry["shard_size"]),
+            entry["jobs"],
+        )
+        pool = {key: entry[key] for key in DEFAULT_PARAMS}
+        results.append({"params": pool, **stats.to_dict()})
+    print(json.dumps(results if isinstance(params, list) else results[0], indent=2))
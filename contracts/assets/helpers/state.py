@@ -1,32 +1,272 @@
+import base64
+
 from pyteal import *
 
 
 class State:
     """
     Wrapper around state vars.
+
+    While a StateCache is active, reads are served from a scratch slot and
+    writes are deferred until the cache is flushed.
     """
 
+    # Opcodes spent on a direct read and on writing a value, excluding the value
+    read_cost = 0
+    write_cost = 0
+
     def __init__(self, name: str):
         self._name = name
+        self._slot = None
+        self._dirty = False
+        self._reads = 0
+        self._writes = 0
+
+    def put(self, value) -> Expr:
+        self._writes += 1
+        if self._slot is not None:
+            self._dirty = True
+            return self._slot.store(value)
+        return self.write(value)
+
+    def get(self) -> Expr:
+        self._reads += 1
+        if self._slot is not None:
+            return self._slot.load()
+        return self.read()
 
-    def put(self, value) -> App:
+    def write(self, value) -> App:
         raise NotImplementedError
 
-    def get(self) -> App:
+    def read(self) -> App:
         raise NotImplementedError
 
+    def cache_pays(self) -> bool:
+        # load into scratch once, then 1 opcode per read and store, and a
+        # single write back with a load of the slot if the var was written
+        direct = self._reads * self.read_cost + self._writes * self.write_cost
+        cached = self.read_cost + 1 + self._reads + self._writes
+        if self._writes:
+            cached += self.write_cost + 1
+        return cached < direct
+
 
 class LocalState(State):
-    def put(self, value) -> App:
+    read_cost = 3  # int 0, byte, app_local_get
+    write_cost = 3  # int 0, byte, app_local_put
+
+    def write(self, value) -> App:
         return App.localPut(Int(0), Bytes(self._name), value)
 
-    def get(self) -> App:
+    def read(self) -> App:
         return App.localGet(Int(0), Bytes(self._name))
 
 
 class GlobalState(State):
-    def put(self, value) -> App:
+    read_cost = 2  # byte, app_global_get
+    write_cost = 2  # byte, app_global_put
+
+    def write(self, value) -> App:
         return App.globalPut(Bytes(self._name), value)
 
-    def get(self) -> App:
+    def read(self) -> App:
         return App.globalGet(Bytes(self._name))
+
+
+class PackedField(State):
+    """
+    A uint64 stored at a fixed offset of a PackedGlobalState value.
+    """
+
+    def __init__(self, packed: "PackedGlobalState", name: str, index: int):
+        super().__init__(name)
+        self.packed = packed
+        self.start = index * PackedGlobalState.width
+        self.end = self.start + PackedGlobalState.width
+        # byte, app_global_get, int, int, substring3 (and btoi when reading)
+        self.read_cost = 6
+        # byte, itob, app_global_put and a concat with the bytes of the
+        # fields before and after it
+        self.write_cost = 4
+        if self.start > 0:
+            self.write_cost += 6
+        if self.end < packed.size:
+            self.write_cost += 6
+
+    def write(self, value) -> App:
+        return self.packed.put_fields({self._name: value})
+
+    def read(self) -> Expr:
+        return self.unpack(self.packed.read())
+
+    def unpack(self, value: Expr) -> Expr:
+        return Btoi(Substring(value, Int(self.start), Int(self.end)))
+
+
+class PackedGlobalState(GlobalState):
+    """
+    Several uint64 values kept in one fixed-width global bytes value, so
+    they are fetched together both on and off chain.
+    """
+
+    width = 8  # bytes per field
+
+    def __init__(self, name: str, *fields: str):
+        super().__init__(name)
+        self.size = len(fields) * self.width
+        self.fields = {
+            field: PackedField(self, field, index) for index, field in enumerate(fields)
+        }
+
+    def field(self, name: str) -> PackedField:
+        return self.fields[name]
+
+    def put_fields(self, values: dict) -> App:
+        """
+        Writes the fields in ``values``, which maps field names to uint64
+        expressions. The bytes of the other fields are copied over as is.
+        """
+        parts = []
+        kept = None  # start of the current run of kept fields
+        for name, field in self.fields.items():
+            if name not in values:
+                if kept is None:
+                    kept = field.start
+                continue
+            if kept is not None:
+                parts.append(Substring(self.read(), Int(kept), Int(field.start)))
+                kept = None
+            parts.append(Itob(values[name]))
+        if kept is not None:
+            parts.append(Substring(self.read(), Int(kept), Int(self.size)))
+        return self.write(Concat(*parts) if len(parts) > 1 else parts[0])
+
+    def cached_fields(self) -> list:
+        """
+        Fields to keep in scratch, written fields are flushed together so the
+        decision is made for all the accessed fields at once.
+        """
+        accessed = [
+            field for field in self.fields.values() if field._reads or field._writes
+        ]
+        if not any(field._writes for field in accessed):
+            return [field for field in accessed if field.cache_pays()]
+        direct = sum(
+            field._reads * field.read_cost + field._writes * field.write_cost
+            for field in accessed
+        )
+        # byte, app_global_put and a concat between each field
+        cached = 2 + len(self.fields) - 1
+        for field in self.fields.values():
+            if field in accessed:
+                # load once, then a load and itob when flushing
+                cached += field.read_cost + 1 + field._reads + field._writes + 2
+            else:
+                # byte, app_global_get, int, int, substring3
+                cached += 5
+        return accessed if cached < direct else []
+
+    def encode(self, values: dict) -> bytes:
+        return b"".join(
+            values.get(name, 0).to_bytes(self.width, "big") for name in self.fields
+        )
+
+    def decode(self, value) -> dict:
+        """
+        Decodes the value as returned by algod (raw or base64 encoded bytes).
+        """
+        if isinstance(value, str):
+            value = base64.b64decode(value)
+        if len(value) != self.size:
+            raise ValueError(
+                f"Expected {self.size} bytes for {self._name}, got {len(value)}"
+            )
+        return {
+            name: int.from_bytes(value[field.start : field.end], "big")
+            for name, field in self.fields.items()
+        }
+
+
+class StateCache:
+    """
+    Keeps state vars in scratch slots for the duration of a handler.
+
+    The handler is built twice: once to count how often each var is read
+    and written, then again with the vars for which a single load into
+    scratch (and a single write back at the end) is cheaper than accessing
+    the state directly every time.
+    """
+
+    def __init__(self, *states: State):
+        self.states = states
+
+    def wrap(self, build) -> list:
+        """
+        Returns the loads, the ops returned by ``build`` and the write backs.
+        ``build`` must not return from the program, so that the write backs
+        are always reached.
+
+        Caches may be nested, vars kept in scratch by an outer cache are left
+        to it and the accesses counted here are added to its counts.
+        """
+        # Vars already kept in scratch by an outer cache
+        states = [state for state in self.states if state._slot is None]
+        counts = {state: (state._reads, state._writes) for state in states}
+        for state in states:
+            state._reads = state._writes = 0
+        build()
+        cached = [
+            state
+            for state in states
+            if not isinstance(state, PackedField) and state.cache_pays()
+        ]
+        packed = dict.fromkeys(
+            state.packed for state in states if isinstance(state, PackedField)
+        )
+        for state in packed:
+            cached.extend(field for field in state.cached_fields() if field in states)
+
+        slots = {}
+        for state in states:
+            state._reads = state._writes = 0
+        for state in cached:
+            state._slot = slots[state] = ScratchSlot()
+            state._dirty = False
+        try:
+            body = build()
+        finally:
+            for state in cached:
+                state._slot = None
+            for state, (reads, writes) in counts.items():
+                state._reads += reads
+                state._writes += writes
+
+        loads = []
+        packed = {}
+        for state in cached:
+            if isinstance(state, PackedField):
+                # The packed value is read once for all of its fields
+                if state.packed not in packed:
+                    packed[state.packed] = ScratchSlot()
+                    loads.append(packed[state.packed].store(state.packed.read()))
+                value = packed[state.packed].load()
+                loads.append(slots[state].store(state.unpack(value)))
+            else:
+                loads.append(slots[state].store(state.read()))
+
+        write_backs = []
+        flushed = {}
+        for state in cached:
+            if not state._dirty:
+                continue
+            if isinstance(state, PackedField):
+                # Fields sharing a value are written back together
+                flushed.setdefault(state.packed, {})[state._name] = slots[state].load()
+            else:
+                write_backs.append(state.write(slots[state].load()))
+        for state, values in flushed.items():
+            for name, field in state.fields.items():
+                if name not in values and field in slots:
+                    values[name] = slots[field].load()
+            write_backs.append(state.put_fields(values))
+        return loads + body + write_backs
@@ -0,0 +1,168 @@
+"""Escrow programs of any pool without compiling escrow.py again."""
+import base64
+import hashlib
+import json
+import sys
+
+from helpers.parse import parse_args
+
+# Placeholder app_id, as large as an app_id can be
+PLACEHOLDER = 2 ** 64 - 1
+
+
+def encode_varuint(value: int) -> bytes:
+    out = bytearray()
+    while value >= 0x80:
+        out.append(value & 0x7F | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+class EscrowTemplate:
+    """
+    Compiled escrow with a placeholder app_id. ``constants`` are the other
+    int constants of the program, an app_id equal to one of them would be
+    assembled differently.
+    """
+
+    def __init__(
+        self,
+        teal: str,
+        prefix: bytes,
+        suffix: bytes,
+        constants,
+        optimize: bool,
+        settle_swaps: bool = False,
+    ):
+        self.teal_template = teal
+        self.prefix = prefix
+        self.suffix = suffix
+        self.constants = frozenset(constants)
+        self.optimize = optimize
+        self.settle_swaps = settle_swaps
+
+    def _check(self, app_id: int):
+        if not 0 < app_id < PLACEHOLDER:
+            raise ValueError(f"Invalid app_id {app_id}")
+        if app_id in self.constants:
+            raise ValueError(
+                f"App ID {app_id} is also a constant of the escrow, "
+                "compile it with escrow.py"
+            )
+
+    def teal(self, app_id: int) -> str:
+        """
+        The TEAL which escrow.py compiles for the app_id.
+        """
+        self._check(app_id)
+        return self.teal_template.replace(str(PLACEHOLDER), str(app_id))
+
+    def bytecode(self, app_id: int) -> bytes:
+        """
+        The escrow program of the app_id, as assembled by goal.
+        """
+        self._check(app_id)
+        return self.prefix + encode_varuint(app_id) + self.suffix
+
+    def program(self, app_id: int) -> str:
+        """
+        The escrow program in base64, as used to build a LogicSig.
+        """
+        return base64.b64encode(self.bytecode(app_id)).decode()
+
+    def address(self, app_id: int) -> str:
+        """
+        Address of the escrow of the app_id.
+        """
+        digest = hashlib.new("sha512_256", b"Program" + self.bytecode(app_id)).digest()
+        checksum = hashlib.new("sha512_256", digest).digest()[-4:]
+        return base64.b32encode(digest + checksum).decode().rstrip("=")
+
+    def to_dict(self) -> dict:
+        return {
+            "teal": self.teal_template,
+            "prefix": self.prefix.hex(),
+            "suffix": self.suffix.hex(),
+            "constants": sorted(self.constants),
+            "optimize": self.optimize,
+            "settle_swaps": self.settle_swaps,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "EscrowTemplate":
+        return cls(
+            data["teal"],
+            bytes.fromhex(data["prefix"]),
+            bytes.fromhex(data["suffix"]),
+            data["constants"],
+            data["optimize"],
+            data.get("settle_swaps", False),
+        )
+
+    def save(self, path: str):
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+    @classmethod
+    def load(cls, path: str) -> "EscrowTemplate":
+        with open(path) as f:
+            return cls.from_dict(json.load(f))
+
+
+def compile_template(
+    optimize: bool = False, settle_swaps: bool = False
+) -> EscrowTemplate:
+    """
+    Compiles escrow.py with the placeholder app_id into a template, with
+    the settle_swaps option of the pools it is used for.
+    """
+    from escrow import compile_escrow
+    from helpers.interpreter import Program
+
+    teal = compile_escrow(
+        {"app_id": PLACEHOLDER, "settle_swaps": settle_swaps, "optimize": optimize}
+    )
+    program = Program(teal, "Signature")
+    ints = program.constants()[0]
+    if ints.count(PLACEHOLDER) != 1:
+        raise ValueError("Expected the app_id once in the int constant block")
+
+    # version, intcblock opcode, number of constants, then the constants
+    bytecode = program.bytecode()
+    start = len(encode_varuint(program.version)) + 1 + len(encode_varuint(len(ints)))
+    for value in ints[: ints.index(PLACEHOLDER)]:
+        start += len(encode_varuint(value))
+    end = start + len(encode_varuint(PLACEHOLDER))
+    if bytecode[start:end] != encode_varuint(PLACEHOLDER):
+        raise ValueError("The app_id is not where the template expects it")
+    constants = [value for value in ints if value != PLACEHOLDER]
+    return EscrowTemplate(
+        teal, bytecode[:start], bytecode[end:], constants, optimize, settle_swaps
+    )
+
+
+if __name__ == "__main__":
+    params = {
+        "template": None,
+        "settle_swaps": False,
+        "optimize": False,
+        "out": None,
+        "apps": [],
+    }
+
+    # Overwrite params if sys.argv[1] is passed
+    if len(sys.argv) > 1:
+        params = parse_args(sys.argv[1], params)
+
+    if params["template"]:
+        template = EscrowTemplate.load(params["template"])
+    else:
+        template = compile_template(
+            bool(params["optimize"]), bool(params["settle_swaps"])
+        )
+    if params["out"]:
+        template.save(params["out"])
+        print(f"Escrow template written to {params['out']}")
+    for app_id in params["apps"]:
+        print(f"{app_id}: {template.address(int(app_id))}")
@@ -0,0 +1,93 @@
+"""
+Time-weighted average prices of pools built with the twap option.
+
+The contract adds the prices before every call changing the reserves (S, A
+and R), times the seconds since the previous such call, to the global uint64
+sums ``M`` (price of the primary asset in the secondary asset) and ``N``
+(price of the secondary asset in the primary asset), both scaled by
+ratio_decimal_points, and keeps the timestamp of the call in ``T``. The
+average price over any interval is the difference of the sums read at its
+ends divided by its length, so it takes two reads of the global state
+however many swaps happened meanwhile:
+
+    start = price_sums(global_state, 1000000, timestamp)
+    ...
+    end = price_sums(global_state, 1000000, timestamp)
+    twap(start, end, 1000000)  # Twap(a_price=..., b_price=...)
+
+The prices are computed from the 128 bit product without the last term of
+a full division, so that they fit into the program and only fail on prices
+over 2 ** 64. It leaves them a few units low on reserves over
+2 ** 64 / ratio_decimal_points.
+The sums wrap around at 2 ** 64, their differences are exact as long as the
+interval is short enough for the sum to grow by less than that, which takes
+over 500 years at a scaled price of 10 ** 9.
+
+The clear program returns the pending withdrawals of an account to the
+reserves without adding to the sums: it is shared by every variant and must
+not fail, which the price computation could. Until the next S, A or R call
+the time since ``T`` is counted at the reserves left by the clear, off by
+the pending amounts of the accounts which cleared.
+"""
+from collections import namedtuple
+
+from helpers.schema import decode_reserves
+
+UINT64 = 2 ** 64
+
+PriceSums = namedtuple("PriceSums", ["timestamp", "a_price_sum", "b_price_sum"])
+Twap = namedtuple("Twap", ["a_price", "b_price"])
+
+
+def scaled_price(numerator: int, ratio_decimal_points: int, denominator: int):
+    """
+    numerator * ratio_decimal_points / denominator as the contract computes
+    it, without the correction of the low bits when the product exceeds
+    2 ** 64, so never more than its high word + 1 below the exact price.
+    """
+    high, low = divmod(numerator * ratio_decimal_points, UINT64)
+    return high * ((UINT64 - 1) // denominator) + low // denominator
+
+
+def price_sums(global_state: dict, ratio_decimal_points: int, timestamp: int = None):
+    """
+    Price sums of a pool given its global state keyed by name, as of
+    ``timestamp``. The sums stored by the last call are extended with the
+    current prices up to the timestamp, the time of that call by default.
+    """
+    global_state = {
+        key.decode() if isinstance(key, bytes) else key: value
+        for key, value in global_state.items()
+    }
+    last = global_state.get("T", 0)
+    if timestamp is None:
+        timestamp = last
+    if timestamp < last:
+        raise ValueError(f"The pool was updated at {last}, after {timestamp}")
+
+    a_price_sum = global_state.get("M", 0)
+    b_price_sum = global_state.get("N", 0)
+    reserves = decode_reserves(global_state)
+    a_balance, b_balance = reserves["A"], reserves["B"]
+    if a_balance and b_balance:
+        elapsed = timestamp - last
+        a_price = scaled_price(b_balance, ratio_decimal_points, a_balance)
+        b_price = scaled_price(a_balance, ratio_decimal_points, b_balance)
+        a_price_sum = (a_price_sum + a_price * elapsed) % UINT64
+        b_price_sum = (b_price_sum + b_price * elapsed) % UINT64
+    return PriceSums(timestamp, a_price_sum, b_price_sum)
+
+
+def twap(start: PriceSums, end: PriceSums, ratio_decimal_points: int) -> Twap:
+    """
+    Average prices between two reads of the price sums, in units of the
+    other asset.
+    """
+    elapsed = end.timestamp - start.timestamp
+    if elapsed <= 0:
+        raise ValueError("The price sums have to be read at different times")
+    scale = elapsed * ratio_decimal_points
+    return Twap(
+        (end.a_price_sum - start.a_price_sum) % UINT64 / scale,
+        (end.b_price_sum - start.b_price_sum) % UINT64 / scale,
+    )
@@ -0,0 +1,159 @@
+"""
+Multiplication followed by division without overflowing on the intermediate
+product.
+
+TEAL v2 has ``mulw`` for the 128 bit product, but no ``divw`` and no loops
+for a long division. The high word is divided with the help of
+2 ** 64 - 1 = R * c + T instead:
+
+    (high * 2 ** 64 + low) / c
+        = high * R + low / c + (high * (T + 1) + low % c) / c
+
+The result is exact as long as the last term does not overflow, which is
+guaranteed when high < R, that is (high + 1) * c < 2 ** 64. Other inputs
+are rejected by an explicit assertion, so whether a call passes does not
+depend on the remainders. For divisors below 2 ** 32 every result that fits
+into 64 bits is computed, above that a * b * c has to stay below about
+2 ** 128.
+
+A long division covering every divisor, unrolled for lack of loops, takes
+about 100 opcodes per use, which does not fit next to the pool within the
+700 opcodes and 1024 bytes of a TEAL v2 application.
+"""
+from pyteal import *
+
+
+class MulW(Expr):
+    """
+    Stores the high and the low word of the 128 bit product a * b.
+    """
+
+    def __init__(self, a: Expr, b: Expr, high: ScratchSlot, low: ScratchSlot):
+        super().__init__()
+        self.a = a
+        self.b = b
+        self.high = high
+        self.low = low
+
+    def __teal__(self, options):
+        # mulw leaves the low word on top of the high word
+        start, end = TealBlock.FromOp(options, TealOp(self, Op.mulw), self.a, self.b)
+        for slot in (self.low, self.high):
+            store_start, store_end = slot.store().__teal__(options)
+            end.setNextBlock(store_start)
+            end = store_end
+        return start, end
+
+    def __str__(self):
+        return "(mulw {} {})".format(self.a, self.b)
+
+    def type_of(self):
+        return TealType.none
+
+
+def mul_div(a: Expr, b: Expr, c: Expr) -> Expr:
+    """
+    a * b / c, rounded down like the plain expression. Fails unless the high
+    word of a * b is below (2 ** 64 - 1) / c. ``c`` is evaluated several
+    times and should be cheap to read.
+    """
+    high, low, quotient = ScratchSlot(), ScratchSlot(), ScratchSlot()
+    # 2 ** 64 - 1 is pushed as ~0, which saves a 10 byte int constant
+    uint64_max = BitwiseNot(Int(0))
+    return Seq(
+        [
+            MulW(a, b, high, low),
+            quotient.store(uint64_max / c),
+            Assert(high.load(TealType.uint64) < quotient.load(TealType.uint64)),
+            high.load(TealType.uint64) * quotient.load(TealType.uint64)
+            + low.load(TealType.uint64) / c
+            + (
+                high.load(TealType.uint64) * (uint64_max % c + Int(1))
+                + low.load(TealType.uint64) % c
+            )
+            / c,
+        ]
+    )
+
+
+class MulDivDown(Expr):
+    """
+    a * b / c without the last term of mul_div, so at most the high word of
+    a * b + 1 less than the exact result. It only fails when the result does
+    not fit into 64 bits, at a third of the size of mul_div.
+    """
+
+    def __init__(self, a: Expr, b: Expr, c: Expr):
+        super().__init__()
+        self.a = a
+        self.b = b
+        self.c = c
+        self.low = ScratchSlot()
+
+    def __teal__(self, options):
+        # The high word stays on the stack under the low word, which is
+        # stored until the high word is multiplied
+        start, end = TealBlock.FromOp(options, TealOp(self, Op.mulw), self.a, self.b)
+        for expr, op in (
+            (self.low.store(), None),
+            (BitwiseNot(Int(0)) / self.c, Op.mul),
+            (self.low.load() / self.c, Op.add),
+        ):
+            expr_start, expr_end = expr.__teal__(options)
+            end.setNextBlock(expr_start)
+            end = expr_end
+            if op is not None:
+                block = TealSimpleBlock([TealOp(self, op)])
+                end.setNextBlock(block)
+                end = block
+        return start, end
+
+    def __str__(self):
+        return "(muldivdown {} {} {})".format(self.a, self.b, self.c)
+
+    def type_of(self):
+        return TealType.uint64
+
+
+def mul_div_down(a: Expr, b: Expr, c: Expr) -> Expr:
+    return MulDivDown(a, b, c)
+
+
+class WrappingMulAdd(Expr):
+    """
+    a * b + c modulo 2 ** 64, the carries of both words are dropped.
+    """
+
+    def __init__(self, a: Expr, b: Expr, c: Expr):
+        super().__init__()
+        self.a = a
+        self.b = b
+        self.c = c
+        self.low = ScratchSlot()
+
+    def __teal__(self, options):
+        # addw adds c to the low word of mulw, which leaves the high word
+        # and the carry under the result
+        start, end = TealBlock.FromOp(options, TealOp(self, Op.mulw), self.a, self.b)
+        c_start, c_end = self.c.__teal__(options)
+        end.setNextBlock(c_start)
+        addw = TealSimpleBlock([TealOp(self, Op.addw)])
+        c_end.setNextBlock(addw)
+        store_start, store_end = self.low.store().__teal__(options)
+        addw.setNextBlock(store_start)
+        pop = TealSimpleBlock([TealOp(self, Op.pop), TealOp(self, Op.pop)])
+        store_end.setNextBlock(pop)
+        load_start, load_end = self.low.load().__teal__(options)
+        pop.setNextBlock(load_start)
+        return start, load_end
+
+    def __str__(self):
+        return "(wrappingmuladd {} {} {})".format(self.a, self.b, self.c)
+
+    def type_of(self):
+        return TealType.uint64
+
+
+def wrapping_mul_add(a: Expr, b: Expr, c: Expr) -> Expr:
+    # a * b + c modulo 2 ** 64
+    return WrappingMulAdd(a, b, c)
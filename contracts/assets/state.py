@@ -3,8 +3,13 @@ from enum import Enum
 
 from pyteal import *
 
-from helpers.state import GlobalState, LocalState
+from helpers.checks import AssertAll
+from helpers.dispatch import Dispatcher
+from helpers.optimize import optimize
+from helpers.schema import state_var
+from helpers.state import StateCache
 from helpers.parse import parse_args
+from helpers.wide import mul_div, mul_div_down, wrapping_mul_add
 
 
 class ExchangeType:
@@ -13,27 +18,67 @@ class ExchangeType:
 
 
 class AlgosToAsaContract:
-    def __init__(self, ratio_decimal_points: int, fee_pct: int):
+    # Application calls are dispatched in this order, hottest first
+    dispatch_order = ("S", "W", "A", "R", "X", "Y", "E", "U")
+
+    def __init__(
+        self,
+        ratio_decimal_points: int,
+        fee_pct: int,
+        packed_state: bool = False,
+        settle_swaps: bool = False,
+        direct_math: bool = False,
+        wide_math: str = "",
+        fail_fast: bool = False,
+        twap: bool = False,
+        limits: bool = False,
+    ):
+        if set(wide_math) - set("SAR"):
+            raise ValueError("Wide math is only available for S, A and R calls")
+        if wide_math and not direct_math:
+            raise ValueError("Wide math requires direct math")
         self.ratio_decimal_points = ratio_decimal_points
         self.fee_pct = fee_pct
+        self.packed_state = packed_state
+        self.settle_swaps = settle_swaps
+        self.direct_math = direct_math
+        self.wide_math = wide_math
+        self.fail_fast = fail_fast
+        self.twap = twap
+        self.limits = limits
         self.type = type
         self.setup_globals()
         self.setup_locals()
-        self.setup_calculations()
+        # Amounts stored by store_withdrawal until they are credited
+        self.withdrawal = ScratchSlot()
+        self.second_withdrawal = ScratchSlot()
+        # Balance of the deposited asset after a swap, before it is written
+        self.balance_after = ScratchSlot()
 
     def setup_globals(self):
-        self.total_liquidity_tokens = GlobalState("L")  # uint64
-        self.a_balance = GlobalState("A")  # uint64
-        self.b_balance = GlobalState("B")  # uint64
-        self.escrow_addr = GlobalState("E")  # bytes
-        self.creator_addr = GlobalState("C")  # bytes
-        self.b_idx = GlobalState("Y")  # uint64
-        self.liq_idx = GlobalState("Z")  # uint64
+        if self.packed_state:
+            # L, A and B packed into a single 24 byte value
+            self.reserves = state_var("reserves")
+            self.total_liquidity_tokens = self.reserves.field("L")
+            self.a_balance = self.reserves.field("A")
+            self.b_balance = self.reserves.field("B")
+        else:
+            self.total_liquidity_tokens = state_var("total_liquidity_tokens")
+            self.a_balance = state_var("a_balance")
+            self.b_balance = state_var("b_balance")
+        self.escrow_addr = state_var("escrow_addr")
+        self.creator_addr = state_var("creator_addr")
+        self.b_idx = state_var("b_idx")
+        self.liq_idx = state_var("liq_idx")
+        if self.twap:
+            self.price_timestamp = state_var("price_timestamp")
+            self.a_price_sum = state_var("a_price_sum")
+            self.b_price_sum = state_var("b_price_sum")
 
     def setup_locals(self):
-        self.a_to_withdraw = LocalState("1")  # uint64
-        self.b_to_withdraw = LocalState("2")  # uint64
-        self.user_liquidity_tokens = LocalState("3")  # uint64
+        self.a_to_withdraw = state_var("a_to_withdraw")
+        self.b_to_withdraw = state_var("b_to_withdraw")
+        self.user_liquidity_tokens = state_var("user_liquidity_tokens")
 
     def calculate_exchange_rate(self) -> Expr:
         self.exchange_rate = ScratchSlot()
@@ -41,12 +86,14 @@ class AlgosToAsaContract:
             self.a_balance.get() * Int(self.ratio_decimal_points) / self.b_balance.get()
         )
 
-    def get_exchange_rate(self, inline=False) -> Expr:
+    def get_exchange_rate(
+        self, inline=False, a_balance: Expr = None, b_balance: Expr = None
+    ) -> Expr:
         if inline:
             return (
-                self.a_balance.get()
+                (a_balance if a_balance is not None else self.a_balance.get())
                 * Int(self.ratio_decimal_points)
-                / self.b_balance.get()
+                / (b_balance if b_balance is not None else self.b_balance.get())
             )
         return self.exchange_rate.load(TealType.uint64)
 
@@ -64,50 +111,253 @@ class AlgosToAsaContract:
     def calculate_liquidity_calc(self) -> Expr:
         self.liquidity_calc = ScratchSlot()
         return self.liquidity_calc.store(
-            self.get_incoming_amount_for_primary_asset(Gtxn[2])
-            * self.total_liquidity_tokens.get()
-            / self.a_balance.get()
+            self.mul_div(
+                "A",
+                self.get_incoming_amount_for_primary_asset(Gtxn[2]),
+                self.total_liquidity_tokens.get(),
+                self.a_balance.get(),
+            )
         )
 
     def get_liquidity_calc(self) -> Expr:
         return self.liquidity_calc.load(TealType.uint64)
 
-    def setup_calculations(self):
-        self.a_calc = (
-            self.a_balance.get()
-            * Btoi(Txn.application_args[1])
-            / self.total_liquidity_tokens.get()
+    def check_deposit_ratio(self) -> Expr:
+        if "A" in self.wide_math:
+            # Same as below divided by A, 99 * b < 100 * a * B / A < 101 * b,
+            # rounding down only rejects deposits right at the lower bound
+            self.tx_product = ScratchSlot()
+            return Seq(
+                [
+                    self.tx_product.store(
+                        mul_div(
+                            Int(100)
+                            * self.get_incoming_amount_for_primary_asset(Gtxn[2]),
+                            self.b_balance.get(),
+                            self.a_balance.get(),
+                        )
+                    ),
+                    self.assert_all(
+                        Int(99) * Gtxn[1].asset_amount()
+                        < self.tx_product.load(TealType.uint64),
+                        self.tx_product.load(TealType.uint64)
+                        < Int(101) * Gtxn[1].asset_amount(),
+                    ),
+                ]
+            )
+        if self.direct_math:
+            # The deposit ratio a / b may differ from the pool ratio A / B by
+            # less than 1%, that is 99 * A * b < 100 * a * B < 101 * A * b
+            self.pool_product = ScratchSlot()
+            self.tx_product = ScratchSlot()
+            return Seq(
+                [
+                    self.pool_product.store(
+                        self.a_balance.get() * Gtxn[1].asset_amount()
+                    ),
+                    self.tx_product.store(
+                        Int(100)
+                        * self.get_incoming_amount_for_primary_asset(Gtxn[2])
+                        * self.b_balance.get()
+                    ),
+                    self.assert_all(
+                        Int(99) * self.pool_product.load(TealType.uint64)
+                        < self.tx_product.load(TealType.uint64),
+                        self.tx_product.load(TealType.uint64)
+                        < Int(101) * self.pool_product.load(TealType.uint64),
+                    ),
+                ]
+            )
+        return Seq(
+            [
+                self.calculate_exchange_rate(),
+                self.calculate_tx_ratio(),
+                If(
+                    # Check if transactions exchange rate matches or is max 1% different from current
+                    Ge(self.get_exchange_rate(), self.get_tx_ratio()),
+                    Assert(
+                        (self.get_exchange_rate() - self.get_tx_ratio())
+                        * Int(self.ratio_decimal_points)
+                        / self.get_exchange_rate()
+                        < Int(int(0.01 * self.ratio_decimal_points))
+                    ),
+                    Assert(
+                        (self.get_tx_ratio() - self.get_exchange_rate())
+                        * Int(self.ratio_decimal_points)
+                        / self.get_exchange_rate()
+                        < Int(int(0.01 * self.ratio_decimal_points))
+                    ),
+                ),
+            ]
         )
-        self.b_calc = (
-            self.b_balance.get()
-            * Btoi(Txn.application_args[1])
-            / self.total_liquidity_tokens.get()
+
+    def assert_all(self, *conditions: Expr) -> Expr:
+        # Rejecting at the first failing condition costs 2 bytes per
+        # condition, which only fits next to a few other options
+        return AssertAll(*conditions, fail_fast=self.fail_fast)
+
+    def mul_div(self, handler: str, a: Expr, b: Expr, c: Expr) -> Expr:
+        # a * b / c, without overflowing on a * b in handlers with wide math
+        if handler in self.wide_math:
+            return mul_div(a, b, c)
+        return a * b / c
+
+    def accumulate_prices(self) -> list:
+        # Adds the prices before the call, times the seconds since the last
+        # update, to sums which wrap around at 2 ** 64 instead of failing.
+        # Only the difference between two reads of a sum is meaningful.
+        self.elapsed = ScratchSlot()
+        return [
+            self.elapsed.store(Global.latest_timestamp() - self.price_timestamp.get()),
+            If(
+                And(self.a_balance.get(), self.b_balance.get()),
+                Seq(
+                    [
+                        # Price of the primary asset in the secondary asset
+                        self.a_price_sum.put(
+                            self.add_price(
+                                self.a_price_sum, self.b_balance, self.a_balance
+                            )
+                        ),
+                        # Price of the secondary asset, the exchange rate
+                        self.b_price_sum.put(
+                            self.add_price(
+                                self.b_price_sum, self.a_balance, self.b_balance
+                            )
+                        ),
+                    ]
+                ),
+            ),
+            self.price_timestamp.put(Global.latest_timestamp()),
+        ]
+
+    def add_price(self, price_sum, numerator, denominator) -> Expr:
+        return wrapping_mul_add(
+            # Never fails on large reserves, which would lock them
+            mul_div_down(
+                numerator.get(), Int(self.ratio_decimal_points), denominator.get()
+            ),
+            self.elapsed.load(TealType.uint64),
+            price_sum.get(),
+        )
+
+    def check_minimum(self, index: int, amount: Expr) -> list:
+        # The optional argument at ``index`` is the least amount the caller
+        # accepts, so that the call fails instead of a worse fill
+        if not self.limits:
+            return []
+        return [
+            If(
+                Txn.application_args.length() > Int(index),
+                Assert(amount >= Btoi(Txn.application_args[index])),
+            )
+        ]
+
+    def store_withdrawal(
+        self, amount: Expr, minimum: int = None, slot: ScratchSlot = None
+    ) -> list:
+        # Keeps the amount owed to the user, checked against the optional
+        # minimum argument before any state is written
+        slot = slot or self.withdrawal
+        return [
+            slot.store(amount),
+            *(
+                self.check_minimum(minimum, slot.load(TealType.uint64))
+                if minimum is not None
+                else []
+            ),
+        ]
+
+    def credit_withdrawal(
+        self, balance, to_withdraw, slot: ScratchSlot = None
+    ) -> list:
+        # Moves the stored amount from the pool to the pending withdrawals of
+        # the user, which add up until they are paid out by a withdraw call
+        slot = slot or self.withdrawal
+        return [
+            to_withdraw.put(to_withdraw.get() + slot.load(TealType.uint64)),
+            balance.put(balance.get() - slot.load(TealType.uint64)),
+        ]
+
+    def approve(self) -> list:
+        # With packed reserves the handlers fall through to the write back
+        # of the reserves, which approves the call
+        return [] if self.packed_state else [Return(Int(1))]
+
+    def reset_reserves(self) -> list:
+        if self.packed_state:
+            return [self.reserves.put_fields({"L": Int(0), "A": Int(0), "B": Int(0)})]
+        return [
+            self.b_balance.put(Int(0)),
+            self.a_balance.put(Int(0)),
+            self.total_liquidity_tokens.put(Int(0)),
+        ]
+
+    # Built on every use, so that the reads go through an active StateCache
+    def get_a_calc(self) -> Expr:
+        return self.mul_div(
+            "R",
+            self.a_balance.get(),
+            Btoi(Txn.application_args[1]),
+            self.total_liquidity_tokens.get(),
+        )
+
+    def get_b_calc(self) -> Expr:
+        return self.mul_div(
+            "R",
+            self.b_balance.get(),
+            Btoi(Txn.application_args[1]),
+            self.total_liquidity_tokens.get(),
         )
 
     def get_contract(self):
-        return Cond(
-            [Txn.application_id() == Int(0), self.on_create()],
-            [Txn.on_completion() == OnComplete.OptIn, self.on_register()],
-            [
-                Txn.on_completion()
-                == Or(OnComplete.UpdateApplication, OnComplete.DeleteApplication),
-                Return(Int(0)),
-            ],
-            [Txn.on_completion() == OnComplete.CloseOut, self.on_closeout()],
-            [Txn.application_args[0] == Bytes("U"), self.on_update()],
-            [
-                Txn.application_args[0] == Bytes("A"),
-                self.on_add_liquidity(),
-            ],
-            [
-                Txn.application_args[0] == Bytes("R"),
-                self.on_remove_liquidity(),
-            ],
-            [Txn.application_args[0] == Bytes("S"), self.on_swap()],
-            [Txn.application_args[0] == Bytes("W"), self.on_withdraw()],
-            [Txn.application_args[0] == Bytes("E"), self.setup_escrow()],
-            [Txn.application_args[0] == Bytes("X"), self.on_withdraw_liquidity()],
-            [Txn.application_args[0] == Bytes("Y"), self.on_deposit_liquidity()],
+        return self.get_dispatcher().get_expr()
+
+    def get_dispatcher(self) -> Dispatcher:
+        handlers = {
+            "U": self.on_update,
+            "A": self.on_add_liquidity,
+            "R": self.on_remove_liquidity,
+            "S": self.on_swap,
+            "W": self.on_withdraw,
+            "E": self.setup_escrow,
+            "X": self.on_withdraw_liquidity,
+            "Y": self.on_deposit_liquidity,
+        }
+        calls = Dispatcher(
+            # Packed reserves are read once and written back once per call
+            cache=StateCache(*self.reserves.fields.values())
+            if self.packed_state
+            else None,
+            # The calls changing the reserves update the price sums first,
+            # prices are constant between them
+            prelude=self.accumulate_prices if self.twap else None,
+            prelude_keys=("S", "A", "R"),
+        )
+        for key in self.dispatch_order:
+            calls.add(key, handlers[key])
+        return (
+            Dispatcher()
+            .add_condition("create", Txn.application_id() == Int(0), self.on_create())
+            .add_condition("NoOp", Txn.on_completion() == OnComplete.NoOp, calls)
+            .add_condition(
+                "OptIn", Txn.on_completion() == OnComplete.OptIn, self.on_register()
+            )
+            .add_condition(
+                "CloseOut",
+                Txn.on_completion() == OnComplete.CloseOut,
+                self.on_closeout(),
+            )
+            # The escrow address is configured with an update call, any other
+            # update or delete is rejected by falling through the dispatch
+            .add_condition(
+                "UpdateApplication",
+                And(
+                    Txn.on_completion() == OnComplete.UpdateApplication,
+                    Txn.application_args[0] == Bytes("U"),
+                ),
+                self.on_update(),
+            )
         )
 
     def get_incoming_amount_for_primary_asset(self, tx) -> Expr:
@@ -124,9 +374,7 @@ class AlgosToAsaContract:
             [
                 self.b_idx.put(Btoi(Txn.application_args[0])),
                 self.liq_idx.put(Btoi(Txn.application_args[1])),
-                self.b_balance.put(Int(0)),
-                self.a_balance.put(Int(0)),
-                self.total_liquidity_tokens.put(Int(0)),
+                *self.reset_reserves(),
                 self.creator_addr.put(Txn.sender()),
                 Return(Int(1)),
             ]
@@ -144,23 +392,24 @@ class AlgosToAsaContract:
         )
 
     def on_closeout(self):
-        return Assert(
-            And(
-                self.b_to_withdraw.get() == Int(0),
-                self.a_to_withdraw.get() == Int(0),
-                self.user_liquidity_tokens.get() == Int(0),
-            )
+        return Seq(
+            [
+                self.assert_all(
+                    self.b_to_withdraw.get() == Int(0),
+                    self.a_to_withdraw.get() == Int(0),
+                    self.user_liquidity_tokens.get() == Int(0),
+                ),
+                Return(Int(1)),
+            ]
         )
 
     def on_update(self):
         return Seq(
             [
                 # Update escrow address after creating it
-                Assert(
-                    And(
-                        Txn.sender() == self.creator_addr.get(),
-                        self.escrow_addr.get() == Int(0),
-                    )
+                self.assert_all(
+                    Txn.sender() == self.creator_addr.get(),
+                    self.escrow_addr.get() == Int(0),
                 ),
                 self.escrow_addr.put(Txn.accounts[1]),
                 Return(Int(1)),
@@ -170,42 +419,19 @@ class AlgosToAsaContract:
     def on_add_liquidity(self):
         return Seq(
             [
-                Assert(
-                    And(
-                        Global.group_size() == Int(3),
-                        Gtxn[1].type_enum() == TxnType.AssetTransfer,
-                        Gtxn[1].asset_receiver() == self.escrow_addr.get(),
-                        Gtxn[1].xfer_asset() == self.b_idx.get(),
-                        self.validate_incoming_tx_for_primary_asset(Gtxn[2]),
-                    )
+                self.assert_all(
+                    Global.group_size() == Int(3),
+                    Gtxn[1].type_enum() == TxnType.AssetTransfer,
+                    Gtxn[1].asset_receiver() == self.escrow_addr.get(),
+                    Gtxn[1].xfer_asset() == self.b_idx.get(),
+                    self.validate_incoming_tx_for_primary_asset(Gtxn[2]),
                 ),
                 If(
                     And(
                         self.b_balance.get() != Int(0),
                         self.a_balance.get() != Int(0),
                     ),
-                    Seq(
-                        [
-                            self.calculate_exchange_rate(),
-                            self.calculate_tx_ratio(),
-                            If(
-                                # Check if transactions exchange rate matches or is max 1% different from current
-                                Ge(self.get_exchange_rate(), self.get_tx_ratio()),
-                                Assert(
-                                    (self.get_exchange_rate() - self.get_tx_ratio())
-                                    * Int(self.ratio_decimal_points)
-                                    / self.get_exchange_rate()
-                                    < Int(int(0.01 * self.ratio_decimal_points))
-                                ),
-                                Assert(
-                                    (self.get_tx_ratio() - self.get_exchange_rate())
-                                    * Int(self.ratio_decimal_points)
-                                    / self.get_exchange_rate()
-                                    < Int(int(0.01 * self.ratio_decimal_points))
-                                ),
-                            ),
-                        ]
-                    ),
+                    self.check_deposit_ratio(),
                 ),
                 If(
                     # If its first transaction then add tokens directly from txn amount, else based on calculations
@@ -239,46 +465,44 @@ class AlgosToAsaContract:
                     self.a_balance.get()
                     + self.get_incoming_amount_for_primary_asset(Gtxn[2])
                 ),
-                Return(Int(1)),
             ]
+            + self.approve()
         )
 
     def on_remove_liquidity(self):
         return Seq(
             [
-                Assert(
-                    And(
-                        Global.group_size() == Int(1),
-                        self.user_liquidity_tokens.get()
-                        >= Btoi(Txn.application_args[1]),
-                        self.a_to_withdraw.get() == Int(0),
-                        self.b_to_withdraw.get() == Int(0),
-                    )
+                self.assert_all(
+                    Global.group_size() == Int(1),
+                    self.user_liquidity_tokens.get()
+                    >= Btoi(Txn.application_args[1]),
+                ),
+                *self.store_withdrawal(self.get_a_calc(), minimum=2),
+                *self.store_withdrawal(
+                    self.get_b_calc(), minimum=3, slot=self.second_withdrawal
+                ),
+                *self.credit_withdrawal(self.a_balance, self.a_to_withdraw),
+                *self.credit_withdrawal(
+                    self.b_balance, self.b_to_withdraw, slot=self.second_withdrawal
                 ),
-                self.a_to_withdraw.put(self.a_calc),
-                self.b_to_withdraw.put(self.b_calc),
                 self.user_liquidity_tokens.put(
                     self.user_liquidity_tokens.get() - Btoi(Txn.application_args[1])
                 ),
                 self.total_liquidity_tokens.put(
                     self.total_liquidity_tokens.get() - Btoi(Txn.application_args[1])
                 ),
-                self.a_balance.put(self.a_balance.get() - self.a_to_withdraw.get()),
-                self.b_balance.put(self.b_balance.get() - self.b_to_withdraw.get()),
-                Return(Int(1)),
             ]
+            + self.approve()
         )
 
     def on_withdraw_liquidity(self):
         return Seq(
             [
-                Assert(
-                    And(
-                        Gtxn[1].xfer_asset() == self.liq_idx.get(),
-                        self.user_liquidity_tokens.get() >= Gtxn[1].asset_amount(),
-                        Gtxn[1].sender() == self.escrow_addr.get(),
-                        Gtxn[2].receiver() == self.escrow_addr.get(),
-                    )
+                self.assert_all(
+                    Gtxn[1].xfer_asset() == self.liq_idx.get(),
+                    self.user_liquidity_tokens.get() >= Gtxn[1].asset_amount(),
+                    Gtxn[1].sender() == self.escrow_addr.get(),
+                    Gtxn[2].receiver() == self.escrow_addr.get(),
                 ),
                 self.user_liquidity_tokens.put(
                     self.user_liquidity_tokens.get() - Gtxn[1].asset_amount()
@@ -290,14 +514,12 @@ class AlgosToAsaContract:
     def on_deposit_liquidity(self):
         return Seq(
             [
-                Assert(
-                    And(
-                        Global.group_size() == Int(2),
-                        Gtxn[0].type_enum() == TxnType.ApplicationCall,
-                        Gtxn[1].type_enum() == TxnType.AssetTransfer,
-                        Gtxn[1].xfer_asset() == self.liq_idx.get(),
-                        Gtxn[1].asset_receiver() == self.escrow_addr.get(),
-                    )
+                self.assert_all(
+                    Global.group_size() == Int(2),
+                    Gtxn[0].type_enum() == TxnType.ApplicationCall,
+                    Gtxn[1].type_enum() == TxnType.AssetTransfer,
+                    Gtxn[1].xfer_asset() == self.liq_idx.get(),
+                    Gtxn[1].asset_receiver() == self.escrow_addr.get(),
                 ),
                 self.user_liquidity_tokens.put(
                     self.user_liquidity_tokens.get() + Gtxn[1].asset_amount()
@@ -307,92 +529,213 @@ class AlgosToAsaContract:
         )
 
     def on_swap(self):
-        return Seq(
-            [
-                Assert(
+        if self.settle_swaps:
+            return Seq(self.swap_settle_ops() + self.approve())
+        return Seq(self.swap_ops() + self.approve())
+
+    def swap_ops(self) -> list:
+        return [
+            self.assert_all(
+                Global.group_size() == Int(2),
+                Gtxn[0].type_enum() == TxnType.ApplicationCall,
+            ),
+            Cond(
+                [
                     And(
-                        Global.group_size() == Int(2),
-                        Gtxn[0].type_enum() == TxnType.ApplicationCall,
-                        self.a_to_withdraw.get() == Int(0),
-                        self.b_to_withdraw.get() == Int(0),
-                    )
-                ),
-                Cond(
-                    [
-                        And(
-                            Gtxn[1].type_enum() == TxnType.AssetTransfer,
-                            Gtxn[1].xfer_asset() == self.b_idx.get(),
-                        ),
-                        Seq(
-                            [
-                                Assert(
-                                    Gtxn[1].asset_receiver() == self.escrow_addr.get(),
-                                ),
-                                self.b_balance.put(
-                                    self.b_balance.get() + Gtxn[1].asset_amount()
-                                ),
-                                self.a_to_withdraw.put(
-                                    # Same as (exchange_rate * asset_amount * ((100 - fee_pct)/100)) / ratio_decimal_points
-                                    (
-                                        self.get_exchange_rate(inline=True)
-                                        * Gtxn[1].asset_amount()
-                                        * Int(100 - self.fee_pct)
-                                    )
-                                    / Int(self.ratio_decimal_points)
-                                    / Int(100)
-                                ),
-                                self.a_balance.put(
-                                    self.a_balance.get() - self.a_to_withdraw.get()
+                        Gtxn[1].type_enum() == TxnType.AssetTransfer,
+                        Gtxn[1].xfer_asset() == self.b_idx.get(),
+                    ),
+                    Seq(
+                        [
+                            Assert(
+                                Gtxn[1].asset_receiver() == self.escrow_addr.get(),
+                            ),
+                            self.balance_after.store(
+                                self.b_balance.get()
+                                + Gtxn[1].asset_amount()
+                            ),
+                            *self.store_withdrawal(
+                                self.get_primary_out(
+                                    Gtxn[1].asset_amount(),
+                                    self.balance_after.load(TealType.uint64),
                                 ),
-                            ]
-                        ),
-                    ],
-                    [
-                        self.validate_incoming_tx_for_primary_asset(Gtxn[1]),
-                        Seq(
-                            [
-                                self.a_balance.put(
-                                    self.a_balance.get()
-                                    + self.get_incoming_amount_for_primary_asset(
+                                minimum=1,
+                            ),
+                            self.b_balance.put(
+                                self.balance_after.load(TealType.uint64)
+                            ),
+                            *self.credit_withdrawal(
+                                self.a_balance, self.a_to_withdraw
+                            ),
+                        ]
+                    ),
+                ],
+                [
+                    self.validate_incoming_tx_for_primary_asset(Gtxn[1]),
+                    Seq(
+                        [
+                            self.balance_after.store(
+                                self.a_balance.get()
+                                + self.get_incoming_amount_for_primary_asset(
+                                    Gtxn[1]
+                                )
+                            ),
+                            *self.store_withdrawal(
+                                self.get_secondary_out(
+                                    self.get_incoming_amount_for_primary_asset(
                                         Gtxn[1]
-                                    )
+                                    ),
+                                    self.balance_after.load(TealType.uint64),
                                 ),
-                                self.b_to_withdraw.put(
-                                    (
-                                        self.get_incoming_amount_for_primary_asset(
-                                            Gtxn[1]
-                                        )
-                                        * Int(100 - self.fee_pct)
+                                minimum=1,
+                            ),
+                            self.a_balance.put(
+                                self.balance_after.load(TealType.uint64)
+                            ),
+                            *self.credit_withdrawal(
+                                self.b_balance, self.b_to_withdraw
+                            ),
+                        ]
+                    ),
+                ],
+            ),
+        ]
+
+    def get_primary_out(
+        self, secondary_amount: Expr, b_balance: Expr = None
+    ) -> Expr:
+        # ``b_balance`` is the secondary balance after the deposit, if it is
+        # not written yet
+        if b_balance is None:
+            b_balance = self.b_balance.get()
+        if "S" in self.wide_math:
+            # Dividing by 100 afterwards rounds down to the same result
+            return (
+                mul_div(
+                    secondary_amount * Int(100 - self.fee_pct),
+                    self.a_balance.get(),
+                    b_balance,
+                )
+                / Int(100)
+            )
+        if self.direct_math:
+            return (
+                secondary_amount
+                * Int(100 - self.fee_pct)
+                * self.a_balance.get()
+                / (b_balance * Int(100))
+            )
+        # Same as (exchange_rate * asset_amount * ((100 - fee_pct)/100)) / ratio_decimal_points
+        return (
+            self.get_exchange_rate(inline=True, b_balance=b_balance)
+            * secondary_amount
+            * Int(100 - self.fee_pct)
+            / Int(self.ratio_decimal_points)
+            / Int(100)
+        )
+
+    def get_secondary_out(self, primary_amount: Expr, a_balance: Expr = None) -> Expr:
+        # ``a_balance`` is the primary balance after the deposit, if it is not
+        # written yet
+        if a_balance is None:
+            a_balance = self.a_balance.get()
+        if "S" in self.wide_math:
+            return (
+                mul_div(
+                    primary_amount * Int(100 - self.fee_pct),
+                    self.b_balance.get(),
+                    a_balance,
+                )
+                / Int(100)
+            )
+        if self.direct_math:
+            return (
+                primary_amount
+                * Int(100 - self.fee_pct)
+                * self.b_balance.get()
+                / (a_balance * Int(100))
+            )
+        return (
+            primary_amount
+            * Int(100 - self.fee_pct)
+            * Int(self.ratio_decimal_points)
+            / Int(100)
+            / self.get_exchange_rate(inline=True, a_balance=a_balance)
+        )
+
+    def swap_settle_ops(self) -> list:
+        # The swap is paid out by the escrow in the same group, which may pay
+        # out less than the swap is worth but never more. The fee reimbursement
+        # in the last transaction is checked by the escrow.
+        return [
+            Assert(Global.group_size() == Int(4)),
+            Cond(
+                [
+                    And(
+                        Gtxn[1].type_enum() == TxnType.AssetTransfer,
+                        Gtxn[1].xfer_asset() == self.b_idx.get(),
+                    ),
+                    Seq(
+                        [
+                            Assert(
+                                Gtxn[1].asset_receiver() == self.escrow_addr.get(),
+                            ),
+                            self.b_balance.put(
+                                self.b_balance.get() + Gtxn[1].asset_amount()
+                            ),
+                            self.assert_all(
+                                self.verify_outgoing_tx_for_primary_asset(Gtxn[2]),
+                                self.get_outgoing_amount_for_primary_asset(Gtxn[2])
+                                <= self.get_primary_out(Gtxn[1].asset_amount()),
+                            ),
+                            self.a_balance.put(
+                                self.a_balance.get()
+                                - self.get_outgoing_amount_for_primary_asset(Gtxn[2])
+                            ),
+                        ]
+                    ),
+                ],
+                [
+                    self.validate_incoming_tx_for_primary_asset(Gtxn[1]),
+                    Seq(
+                        [
+                            self.a_balance.put(
+                                self.a_balance.get()
+                                + self.get_incoming_amount_for_primary_asset(
+                                    Gtxn[1]
+                                )
+                            ),
+                            self.assert_all(
+                                Gtxn[2].xfer_asset() == self.b_idx.get(),
+                                Gtxn[2].sender() == self.escrow_addr.get(),
+                                Gtxn[2].asset_amount()
+                                <= self.get_secondary_out(
+                                    self.get_incoming_amount_for_primary_asset(
+                                        Gtxn[1]
                                     )
-                                    * Int(self.ratio_decimal_points)
-                                    / Int(100)
-                                    / self.get_exchange_rate(inline=True)
-                                ),
-                                self.b_balance.put(
-                                    self.b_balance.get() - self.b_to_withdraw.get()
                                 ),
-                            ]
-                        ),
-                    ],
-                ),
-                Return(Int(1)),
-            ]
-        )
+                            ),
+                            self.b_balance.put(
+                                self.b_balance.get() - Gtxn[2].asset_amount()
+                            ),
+                        ]
+                    ),
+                ],
+            ),
+        ]
 
     def on_withdraw(self):
         return Seq(
             [
-                Assert(
-                    And(
-                        Global.group_size() == Int(4),
-                        Gtxn[1].asset_amount() == self.b_to_withdraw.get(),
-                        Gtxn[1].sender() == self.escrow_addr.get(),
-                        Gtxn[1].xfer_asset() == self.b_idx.get(),
-                        self.verify_outgoing_tx_for_primary_asset(Gtxn[2]),
-                        self.get_outgoing_amount_for_primary_asset(Gtxn[2])
-                        == self.a_to_withdraw.get(),
-                        Gtxn[3].receiver() == self.escrow_addr.get(),
-                    )
+                self.assert_all(
+                    Global.group_size() == Int(4),
+                    Gtxn[1].asset_amount() == self.b_to_withdraw.get(),
+                    Gtxn[1].sender() == self.escrow_addr.get(),
+                    Gtxn[1].xfer_asset() == self.b_idx.get(),
+                    self.verify_outgoing_tx_for_primary_asset(Gtxn[2]),
+                    self.get_outgoing_amount_for_primary_asset(Gtxn[2])
+                    == self.a_to_withdraw.get(),
+                    Gtxn[3].receiver() == self.escrow_addr.get(),
                 ),
                 self.b_to_withdraw.put(Int(0)),
                 self.a_to_withdraw.put(Int(0)),
@@ -412,11 +755,9 @@ class AlgosToAsaContract:
     def setup_escrow(self):
         return Seq(
             [
-                Assert(
-                    And(
-                        Gtxn[0].sender() == self.creator_addr.get(),
-                        self.escrow_addr.get() == Int(0),
-                    )
+                self.assert_all(
+                    Gtxn[0].sender() == self.creator_addr.get(),
+                    self.escrow_addr.get() == Int(0),
                 ),
                 Return(Int(1)),
             ]
@@ -424,9 +765,9 @@ class AlgosToAsaContract:
 
 
 class AsaToAsaContract(AlgosToAsaContract):
-    def __init__(self, ratio_decimal_points: int, fee_pct: int):
-        super().__init__(ratio_decimal_points, fee_pct)
-        self.a_idx = GlobalState("X")  # uint64
+    def __init__(self, ratio_decimal_points: int, fee_pct: int, **options):
+        super().__init__(ratio_decimal_points, fee_pct, **options)
+        self.a_idx = state_var("a_idx")
 
     def get_incoming_amount_for_primary_asset(self, tx) -> Expr:
         return tx.asset_amount()
@@ -454,43 +795,61 @@ class AsaToAsaContract(AlgosToAsaContract):
                 self.b_idx.put(Btoi(Txn.application_args[0])),
                 self.a_idx.put(Btoi(Txn.application_args[1])),
                 self.liq_idx.put(Btoi(Txn.application_args[2])),
-                self.b_balance.put(Int(0)),
-                self.a_balance.put(Int(0)),
-                self.total_liquidity_tokens.put(Int(0)),
+                *self.reset_reserves(),
                 self.creator_addr.put(Txn.sender()),
                 Return(Int(1)),
             ]
         )
 
 
+DEFAULT_PARAMS = {
+    "ratio_decimal_points": 1000000,
+    "fee_pct": 3,
+    "type": ExchangeType.ALGOS_TO_ASA,
+    "packed_state": False,
+    "settle_swaps": False,
+    "direct_math": False,
+    "wide_math": "",
+    "fail_fast": False,
+    "twap": False,
+    "limits": False,
+    "optimize": False,
+}
+
+
+def build_contract(params: dict) -> AlgosToAsaContract:
+    if params["type"] == ExchangeType.ALGOS_TO_ASA:
+        contract_class = AlgosToAsaContract
+    elif params["type"] == ExchangeType.ASA_TO_ASA:
+        contract_class = AsaToAsaContract
+    else:
+        raise ValueError(f"Unknown contract type {params['type']}")
+    return contract_class(
+        int(params["ratio_decimal_points"]),
+        int(params["fee_pct"]),
+        packed_state=bool(params["packed_state"]),
+        settle_swaps=bool(params["settle_swaps"]),
+        direct_math=bool(params["direct_math"]),
+        wide_math=str(params["wide_math"] or ""),
+        fail_fast=bool(params["fail_fast"]),
+        twap=bool(params["twap"]),
+        limits=bool(params["limits"]),
+    )
+
+
+def compile_state(params: dict, out=None) -> str:
+    teal = compileTeal(build_contract(params).get_contract(), Mode.Application)
+    if params["optimize"]:
+        teal = optimize(teal, out)
+    return teal
+
+
 if __name__ == "__main__":
-    params = {
-        "ratio_decimal_points": 1000000,
-        "fee_pct": 3,
-        "type": ExchangeType.ALGOS_TO_ASA,
-    }
+    params = dict(DEFAULT_PARAMS)
 
     # Overwrite params if sys.argv[1] is passed
     if len(sys.argv) > 1:
         params = parse_args(sys.argv[1], params)
 
-    if params["type"] == ExchangeType.ALGOS_TO_ASA:
-        print(
-            compileTeal(
-                AlgosToAsaContract(
-                    int(params["ratio_decimal_points"]),
-                    int(params["fee_pct"]),
-                ).get_contract(),
-                Mode.Application,
-            )
-        )
-    elif params["type"] == ExchangeType.ASA_TO_ASA:
-        print(
-            compileTeal(
-                AsaToAsaContract(
-                    int(params["ratio_decimal_points"]),
-                    int(params["fee_pct"]),
-                ).get_contract(),
-                Mode.Application,
-            )
-        )
+    # The optimizer reports to stderr, algob reads the program from stdout
+    print(compile_state(params, sys.stderr))
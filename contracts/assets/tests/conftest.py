@@ -0,0 +1,48 @@
+import os
+import sys
+
+import pytest
+
+# The contracts import each other and helpers from the assets directory
+ASSETS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ASSETS_DIR not in sys.path:
+    sys.path.insert(0, ASSETS_DIR)
+
+from helpers.benchmark import SECONDARY, Pool  # noqa: E402
+from state import DEFAULT_PARAMS  # noqa: E402
+
+
+@pytest.fixture
+def make_pool():
+    """
+    Builds a pool from state.py params on an in-process ledger, with the
+    escrow set up and 7000000 primary and 6000000 secondary added by the
+    master account. The swapper is opted in, the idle account is not.
+    """
+
+    def make(app_id=1, **options):
+        pool = Pool(dict(DEFAULT_PARAMS, **options), app_id=app_id)
+        pool.create()
+        pool.run(
+            "E",
+            [
+                pool.call(pool.creator, b"E"),
+                pool.asset(pool.escrow, SECONDARY, 0, pool.escrow),
+            ],
+        )
+        update = pool.call(pool.creator, b"U", on_completion="UpdateApplication")
+        update["Accounts"] = [pool.escrow]
+        pool.run("U", [update])
+        for user in (pool.master, pool.swapper):
+            pool.run("OptIn", [pool.call(user, on_completion="OptIn")])
+        pool.run(
+            "A",
+            [
+                pool.call(pool.master, b"A"),
+                pool.secondary(pool.master, 6000000),
+                pool.primary(pool.master, 7000000),
+            ],
+        )
+        return pool
+
+    return make
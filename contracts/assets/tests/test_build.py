@@ -0,0 +1,20 @@
+from helpers.build import build, default_pool
+from state import ExchangeType, compile_state
+
+
+def pools(fee_pct: int = 3) -> list:
+    return [
+        dict(default_pool(), app_id=1000),
+        dict(default_pool(), type=ExchangeType.ASA_TO_ASA, fee_pct=fee_pct, name="b"),
+    ]
+
+
+def test_unchanged_pools_are_served_from_the_cache(tmp_path):
+    # The states of both pools, the escrow of the first and their shared clear
+    assert build(pools(), str(tmp_path), jobs=1) == {"compiled": 4, "cached": 0}
+    assert build(pools(), str(tmp_path), jobs=1) == {"compiled": 0, "cached": 4}
+
+    changed = pools(fee_pct=2)
+    assert build(changed, str(tmp_path), jobs=1) == {"compiled": 1, "cached": 3}
+    teal = (tmp_path / "b" / "state.teal").read_text()
+    assert teal == compile_state(changed[1]) + "\n"
@@ -0,0 +1,24 @@
+from pyteal import *
+from pyteal.compiler import CompileOptions
+
+from helpers.checks import AssertAll, condition_ops
+
+OPTIONS = CompileOptions(mode=Mode.Application, version=2)
+
+
+def test_branches_count_towards_the_cost():
+    branched = If(Txn.fee() > Int(1), Txn.amount() + Int(1) + Int(2), Int(0))
+    ops = [op.value.value for op, _ in condition_ops(branched, OPTIONS)]
+    # Both branches and the branch itself
+    assert ops.count("int") == 4
+    assert "txn" in ops and "bnz" in ops and ops.count("+") == 2
+
+
+def test_cheaper_condition_is_checked_before_a_branched_one():
+    branched = If(Txn.fee() > Int(1), Txn.amount() + Int(1) + Int(2), Int(0))
+    plain = Txn.fee() + Int(1) == Int(3)
+    teal = compileTeal(
+        Seq([AssertAll(branched, plain), Int(1)]), Mode.Application, version=2
+    )
+    lines = teal.splitlines()
+    assert lines.index("==") < lines.index(">")
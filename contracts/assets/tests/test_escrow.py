@@ -0,0 +1,44 @@
+from helpers.interpreter import TXN_TYPES, evaluate_group
+
+
+def settle_group(pool, payout):
+    return [
+        pool.call(pool.swapper, b"S"),
+        pool.primary(pool.swapper, 1000000),
+        payout,
+        pool.algos(pool.swapper, 1000),
+    ]
+
+
+def test_settled_swap_pays_out_to_the_caller(make_pool):
+    pool = make_pool(settle_swaps=True)
+    results = evaluate_group(
+        settle_group(pool, pool.secondary(pool.escrow, 1, pool.swapper)), pool.ledger
+    )
+    assert results[2].approved
+    assert results[0].approved
+
+
+def test_settled_swap_payout_to_another_account_is_rejected(make_pool):
+    pool = make_pool(settle_swaps=True)
+    results = evaluate_group(
+        settle_group(pool, pool.secondary(pool.escrow, 1, pool.idle)), pool.ledger
+    )
+    assert not results[2].approved
+
+
+def test_settled_swap_payout_of_another_type_is_rejected(make_pool):
+    pool = make_pool(settle_swaps=True)
+    payout = pool.secondary(pool.escrow, 1, pool.swapper)
+    # Any other transaction signed by the escrow, whatever its fields
+    payout["TypeEnum"] = TXN_TYPES["afrz"]
+    results = evaluate_group(settle_group(pool, payout), pool.ledger)
+    assert not results[2].approved
+
+
+def test_escrow_of_other_pools_rejects_swap_groups(make_pool):
+    pool = make_pool()
+    results = evaluate_group(
+        settle_group(pool, pool.secondary(pool.escrow, 1, pool.swapper)), pool.ledger
+    )
+    assert not results[2].approved
@@ -0,0 +1,53 @@
+import os
+import subprocess
+import sys
+
+from helpers.history import COLUMNS, DTYPE, Indexer, ReserveHistory
+from helpers.schema import decode_reserves
+
+PACKED = (7).to_bytes(8, "big") + (5).to_bytes(8, "big") + (3).to_bytes(8, "big")
+
+
+def test_readers_do_not_import_pyteal():
+    code = (
+        "import sys\n"
+        "import helpers.history, helpers.quote_server, helpers.twap\n"
+        "assert 'pyteal' not in sys.modules\n"
+    )
+    cwd = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    subprocess.run([sys.executable, "-c", code], cwd=cwd, check=True)
+
+
+def test_decode_reserves_packed_and_plain():
+    assert decode_reserves({"P": PACKED}) == {"L": 7, "A": 5, "B": 3}
+    assert decode_reserves({"A": 5, "B": 3}) == {"L": 0, "A": 5, "B": 3}
+
+
+def test_indexer_unpacks_reserves(tmp_path):
+    indexer = Indexer([1], str(tmp_path))
+    assert indexer.apply(10, 1, {"P": PACKED})
+    assert not indexer.apply(11, 1, {"P": PACKED})
+    indexer.flush()
+    assert indexer.histories[1].at(12) == {"round": 10, "L": 7, "A": 5, "B": 3}
+
+
+def test_partial_flush_is_dropped_on_open(tmp_path):
+    history = ReserveHistory(str(tmp_path))
+    history.append(1, {"A": 5, "B": 3, "L": 7})
+    history.flush()
+    # A crash after writing the first columns of the next row
+    for name in COLUMNS[:2]:
+        with open(os.path.join(tmp_path, f"{name}.u64"), "ab") as f:
+            f.write(DTYPE.type(2).tobytes())
+
+    history = ReserveHistory(str(tmp_path))
+    assert len(history) == 1
+    assert history.last() == {"round": 1, "A": 5, "B": 3, "L": 7}
+    history.append(2, {"A": 6, "B": 3, "L": 7})
+    history.flush()
+    assert ReserveHistory(str(tmp_path)).at(2) == {
+        "round": 2,
+        "A": 6,
+        "B": 3,
+        "L": 7,
+    }
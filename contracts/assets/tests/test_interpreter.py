@@ -0,0 +1,56 @@
+import pytest
+
+from helpers.interpreter import Ledger, Program, _GroupState
+
+PROGRAMS = {
+    "approved": ("int 1\nint 2\n+\nint 3\n==\nreturn", True, None, 6),
+    "overflow": ("int 0\n~\nint 1\n+\nreturn", False, "+ overflowed", 4),
+    "underflow": ("int 1\n+\nreturn", False, "stack underflow", 2),
+    "types": ('byte "a"\nint 1\n==', False, "== expects arguments of the same type", 3),
+    "err": ("int 1\nbnz l1\nerr\nl1:\nint 0\nbz l2\nerr\nl2:\nint 1", True, None, 5),
+    "gtxn": (
+        "int 1\ngtxn 3 Amount\nint 1\n==",
+        False,
+        "gtxn index 3 out of group",
+        2,
+    ),
+    "call": ("int 1\nbyte 0x0102030405060708090a\nbtoi", False, "btoi arg too long", 3),
+    "state": (
+        'byte "k"\nint 5\napp_global_put\nbyte "k"\napp_global_get\nint 5\n==',
+        True,
+        None,
+        7,
+    ),
+    "scratch": ("int 3\ndup\nstore 1\npop\nload 1\nint 3\n==", True, None, 7),
+    "bytes": ('int 1\nbyte "a"\nreturn', False, "program returned bytes", 3),
+}
+
+
+def evaluate(program: Program, ledger: Ledger):
+    group = [{"TypeEnum": 6, "Sender": bytes(32), "Amount": 1}]
+    return program.evaluate(group, 0, _GroupState(ledger), 1)
+
+
+@pytest.mark.parametrize("name", sorted(PROGRAMS))
+def test_compiled_runs_match_the_ops(name):
+    source, approved, error, opcodes = PROGRAMS[name]
+    program = Program(f"#pragma version 2\n{source}\n")
+    results = []
+    for inline in (True, False):
+        program.blocks = program._blocks(inline)
+        ledger = Ledger()
+        ledger.create_app(program, program, app_id=1)
+        results.append(evaluate(program, ledger))
+    for result in results:
+        assert (result.approved, result.error, result.opcodes) == (
+            approved,
+            error,
+            opcodes,
+        )
+
+
+def test_signature_programs_can_not_read_state():
+    program = Program('#pragma version 2\nbyte "k"\napp_global_get', "Signature")
+    result = program.evaluate([{"TypeEnum": 1}], 0)
+    assert result.error == "state access is not allowed in signature mode"
+    assert result.opcodes == 2
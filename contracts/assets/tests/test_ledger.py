@@ -0,0 +1,80 @@
+import random
+
+import pytest
+
+from helpers.ledger import COLUMNS, PositionLedger
+from helpers.quote import PoolMath, TealArithmeticError
+
+MATH = [PoolMath(1000000, 3), PoolMath(1000000, 3, direct_math=True, wide_math="AR")]
+
+
+def sequential(math, a_balance, b_balance, total, calls):
+    # The calls one after another with the scalar methods
+    outs = []
+    for call in calls:
+        if len(call) == 2:
+            quote = math.add_liquidity(a_balance, b_balance, total, *call)
+            outs.append(quote.minted)
+        else:
+            quote = math.remove_liquidity(a_balance, b_balance, total, *call)
+            outs.append((quote.a_out, quote.b_out))
+        a_balance, b_balance = quote.a_balance, quote.b_balance
+        total = quote.total_liquidity_tokens
+    return outs, (a_balance, b_balance, total)
+
+
+def snapshot(ledger):
+    return (
+        ledger.a_balance,
+        ledger.b_balance,
+        ledger.total_liquidity_tokens,
+        list(ledger.addresses),
+        {name: ledger[name].tolist() for name in COLUMNS},
+    )
+
+
+@pytest.mark.parametrize("math", MATH)
+def test_batches_match_calls_in_order(math):
+    generator = random.Random(7)
+    ledger = PositionLedger(math, capacity=1)
+    deposits = [
+        (a, a * 6 // 7 + generator.randrange(-2, 3))
+        for a in (generator.randrange(10 ** 3, 10 ** 9) for _ in range(50))
+    ]
+    deposits[0] = (7000000, 6000000)
+    minted = ledger.add_liquidity(
+        list(range(50)), *(list(column) for column in zip(*deposits))
+    )
+    expected, reserves = sequential(math, 0, 0, 0, deposits)
+    assert minted.tolist() == expected
+    assert (ledger.a_balance, ledger.b_balance, ledger.total_liquidity_tokens) == (
+        reserves
+    )
+
+    addresses = [generator.randrange(50) for _ in range(40)]
+    amounts = [int(ledger["user_liquidity_tokens"][row]) // 3 for row in addresses]
+    a_out, b_out = ledger.remove_liquidity(addresses, amounts)
+    expected, after = sequential(math, *reserves, [(amount,) for amount in amounts])
+    assert list(zip(a_out.tolist(), b_out.tolist())) == expected
+    assert (ledger.a_balance, ledger.b_balance, ledger.total_liquidity_tokens) == after
+
+
+def test_failed_batches_leave_the_ledger_unchanged():
+    ledger = PositionLedger(MATH[0])
+    ledger.add_liquidity(["a"], [7000000], [6000000])
+    before = snapshot(ledger)
+
+    with pytest.raises(TealArithmeticError, match="Call 1: assert failed: ratio"):
+        ledger.add_liquidity(["b", "c"], [700, 700], [600, 6])
+    with pytest.raises(TealArithmeticError, match="Call 2: assert failed: not enough"):
+        ledger.remove_liquidity(["a", "new", "new"], [1000, 0, 1])
+    with pytest.raises(TealArithmeticError, match="Call 0: / 0"):
+        PositionLedger(MATH[0]).remove_liquidity(["a"], [0])
+    with pytest.raises(TealArithmeticError, match="not enough liquidity tokens"):
+        ledger.withdraw_liquidity(["new", "a"], [0, 7000001])
+    with pytest.raises(TealArithmeticError, match=r"\+ overflowed"):
+        ledger.deposit_liquidity(["new", "a"], [0, 2 ** 64 - 7000000])
+    assert snapshot(ledger) == before
+
+    ledger.withdraw_liquidity(["new", "a"], [0, 7000000])
+    assert ledger.addresses == ["a", "new"]
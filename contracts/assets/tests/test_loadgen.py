@@ -0,0 +1,139 @@
+import pytest
+
+from helpers.benchmark import LIQUIDITY, SECONDARY
+from helpers.interpreter import TXN_TYPES, evaluate_group
+from helpers.loadgen import GroupBuilder, pack, sha512_256
+from state import DEFAULT_PARAMS
+
+signing = pytest.importorskip("nacl.signing")
+
+NETWORK = {
+    "genesis_id": "sandnet-v1",
+    "genesis_hash": "AAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAA=",
+    "first_valid": 1,
+    "last_valid": 1001,
+}
+
+FIELDS = {
+    "snd": "Sender",
+    "fee": "Fee",
+    "fv": "FirstValid",
+    "lv": "LastValid",
+    "note": "Note",
+    "grp": "GroupID",
+    "rcv": "Receiver",
+    "amt": "Amount",
+    "xaid": "XferAsset",
+    "aamt": "AssetAmount",
+    "arcv": "AssetReceiver",
+    "apid": "ApplicationID",
+    "apaa": "ApplicationArgs",
+    "apan": "OnCompletion",
+}
+
+# Sizes of the lengths of bin and str values, and of arrays and maps
+LENGTHS = {0xC4: 1, 0xC5: 2, 0xC6: 4, 0xD9: 1, 0xDA: 2, 0xDC: 2, 0xDE: 2}
+
+
+def unpack(data: bytes, offset: int = 0) -> tuple:
+    # The msgpack types written by pack, and the offset after the value
+    first = data[offset]
+    offset += 1
+    if first < 0x80:
+        return first, offset
+    if 0xCC <= first <= 0xCF:
+        size = 1 << (first - 0xCC)
+        return int.from_bytes(data[offset : offset + size], "big"), offset + size
+    if first in LENGTHS:
+        length = LENGTHS[first]
+        size = int.from_bytes(data[offset : offset + length], "big")
+        offset += length
+    else:
+        size = first & (0x1F if first >= 0xA0 else 0x0F)
+    if first in (0xC4, 0xC5, 0xC6):
+        return data[offset : offset + size], offset + size
+    if first in (0xD9, 0xDA) or 0xA0 <= first < 0xC0:
+        return data[offset : offset + size].decode(), offset + size
+    if first == 0xDC or 0x90 <= first < 0xA0:
+        items = []
+        for _ in range(size):
+            item, offset = unpack(data, offset)
+            items.append(item)
+        return items, offset
+    if first == 0xDE or 0x80 <= first < 0x90:
+        fields = {}
+        for _ in range(size):
+            key, offset = unpack(data, offset)
+            fields[key], offset = unpack(data, offset)
+        return fields, offset
+    raise ValueError(f"Unexpected msgpack type {first:#x}")
+
+
+def decode_group(pool, data: bytes) -> list:
+    """
+    The transactions of a signed group as evaluate_group takes them, after
+    checking their signatures and group ID.
+    """
+    signed_txns = []
+    offset = 0
+    while offset < len(data):
+        signed, offset = unpack(data, offset)
+        signed_txns.append(signed)
+
+    if len(signed_txns) > 1:
+        ids = [
+            sha512_256(b"TX" + pack(dict(signed["txn"], grp=None)))
+            for signed in signed_txns
+        ]
+        group_id = sha512_256(b"TG" + pack({"txlist": ids}))
+        assert all(signed["txn"]["grp"] == group_id for signed in signed_txns)
+
+    group = []
+    for signed in signed_txns:
+        txn = signed["txn"]
+        decoded = {FIELDS[key]: value for key, value in txn.items() if key in FIELDS}
+        decoded["TypeEnum"] = TXN_TYPES[txn["type"]]
+        if "lsig" in signed:
+            assert signed["lsig"] == {"l": pool.lsig.bytecode()}
+            assert txn["snd"] == pool.escrow
+            decoded["LogicSig"] = pool.lsig
+        else:
+            signing.VerifyKey(txn["snd"]).verify(b"TX" + pack(txn), signed["sig"])
+        group.append(decoded)
+    return group
+
+
+def make_builder(pool, amounts: dict) -> GroupBuilder:
+    # A single account, which signs every group
+    assets = {"secondary": SECONDARY, "liquidity": LIQUIDITY}
+    lsig = pool.lsig.bytecode()
+    return GroupBuilder(
+        DEFAULT_PARAMS, pool.app_id, lsig, assets, NETWORK, 1, 0, amounts
+    )
+
+
+def send(pool, data: bytes):
+    results = evaluate_group(decode_group(pool, data), pool.ledger)
+    assert all(result.approved for result in results if result is not None)
+
+
+def test_built_groups_are_approved(make_pool):
+    pool = make_pool()
+    amounts = {"A": [700000, 600000], "S": 10000, "R": 1000}
+    builder = make_builder(pool, amounts)
+    sender = builder.public_keys[0]
+    pool.run("OptIn", [pool.call(sender, on_completion="OptIn")])
+
+    send(pool, builder.group("A", 0))
+    assert pool.local(sender, b"3") == 700000
+    # Swaps of the primary asset, then of the secondary asset
+    send(pool, builder.group("S", 0))
+    send(pool, builder.group("S", 1))
+    send(pool, builder.group("R", 0))
+    assert pool.local(sender, b"3") == 699000
+
+    pending = [pool.local(sender, b"1"), pool.local(sender, b"2")]
+    amounts["W"] = pending
+    builder = make_builder(pool, amounts)
+    send(pool, builder.group("W", 0))
+    assert pool.local(sender, b"1") == pool.local(sender, b"2") == 0
@@ -0,0 +1,92 @@
+import pytest
+
+from helpers.interpreter import Program, evaluate_group
+from helpers.optimize import optimize
+from helpers.schema import decode_reserves
+
+# Variants which fit into the limits without the optimizer
+VARIANTS = {
+    "default": {},
+    "packed_state": {"packed_state": True},
+    "direct_math": {"direct_math": True},
+}
+
+
+def groups(pool):
+    # Accepted and rejected calls of every handler, built once the groups
+    # before them have been evaluated
+    swap = pool.call(pool.swapper, b"S", 1)
+    yield [swap, pool.primary(pool.swapper, 1000000)]
+    yield [swap, pool.secondary(pool.swapper, 1000000)]
+    yield [swap, pool.secondary(pool.idle, 1000000)]
+    state = {
+        key.decode(): value
+        for key, value in pool.ledger.global_state[pool.app_id].items()
+    }
+    reserves = decode_reserves(state)
+    # At the exchange rate of the pool and 2% off it
+    for scale in (100, 102):
+        primary = reserves["A"] * 600000 * scale // (reserves["B"] * 100)
+        yield [
+            pool.call(pool.master, b"A"),
+            pool.secondary(pool.master, 600000),
+            pool.primary(pool.master, primary),
+        ]
+    yield [pool.call(pool.master, b"R", 1000000, 1, 1)]
+    yield [pool.call(pool.master, b"R", 10 ** 12, 1, 1)]
+    yield [
+        pool.call(pool.master, b"W"),
+        pool.secondary(pool.escrow, pool.local(pool.master, b"2"), pool.master),
+        pool.primary(pool.escrow, pool.local(pool.master, b"1"), pool.master),
+        pool.algos(pool.master, 2000),
+    ]
+    yield [pool.call(pool.swapper, b"W")]
+
+
+def outcome(pool) -> list:
+    results = []
+    for group in groups(pool):
+        approved = [
+            result.approved
+            for result in evaluate_group(group, pool.ledger)
+            if result is not None
+        ]
+        state = dict(pool.ledger.global_state[pool.app_id])
+        # The escrow address depends on the escrow program
+        state.pop(b"E")
+        locals_ = [
+            dict(pool.ledger.local_state[(user, pool.app_id)])
+            for user in (pool.master, pool.swapper)
+        ]
+        results.append((approved, state, locals_))
+    return results
+
+
+@pytest.mark.parametrize("name", sorted(VARIANTS))
+def test_optimized_pools_behave_the_same(make_pool, name):
+    plain = make_pool(**VARIANTS[name])
+    optimized = make_pool(**VARIANTS[name], optimize=True)
+    assert optimized.approval.size <= plain.approval.size
+    assert optimized.approval.static_cost <= plain.approval.static_cost
+    assert outcome(optimized) == outcome(plain)
+
+
+PROGRAMS = [
+    "int 2\nint 3\n*\nint 6\n==",
+    "int 0\n~\nint 1\n+\nreturn",
+    "txn Amount\nint 0\n==\nbnz l1\nerr\nl1:\nint 1",
+    "txn Amount\ntxn Amount\n+\nint 0\n!=",
+    "int 1\nbz l1\nint 7\nb l2\nl1:\nint 8\nl2:\nint 7\n==",
+]
+
+
+@pytest.mark.parametrize("source", PROGRAMS)
+def test_optimized_programs_return_the_same(source):
+    plain = Program(f"#pragma version 2\n{source}\n", "Signature")
+    optimized = Program(optimize(plain.source), "Signature")
+    assert optimized.size <= plain.size
+    for amount in (0, 1):
+        group = [{"TypeEnum": 1, "Amount": amount}]
+        expected = plain.evaluate(group, 0)
+        result = optimized.evaluate(group, 0)
+        assert (result.approved, result.error) == (expected.approved, expected.error)
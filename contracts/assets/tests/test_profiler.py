@@ -0,0 +1,30 @@
+from helpers.interpreter import Program, evaluate_group
+from helpers.profiler import Profile, compile_with_origins
+from state import DEFAULT_PARAMS, build_contract, compile_state
+
+
+def test_method_costs_add_up_to_the_metered_cost(make_pool):
+    pool = make_pool()
+    teal, frames = compile_with_origins(build_contract(DEFAULT_PARAMS))
+    assert teal == compile_state(DEFAULT_PARAMS)
+    program = Program(teal)
+    pool.ledger.apps[pool.app_id] = (program, pool.clear)
+
+    for handler, group in (
+        ("on_swap", [pool.call(pool.swapper, b"S"), pool.primary(pool.swapper, 10)]),
+        ("on_remove_liquidity", [pool.call(pool.master, b"R", 1000000)]),
+    ):
+        profile = Profile(program, frames)
+        program.record(profile.counts)
+        result = evaluate_group(group, pool.ledger)[0]
+        program.record(None)
+        assert result.approved
+        stacks = profile.stacks()
+        assert profile.transactions == 1
+        assert sum(cost for cost, _ in stacks.values()) == result.cost
+        assert sum(opcodes for _, opcodes in stacks.values()) == result.opcodes
+        # Only the dispatch is outside of the handler of the call
+        assert {frames[:2] for frames in stacks} == {
+            ("get_contract",),
+            ("get_contract", handler),
+        }
@@ -0,0 +1,105 @@
+import pytest
+
+from helpers.quote import PoolMath
+from state import DEFAULT_PARAMS
+
+OPTIONS = {
+    "default": {},
+    "direct": {"direct_math": True},
+    # Wide math in every handler does not fit into 700 opcodes
+    "wide swaps": {"direct_math": True, "wide_math": "S", "optimize": True},
+    "wide liquidity": {"direct_math": True, "wide_math": "AR", "optimize": True},
+}
+
+
+def reserves(pool) -> tuple:
+    state = pool.ledger.global_state[pool.app_id]
+    return state[b"A"], state[b"B"], state[b"L"]
+
+
+@pytest.mark.parametrize("name", sorted(OPTIONS))
+def test_quotes_match_the_contract(make_pool, name):
+    pool = make_pool(**OPTIONS[name])
+    math = PoolMath.from_params(dict(DEFAULT_PARAMS, **OPTIONS[name]))
+
+    quote = math.add_liquidity(*reserves(pool), 700000, 600000)
+    pool.run(
+        "A",
+        [
+            pool.call(pool.master, b"A"),
+            pool.secondary(pool.master, 600000),
+            pool.primary(pool.master, 700000),
+        ],
+    )
+    assert pool.local(pool.master, b"3") == 7000000 + quote.minted
+    assert reserves(pool) == (
+        quote.a_balance,
+        quote.b_balance,
+        quote.total_liquidity_tokens,
+    )
+
+    a_balance, b_balance, total = reserves(pool)
+    quote = math.swap_primary(a_balance, b_balance, 1000000)
+    pool.run(
+        "S", [pool.call(pool.swapper, b"S", 1), pool.primary(pool.swapper, 1000000)]
+    )
+    assert pool.local(pool.swapper, b"2") == quote.amount_out
+    assert reserves(pool) == (quote.a_balance, quote.b_balance, total)
+
+    a_balance, b_balance, total = reserves(pool)
+    quote = math.swap_secondary(a_balance, b_balance, 1000000)
+    pool.run(
+        "S", [pool.call(pool.swapper, b"S", 1), pool.secondary(pool.swapper, 1000000)]
+    )
+    assert pool.local(pool.swapper, b"1") == quote.amount_out
+    assert reserves(pool) == (quote.a_balance, quote.b_balance, total)
+
+    quote = math.remove_liquidity(*reserves(pool), 1000000)
+    pool.run("R", [pool.call(pool.master, b"R", 1000000, 1, 1)])
+    assert pool.local(pool.master, b"1") == quote.a_out
+    assert pool.local(pool.master, b"2") == quote.b_out
+    assert reserves(pool) == (
+        quote.a_balance,
+        quote.b_balance,
+        quote.total_liquidity_tokens,
+    )
+
+
+@pytest.mark.parametrize("name", sorted(OPTIONS))
+def test_batches_match_the_scalar_methods(name):
+    math = PoolMath.from_params(dict(DEFAULT_PARAMS, **OPTIONS[name]))
+    amounts = [0, 1, 999, 1000000, 2 ** 40, 2 ** 63]
+    for method in ("swap_primary", "swap_secondary"):
+        quote, failed = getattr(math, f"{method}_batch")(7000000, 6000000, amounts)
+        for index, amount in enumerate(amounts):
+            try:
+                expected = getattr(math, method)(7000000, 6000000, amount)
+            except ArithmeticError:
+                assert failed[index]
+            else:
+                assert not failed[index]
+                assert [int(value[index]) for value in quote] == list(expected)
+
+
+# Pools where small deposits fail the ratio check and large ones overflow
+POOLS = [
+    ({}, 1000000000769, 557779),
+    ({"direct_math": True}, 1000000000766, 838962),
+    ({"direct_math": True, "wide_math": "A"}, 7000000, 6000000),
+]
+
+
+@pytest.mark.parametrize("options, a_balance, b_balance", POOLS)
+def test_max_add_liquidity_is_the_largest_deposit(options, a_balance, b_balance):
+    math = PoolMath.from_params(dict(DEFAULT_PARAMS, **options))
+
+    def add_liquidity(amount):
+        return math.add_liquidity(
+            a_balance, b_balance, a_balance, amount, amount * b_balance // a_balance
+        )
+
+    largest = math.max_add_liquidity(a_balance, b_balance, a_balance)
+    add_liquidity(largest)
+    for amount in range(largest + 1, largest + 10000):
+        with pytest.raises(ArithmeticError):
+            add_liquidity(amount)
@@ -0,0 +1,109 @@
+import asyncio
+
+from helpers.interpreter import Ledger
+from helpers.quote_server import LocalAlgod, QuoteServer
+from state import DEFAULT_PARAMS
+
+APP_ID = 1
+
+
+class FlakyAlgod(LocalAlgod):
+    """
+    LocalAlgod failing the first ``failures`` reads of the applications.
+    """
+
+    def __init__(self, ledger, failures: int):
+        super().__init__(ledger)
+        self.failures = failures
+
+    def application(self, app_id: int) -> dict:
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionRefusedError("algod is restarting")
+        return super().application(app_id)
+
+
+class ClosedWriter:
+    def write(self, data):
+        pass
+
+    async def drain(self):
+        raise ConnectionResetError()
+
+
+class SlowWriter:
+    """
+    Writer of a client which never reads, unless ``fast``.
+    """
+
+    def __init__(self, fast: bool):
+        self.fast = fast
+        self.messages = []
+        self.aborted = False
+        self.transport = self
+
+    def write(self, data):
+        self.messages.append(data)
+
+    async def drain(self):
+        if not self.fast:
+            await asyncio.sleep(60)
+
+    def abort(self):
+        self.aborted = True
+
+
+def make_server(algod, **options) -> QuoteServer:
+    algod.ledger.global_state[APP_ID] = {b"L": 7000000, b"A": 7000000, b"B": 6000000}
+    return QuoteServer(algod, {APP_ID: dict(DEFAULT_PARAMS)}, retry_delay=0, **options)
+
+
+def test_poll_retries_after_algod_errors():
+    server = make_server(FlakyAlgod(Ledger(), failures=2))
+
+    async def poll_until_refreshed():
+        task = asyncio.ensure_future(server.poll())
+        while server.round is None:
+            await asyncio.sleep(0.01)
+        task.cancel()
+
+    asyncio.run(asyncio.wait_for(poll_until_refreshed(), 5))
+    assert server.reserves[APP_ID] == {"L": 7000000, "A": 7000000, "B": 6000000}
+
+
+def test_disconnected_subscriber_is_dropped():
+    server = make_server(LocalAlgod(Ledger()))
+    asyncio.run(server.refresh(1))
+    server._subscribers[ClosedWriter()] = {APP_ID}
+    asyncio.run(server.publish(APP_ID))
+    assert server._subscribers == {}
+
+
+def test_slow_subscriber_does_not_hold_up_the_others():
+    server = make_server(LocalAlgod(Ledger()), send_timeout=0.1)
+    asyncio.run(server.refresh(1))
+    slow, fast = SlowWriter(fast=False), SlowWriter(fast=True)
+    server._subscribers[slow] = {APP_ID}
+    server._subscribers[fast] = {APP_ID}
+    asyncio.run(asyncio.wait_for(server.publish(APP_ID), 5))
+    assert len(fast.messages) == 1 and not fast.aborted
+    assert slow.aborted
+    assert server._subscribers == {fast: {APP_ID}}
+
+
+def test_quote_amounts_are_converted():
+    server = make_server(LocalAlgod(Ledger()))
+    asyncio.run(server.refresh(1))
+    request = {
+        "id": 1,
+        "quote": {
+            "app_id": str(APP_ID),
+            "operation": "add_liquidity",
+            "amount": "700000",
+            "b_amount": "600000",
+        },
+    }
+    answer = server._answer(request, None)
+    assert answer["result"] == {"b_amount": 600000, "minted": 700000}
+    request["quote"]["b_amount"] = ["600000"]
+    assert "error" in server._answer(request, None)
@@ -0,0 +1,77 @@
+import pytest
+
+from helpers.benchmark import PRIMARY, SECONDARY
+from helpers.interpreter import evaluate_group
+from helpers.router import ALGO, RoutedPool, Router
+from state import DEFAULT_PARAMS, ExchangeType
+
+TYPES = {False: ExchangeType.ALGOS_TO_ASA, True: ExchangeType.ASA_TO_ASA}
+
+
+@pytest.fixture
+def pools(make_pool):
+    # ALGO/SECONDARY and PRIMARY/SECONDARY, without a direct ALGO/PRIMARY pool
+    return {
+        1: make_pool(),
+        2: make_pool(app_id=2, type=ExchangeType.ASA_TO_ASA),
+    }
+
+
+def router(pools) -> Router:
+    return Router(
+        [
+            RoutedPool.from_state(
+                dict(DEFAULT_PARAMS, type=TYPES[pool.asa]),
+                app_id,
+                pool.escrow,
+                pool.ledger.global_state[app_id],
+                lsig=pool.lsig,
+            )
+            for app_id, pool in pools.items()
+        ]
+    )
+
+
+def send(pools, group) -> list:
+    pool = pools[group[0]["ApplicationID"]]
+    results = evaluate_group(group, pool.ledger)
+    assert all(result.approved for result in results if result is not None)
+    return results
+
+
+def test_two_hop_route_pays_out_the_quoted_amount(pools):
+    route = router(pools).best_route(ALGO, PRIMARY, 1000000)
+    assert [(hop.asset_in, hop.asset_out) for hop in route.hops] == [
+        (ALGO, SECONDARY),
+        (SECONDARY, PRIMARY),
+    ]
+    groups = router(pools).groups(route, pools[1].swapper)
+    for group in groups:
+        send(pools, group)
+    # Each withdrawal pays out what the next hop deposits
+    first, last = groups[1], groups[3]
+    assert first[1]["AssetAmount"] == route.hops[1].amount_in
+    assert last[2]["AssetAmount"] == route.amount_out > 0
+    for pool in pools.values():
+        assert pool.local(pool.swapper, b"1") == pool.local(pool.swapper, b"2") == 0
+
+
+def test_pending_amounts_are_withdrawn_along(pools):
+    pool = pools[1]
+    pool.run(
+        "S", [pool.call(pool.swapper, b"S", 1), pool.secondary(pool.swapper, 100000)]
+    )
+    pending = pool.local(pool.swapper, b"1")
+    assert pending > 0
+
+    route = router(pools).best_route(ALGO, PRIMARY, 1000000)
+    swap, withdraw = router(pools).groups(route, pool.swapper)[:2]
+    send(pools, swap)
+    results = evaluate_group(withdraw, pool.ledger)
+    assert not results[0].approved
+
+    groups = router(pools).groups(route, pool.swapper, pending={1: (pending, 0)})
+    withdraw = groups[1]
+    send(pools, withdraw)
+    assert withdraw[2]["Amount"] == pending
+    assert pool.local(pool.swapper, b"1") == pool.local(pool.swapper, b"2") == 0
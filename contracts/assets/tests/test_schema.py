@@ -0,0 +1,82 @@
+import base64
+
+from helpers.interpreter import encode_address
+from helpers.schema import (
+    LOCAL,
+    decode_global_states,
+    decode_local_states,
+    decode_state,
+)
+
+# Addresses ending in NUL bytes, which a fixed-width string would strip
+ESCROW = bytes(range(1, 29)) + b"\x00" * 4
+CREATOR = b"\x00" * 32
+
+
+def entry(key: str, **value) -> dict:
+    if "bytes" in value:
+        value = {"type": 1, "bytes": base64.b64encode(value["bytes"]).decode()}
+    else:
+        value = {"type": 2, **value}
+    return {"key": base64.b64encode(key.encode()).decode(), "value": value}
+
+
+def test_addresses_keep_trailing_nul_bytes():
+    entries = [entry("E", bytes=ESCROW), entry("C", bytes=CREATOR), entry("A", uint=5)]
+    pools = decode_global_states([{"id": 1, "params": {"global-state": entries}}])
+    assert pools["escrow_addr"][0].tobytes() == ESCROW
+    assert pools["creator_addr"][0].tobytes() == CREATOR
+    assert decode_state(entries)["escrow_addr"] == ESCROW
+
+
+def algod_entries(state: dict) -> list:
+    # A key-value list as algod returns it
+    return [
+        entry(key.decode(), bytes=value)
+        if isinstance(value, bytes)
+        else entry(key.decode(), uint=value)
+        for key, value in state.items()
+    ]
+
+
+def test_contract_state_round_trips(make_pool):
+    decoded = []
+    for packed_state in (False, True):
+        pool = make_pool(packed_state=packed_state)
+        pool.run("R", [pool.call(pool.master, b"R", 1000000, 1, 1)])
+        entries = algod_entries(pool.ledger.global_state[pool.app_id])
+        state = decode_state(entries)
+        assert state["escrow_addr"] == pool.escrow
+        assert state["creator_addr"] == pool.creator
+        application = {"id": pool.app_id, "params": {"global-state": entries}}
+        row = decode_global_states([application])[0]
+        for name, value in state.items():
+            if isinstance(value, bytes):
+                assert row[name].tobytes() == value
+            else:
+                assert row[name] == value
+
+        accounts = [
+            {
+                "address": encode_address(user),
+                "apps-local-state": [
+                    {
+                        "id": pool.app_id,
+                        "key-value": algod_entries(
+                            pool.ledger.local_state[(user, pool.app_id)]
+                        ),
+                    }
+                ],
+            }
+            for user in (pool.master, pool.swapper)
+        ]
+        local_states = decode_local_states(accounts, pool.app_id)
+        assert local_states["address"].tolist() == [
+            encode_address(pool.master),
+            encode_address(pool.swapper),
+        ]
+        master = decode_state(accounts[0]["apps-local-state"][0]["key-value"], LOCAL)
+        assert {name: int(local_states[name][0]) for name in master} == master
+        reserves = ("total_liquidity_tokens", "a_balance", "b_balance")
+        decoded.append([state[name] for name in reserves])
+    assert decoded[0] == decoded[1]
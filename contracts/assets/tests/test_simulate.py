@@ -0,0 +1,75 @@
+import numpy as np
+
+from helpers.quote import PoolMath, TealArithmeticError
+from helpers.simulate import OPERATIONS, simulate_shard
+from state import DEFAULT_PARAMS
+
+# Constant sizes draw nothing from the generator, only the operations do
+FLOW = {
+    "swap_primary": {
+        "weight": 0.3,
+        "size": {"distribution": "constant", "value": 0.02},
+    },
+    "swap_secondary": {
+        "weight": 0.3,
+        "size": {"distribution": "constant", "value": 0.03},
+    },
+    "add_liquidity": {
+        "weight": 0.2,
+        "size": {"distribution": "constant", "value": 0.05},
+        "skew": {"distribution": "constant", "value": 0.003},
+    },
+    "remove_liquidity": {
+        "weight": 0.2,
+        "size": {"distribution": "constant", "value": 0.04},
+    },
+}
+
+
+def replay(math, reserves, steps: int, seed: int) -> tuple:
+    # The trades of a single run, applied one at a time
+    rng = np.random.default_rng(seed)
+    weights = np.array([FLOW[name]["weight"] for name in OPERATIONS])
+    a_balance, b_balance = reserves
+    total = reserves[0]
+    failed = dict.fromkeys(OPERATIONS, 0)
+    for _ in range(steps):
+        name = OPERATIONS[rng.choice(len(OPERATIONS), 1, p=weights / weights.sum())[0]]
+        size = FLOW[name]["size"]["value"]
+        try:
+            if name == "swap_primary":
+                quote = math.swap_primary(a_balance, b_balance, int(size * a_balance))
+            elif name == "swap_secondary":
+                quote = math.swap_secondary(a_balance, b_balance, int(size * b_balance))
+            elif name == "add_liquidity":
+                a_amount = int(size * a_balance)
+                skew = 1 + FLOW[name]["skew"]["value"]
+                b_amount = int(a_amount / a_balance * skew * b_balance)
+                quote = math.add_liquidity(
+                    a_balance, b_balance, total, a_amount, b_amount
+                )
+            else:
+                quote = math.remove_liquidity(
+                    a_balance, b_balance, total, int(size * total)
+                )
+        except TealArithmeticError:
+            failed[name] += 1
+            continue
+        a_balance, b_balance = quote.a_balance, quote.b_balance
+        if not name.startswith("swap"):
+            total = quote.total_liquidity_tokens
+    return (a_balance, b_balance, total), failed
+
+
+def test_seeded_run_matches_its_trades_replayed():
+    math = PoolMath.from_params(DEFAULT_PARAMS)
+    reserves = (7 * 10 ** 9, 6 * 10 ** 9)
+    stats = simulate_shard((DEFAULT_PARAMS, FLOW, reserves, 1, 300, 42))
+    final, failed = replay(math, reserves, 300, 42)
+    assert sum(stats.calls.values()) == 300
+    assert stats.failed == failed
+    assert (
+        stats.metrics["final_a_balance"].maximum,
+        stats.metrics["final_b_balance"].maximum,
+        stats.metrics["final_total_liquidity_tokens"].maximum,
+    ) == final
@@ -0,0 +1,21 @@
+from helpers.interpreter import evaluate_group
+
+
+def global_state(pool) -> dict:
+    return dict(pool.ledger.global_state[pool.app_id])
+
+
+def test_swap_with_a_second_deposit_is_rejected(make_pool):
+    pool = make_pool()
+    before = global_state(pool)
+    results = evaluate_group(
+        [
+            pool.call(pool.swapper, b"S"),
+            pool.primary(pool.swapper, 500000),
+            pool.primary(pool.swapper, 500000),
+        ],
+        pool.ledger,
+    )
+    assert not results[0].approved
+    assert global_state(pool) == before
+    assert pool.local(pool.swapper, b"2") == 0
@@ -0,0 +1,31 @@
+import hashlib
+
+import pytest
+
+from escrow import compile_escrow
+from helpers.interpreter import Program, encode_address
+from helpers.template import EscrowTemplate, compile_template
+
+# Around the sizes of the app_id as a varuint
+APP_IDS = [1000, 127, 128, 14104138, 2 ** 63]
+
+
+@pytest.mark.parametrize("settle_swaps", [False, True])
+def test_addresses_match_the_compiled_escrow(settle_swaps):
+    template = compile_template(settle_swaps=settle_swaps)
+    template = EscrowTemplate.from_dict(template.to_dict())
+    for app_id in APP_IDS:
+        params = {"app_id": app_id, "settle_swaps": settle_swaps, "optimize": False}
+        teal = compile_escrow(params)
+        bytecode = Program(teal, "Signature").bytecode()
+        digest = hashlib.new("sha512_256", b"Program" + bytecode).digest()
+        assert template.teal(app_id) == teal
+        assert template.bytecode(app_id) == bytecode
+        assert template.address(app_id) == encode_address(digest)
+
+
+def test_app_ids_assembled_differently_are_rejected():
+    template = compile_template()
+    for app_id in [0, 2 ** 64 - 1, max(template.constants)]:
+        with pytest.raises(ValueError):
+            template.address(app_id)
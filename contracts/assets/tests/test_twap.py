@@ -0,0 +1,64 @@
+import pytest
+
+from helpers.schema import decode_reserves
+from helpers.twap import price_sums, scaled_price, twap
+
+RATIO = 1000000
+
+
+def state(pool) -> dict:
+    return {
+        key.decode(): value
+        for key, value in pool.ledger.global_state[pool.app_id].items()
+    }
+
+
+def swap(pool, timestamp: int, primary: bool, amount: int):
+    pool.ledger.latest_timestamp = timestamp
+    deposit = pool.primary if primary else pool.secondary
+    pool.run("S", [pool.call(pool.swapper, b"S", 1), deposit(pool.swapper, amount)])
+
+
+def test_twap_is_the_time_weighted_price_of_the_reserves(make_pool):
+    pool = make_pool(twap=True, optimize=True)
+    swap(pool, 1000, True, 1000000)
+    start = price_sums(state(pool), RATIO)
+    assert start.timestamp == 1000
+
+    # The reserves left by each swap, and the seconds until the next one
+    periods = []
+    for timestamp, primary, amount in [
+        (1600, False, 500000),
+        (1750, True, 2000000),
+        (2400, False, 300000),
+    ]:
+        periods.append(
+            (decode_reserves(state(pool)), timestamp - pool.ledger.latest_timestamp)
+        )
+        swap(pool, timestamp, primary, amount)
+    end = price_sums(state(pool), RATIO)
+    assert end.timestamp == 2400
+
+    a_sum = sum(
+        scaled_price(reserves["B"], RATIO, reserves["A"]) * seconds
+        for reserves, seconds in periods
+    )
+    b_sum = sum(
+        scaled_price(reserves["A"], RATIO, reserves["B"]) * seconds
+        for reserves, seconds in periods
+    )
+    assert end.a_price_sum - start.a_price_sum == a_sum
+    assert end.b_price_sum - start.b_price_sum == b_sum
+
+    a_price = sum(r["B"] / r["A"] * seconds for r, seconds in periods) / 1400
+    b_price = sum(r["A"] / r["B"] * seconds for r, seconds in periods) / 1400
+    average = twap(start, end, RATIO)
+    assert average.a_price == pytest.approx(a_price, abs=1 / RATIO)
+    assert average.b_price == pytest.approx(b_price, abs=1 / RATIO)
+
+    # Read later without another call, the last reserves count up to then
+    later = price_sums(state(pool), RATIO, 3000)
+    last = decode_reserves(state(pool))
+    assert later.a_price_sum - end.a_price_sum == 600 * scaled_price(
+        last["B"], RATIO, last["A"]
+    )
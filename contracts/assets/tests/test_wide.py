@@ -0,0 +1,63 @@
+import pytest
+from pyteal import *
+
+from helpers import quote
+from helpers.interpreter import Program
+from helpers.wide import mul_div, mul_div_down, wrapping_mul_add
+
+UINT64_MAX = 2 ** 64 - 1
+
+CASES = [
+    (0, 0, 1),
+    (5, 7, 3),
+    (UINT64_MAX, 1, 1),
+    (UINT64_MAX, UINT64_MAX, UINT64_MAX),
+    (2 ** 32, 2 ** 32, 2 ** 32),
+    (2 ** 63, 4, 8),
+    # Divisors below 2 ** 32 compute every result which fits into 64 bits
+    (UINT64_MAX, 2 ** 32 - 1, 2 ** 32 - 1),
+    (UINT64_MAX, 2 ** 32 - 1, 2 ** 32),
+    (UINT64_MAX, 2 ** 32, 2 ** 32 - 1),
+    # Large divisors need the high word below (2 ** 64 - 1) / c
+    (2 ** 40, 2 ** 40, 2 ** 40),
+    (2 ** 62, 2 ** 62, 2 ** 62),
+    (7000000, 6000000, 0),
+]
+
+
+def run(expr: Expr):
+    teal = compileTeal(Seq([Assert(expr), Int(1)]), Mode.Signature, version=2)
+    return Program(teal, "Signature").evaluate([{"TypeEnum": 1}], 0)
+
+
+@pytest.mark.parametrize("a, b, c", CASES)
+def test_mul_div_matches_the_model(a, b, c):
+    try:
+        expected = quote.mul_div(a, b, c)
+    except quote.TealArithmeticError:
+        assert not run(mul_div(Int(a), Int(b), Int(c)) == Int(0)).approved
+        assert not run(mul_div(Int(a), Int(b), Int(c)) != Int(0)).approved
+    else:
+        assert expected == a * b // c
+        assert run(mul_div(Int(a), Int(b), Int(c)) == Int(expected)).approved
+
+
+@pytest.mark.parametrize("a, b, c", CASES[:-1])
+def test_mul_div_down_is_at_most_the_high_word_short(a, b, c):
+    exact = a * b // c
+    if exact > UINT64_MAX:
+        assert not run(mul_div_down(Int(a), Int(b), Int(c)) >= Int(0)).approved
+        return
+    high = a * b >> 64
+    assert run(
+        And(
+            mul_div_down(Int(a), Int(b), Int(c)) <= Int(exact),
+            mul_div_down(Int(a), Int(b), Int(c)) >= Int(max(exact - high - 1, 0)),
+        )
+    ).approved
+
+
+def test_wrapping_mul_add_drops_the_carries():
+    a, b, c = UINT64_MAX, UINT64_MAX, UINT64_MAX
+    expected = (a * b + c) % 2 ** 64
+    assert run(wrapping_mul_add(Int(a), Int(b), Int(c)) == Int(expected)).approved
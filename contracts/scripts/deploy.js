@@ -13,6 +13,11 @@ const ASA_TO_ASA = 'ASA_TO_ASA';
 const SECONDARY_ASSET_INDEX = 14075549;
 const PRIMARY_ASSET_INDEX = 14098899;
 const CONTRACT_TYPE = ALGOS_TO_ASA;
+// Options of state.py which change the global schema
+const PACKED_STATE = false;
+const TWAP = false;
+// The escrow has to be compiled with the same option as the pool
+const SETTLE_SWAPS = false;
 const PAIR = ['ALGOS', 'USDTG'];
 const LIQUIDITY_TOKEN_NOTE = `Asaswap Liquidity Token for ${PAIR.join('/')}. Make sure to verify its authenticity`;
 const LIQUIDITY_TOKEN_NAME = `${PAIR[0][0]}${PAIR[1][0]}_LIQ`;
@@ -52,9 +57,13 @@ async function run (runtimeEnv, deployer) {
 
   // Create Application
   // Note: An Account can have maximum of 10 Applications.
-  await deployer.ensureCompiled('state.py', true, {
-    type: CONTRACT_TYPE
-  });
+  const stateParams = {
+    type: CONTRACT_TYPE,
+    packed_state: PACKED_STATE,
+    settle_swaps: SETTLE_SWAPS,
+    twap: TWAP
+  };
+  await deployer.ensureCompiled('state.py', true, stateParams);
   const res = await deployer.deploySSC(
     'state.py', // approval program
     'clear.py', // clear program
@@ -62,19 +71,22 @@ async function run (runtimeEnv, deployer) {
       sender: masterAccount,
       localInts: 3,
       localBytes: 0,
-      globalInts: CONTRACT_TYPE === ALGOS_TO_ASA ? 5 : 6,
-      globalBytes: 2,
+      // L, A and B are packed into a single byte value, the price sums
+      // and their timestamp take 3 more ints
+      globalInts: (CONTRACT_TYPE === ALGOS_TO_ASA ? 5 : 6) - (PACKED_STATE ? 3 : 0) + (TWAP ? 3 : 0),
+      globalBytes: PACKED_STATE ? 3 : 2,
       appArgs: appArgs
     },
     {},
-    {
-      type: CONTRACT_TYPE
-    }
+    stateParams
   );
   const applicationID = res.appID;
 
   // Get escrow account address
-  const escrowAccount = await deployer.loadLogic('escrow.py', [], { app_id: applicationID });
+  const escrowAccount = await deployer.loadLogic('escrow.py', [], {
+    app_id: applicationID,
+    settle_swaps: SETTLE_SWAPS
+  });
   console.log('Escrow Account Address:', escrowAccount.address());
 
   // Send funds for minimum escrow balance
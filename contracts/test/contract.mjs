@@ -413,5 +413,35 @@ const { assert } = chai;
       // Withdraw primary asset
       asaswap.withdraw(master, 1237145, 0);
     });
+
+    it('successfully accumulates pending withdrawals over several swaps', () => {
+      asaswap.setupApplicationWithEscrow(master);
+      asaswap.optIn(master.address);
+      asaswap.addLiquidity(master.account, asaswap.getEscrowAddress(), 7000000, 6000000);
+
+      asaswap.optIn(swapper.address);
+      asaswap.primaryAssetSwap(swapper.account, asaswap.getEscrowAddress(), 1000000);
+      asaswap.primaryAssetSwap(swapper.account, asaswap.getEscrowAddress(), 1000000);
+
+      assert.equal(getGlobal(GLOBAL_A_BAL), 9000000);
+      assert.equal(getGlobal(GLOBAL_B_BAL), 4704242);
+      assert.equal(getLocal(swapper.address, USR_A_BAL), 0);
+      assert.equal(getLocal(swapper.address, USR_B_BAL), 727500 + 568258);
+
+      asaswap.secondaryAssetSwap(swapper.account, asaswap.getEscrowAddress(), 500000);
+
+      assert.equal(getGlobal(GLOBAL_A_BAL), 8161262);
+      assert.equal(getGlobal(GLOBAL_B_BAL), 5204242);
+      assert.equal(getLocal(swapper.address, USR_A_BAL), 838738);
+      assert.equal(getLocal(swapper.address, USR_B_BAL), 1295758);
+
+      expectTealError(
+        () => asaswap.withdraw(swapper, 838738, 568258),
+        RUNTIME_ERRORS.TEAL.TEAL_ENCOUNTERED_ERR
+      );
+      asaswap.withdraw(swapper, 838738, 1295758);
+      assert.equal(getLocal(swapper.address, USR_A_BAL), 0);
+      assert.equal(getLocal(swapper.address, USR_B_BAL), 0);
+    });
   });
 });